@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmark of reduced precision parameter storage for inference.
+
+For ``Mlp``, ``Lenet`` and ``SupervisedRnn``, print the size of the stored
+parameters, the latency of ``predict`` and the largest deviation from the
+full precision predictions for float32/64, float16 and int8 parameters.
+
+Run as ``python benchmarks/quantization.py``.
+"""
+
+
+import time
+
+import climin.initialize
+import numpy as np
+import theano
+
+from breze.learn.cnn import Lenet
+from breze.learn.mlp import Mlp
+from breze.learn.rnn import SupervisedRnn
+
+
+def make_mlp():
+    model = Mlp(784, [1024, 1024], 10, ['tanh', 'tanh'], 'softmax', 'cat_ce')
+    X = np.random.standard_normal((256, 784))
+    return model, X
+
+
+def make_lenet():
+    batch_size = 64
+    model = Lenet(28, 28, 1, [32, 64], [(5, 5), (5, 5)], [(2, 2), (2, 2)],
+                  [512], 10, ['tanh', 'tanh'], ['rectifier'], 'softmax', 'cat_ce',
+                  batch_size=batch_size)
+    X = np.random.standard_normal((batch_size, 1, 28, 28))
+    return model, X
+
+
+def make_rnn():
+    model = SupervisedRnn(64, [512], 10, hidden_transfers=['tanh'])
+    X = np.random.standard_normal((50, 32, 64))
+    return model, X
+
+
+def stored_bytes(parameters):
+    if parameters.quantized is not None:
+        return parameters.quantized.nbytes + parameters.scales.nbytes
+    return parameters.data.nbytes
+
+
+def time_predict(model, X, n_repeats):
+    model.predict(X)
+    start = time.time()
+    for _ in range(n_repeats):
+        model.predict(X)
+    return (time.time() - start) / n_repeats
+
+
+def benchmark(name, make, n_repeats=10):
+    model, X = make()
+    X = X.astype(theano.config.floatX)
+    climin.initialize.randomize_normal(model.parameters.data, 0, 0.01)
+    Y = model.predict(X)
+
+    for dtype in [None, 'float16', 'int8']:
+        if dtype is not None:
+            model.quantize(dtype)
+        latency = time_predict(model, X, n_repeats)
+        error = abs(model.predict(X) - Y).max()
+        print '%-14s %-8s %10.2f MB %10.2f ms %12.2e' % (
+            name, dtype or theano.config.floatX,
+            stored_bytes(model.parameters) / 2. ** 20, latency * 1000, error)
+        if dtype is not None:
+            model.dequantize()
+
+
+def main():
+    print '%-14s %-8s %13s %13s %12s' % (
+        'model', 'storage', 'parameters', 'latency', 'max error')
+    for name, make in [('Mlp', make_mlp), ('Lenet', make_lenet),
+                       ('SupervisedRnn', make_rnn)]:
+        benchmark(name, make)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,547 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmark suite for the learners of ``breze.learn`` and the losses of
+``breze.arch.component.loss``.
+
+For each case, the following is measured on synthetic data:
+
+  - ``compile_time``: seconds spent compiling the functions needed for
+    training, i.e. the loss and its gradient,
+  - ``first_call``: seconds of the first evaluation of the gradient,
+  - ``throughput``: samples per second of evaluating the gradient, once
+    warmed up,
+  - ``peak_memory``: increase of the peak resident set size of the process
+    over the course of the case, in bytes.
+
+Learners without compiled functions (``GainShapeKMeans``, ``Pca``, ``Zca``)
+are measured fitting and transforming the data instead; their compile time is
+zero.
+
+The ``estimate_nll`` cases measure the estimation of the negative
+log-likelihood of the variational models, with samples per second counting
+data points. They also measure ``breze.learn.sgvb.base.estimate_nll``, which
+draws one importance sample per call of four separate functions, reported as
+``legacy_throughput``, and the ratio of both as ``speedup``.
+
+Each case runs in a process of its own, so that the peak memory of one case
+does not hide that of another. Theano keeps compiled C code in its compile
+directory, so compile times are those with a warm cache from the second run
+on.
+
+Run as::
+
+    python benchmarks/suite.py --out results.json
+    python benchmarks/suite.py --baseline results.json --out new.json
+
+The latter compares against the stored results and exits with status 1 if a
+case is slower or needs more memory than the baseline by more than the
+tolerance. With ``--quick``, small problem sizes are used. Cases can be
+selected by giving their names.
+"""
+
+
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+import traceback
+
+import numpy as np
+import theano
+import theano.tensor as T
+
+from breze.arch.component import loss as loss_
+from breze.learn import sgvb
+from breze.learn.sgvb.base import estimate_nll, estimate_nll_batched
+from breze.learn.cnn import Lenet
+from breze.learn.kmeans import GainShapeKMeans
+from breze.learn.mlp import Mlp, FastDropoutNetwork
+from breze.learn.pca import Pca, Zca
+from breze.learn.rnn import SupervisedRnn, SupervisedFastDropoutRnn
+
+
+# Data generators. All of them are deterministic given the seed.
+
+def synthetic_classification(n_samples, n_inpt, n_output, seed=0):
+    """Return inputs and one-of-k targets of a random linear classifier."""
+    rng = np.random.RandomState(seed)
+    X = rng.standard_normal((n_samples, n_inpt))
+    W = rng.standard_normal((n_inpt, n_output))
+    Z = np.eye(n_output)[(X.dot(W)).argmax(axis=1)]
+    return X.astype(theano.config.floatX), Z.astype(theano.config.floatX)
+
+
+def synthetic_regression(n_samples, n_inpt, n_output, seed=0):
+    """Return inputs and noisy targets of a random linear map."""
+    rng = np.random.RandomState(seed)
+    X = rng.standard_normal((n_samples, n_inpt))
+    Z = X.dot(rng.standard_normal((n_inpt, n_output)))
+    Z += rng.standard_normal(Z.shape) * 0.1
+    return X.astype(theano.config.floatX), Z.astype(theano.config.floatX)
+
+
+def synthetic_sequences(n_timesteps, n_samples, n_inpt, n_output, seed=0):
+    """Return input and target sequences of shape ``(n_timesteps,
+    n_samples, n)``, where targets are a linear map of a moving average of
+    the inputs."""
+    rng = np.random.RandomState(seed)
+    X = rng.standard_normal((n_timesteps, n_samples, n_inpt))
+    avg = np.cumsum(X, axis=0) / np.arange(1, n_timesteps + 1)[:, None, None]
+    Z = avg.dot(rng.standard_normal((n_inpt, n_output)))
+    return X.astype(theano.config.floatX), Z.astype(theano.config.floatX)
+
+
+def synthetic_images(n_samples, height, width, n_output, seed=0):
+    """Return images of random blobs and one-of-k targets."""
+    rng = np.random.RandomState(seed)
+    X = rng.standard_normal((n_samples, 1, height, width))
+    Z = np.eye(n_output)[rng.randint(0, n_output, n_samples)]
+    return X.astype(theano.config.floatX), Z.astype(theano.config.floatX)
+
+
+def synthetic_binary(n_samples, n_inpt, seed=0):
+    """Return binary vectors with correlated coordinates."""
+    rng = np.random.RandomState(seed)
+    latent = rng.standard_normal((n_samples, 4))
+    X = latent.dot(rng.standard_normal((4, n_inpt))) > 0
+    return X.astype(theano.config.floatX)
+
+
+# Cases.
+
+def fd_squared(target, prediction):
+    return loss_.squared(target, prediction[:, :target.shape[1]])
+
+
+class StornCase(sgvb.StochasticRnn,
+                sgvb.GaussLatentStornMixin,
+                sgvb.GaussVisibleStornMixin):
+    pass
+
+
+class VaeCase(sgvb.VariationalAutoEncoder,
+              sgvb.MlpGaussLatentVAEMixin,
+              sgvb.MlpBernoulliVisibleVAEMixin):
+    pass
+
+
+def init_parameters(model):
+    rng = np.random.RandomState(1)
+    model.parameters.data[...] = rng.standard_normal(
+        model.parameters.data.shape) * 0.01
+
+
+def learner_cases(scale):
+    """Return a dictionary mapping names to functions returning a model and
+    the arguments of its loss."""
+    n = 64 * scale
+
+    def mlp():
+        X, Z = synthetic_classification(n, 784, 10)
+        return Mlp(784, [512, 512], 10, ['tanh', 'tanh'], 'softmax',
+                   'cat_ce'), (X, Z)
+
+    def fd_mlp():
+        X, Z = synthetic_regression(n, 784, 10)
+        return FastDropoutNetwork(784, [512, 512], 10,
+                                  ['rectifier', 'rectifier'], 'identity',
+                                  fd_squared), (X, Z)
+
+    def rnn():
+        X, Z = synthetic_sequences(50, n // 4, 32, 8)
+        return SupervisedRnn(32, [128], 8, hidden_transfers=['tanh']), (X, Z)
+
+    def lstm():
+        X, Z = synthetic_sequences(50, n // 4, 32, 8)
+        return SupervisedRnn(32, [128], 8, hidden_transfers=['lstm']), (X, Z)
+
+    def fd_rnn():
+        X, Z = synthetic_sequences(50, n // 4, 32, 8)
+        return SupervisedFastDropoutRnn(32, [128], 8,
+                                        hidden_transfers=['rectifier']), (X, Z)
+
+    def lenet():
+        X, Z = synthetic_images(n, 28, 28, 10)
+        return Lenet(28, 28, 1, [16, 32], [(5, 5), (5, 5)], [(2, 2), (2, 2)],
+                     [256], 10, ['tanh', 'tanh'], ['rectifier'], 'softmax',
+                     'cat_ce', batch_size=n), (X, Z)
+
+    def vae():
+        X = synthetic_binary(n, 784)
+        return VaeCase(784, [256], 16, [256], ['tanh'], ['tanh'],
+                       optimizer='adam'), (X,)
+
+    def storn():
+        X, _ = synthetic_sequences(50, n // 4, 16, 1)
+        return StornCase(16, [64], 8, [64], ['tanh'], ['tanh'],
+                         optimizer='adam'), (X,)
+
+    return {
+        'Mlp': mlp,
+        'FastDropoutNetwork': fd_mlp,
+        'SupervisedRnn': rnn,
+        'SupervisedRnn-lstm': lstm,
+        'SupervisedFastDropoutRnn': fd_rnn,
+        'Lenet': lenet,
+        'VariationalAutoEncoder': vae,
+        'StochasticRnn': storn,
+    }
+
+
+def estimate_nll_cases(scale):
+    """Return a dictionary mapping names to functions returning a model,
+    the data to estimate the likelihood of and the number of importance
+    samples."""
+    n = 64 * scale
+
+    def vae():
+        X = synthetic_binary(n, 784)
+        return VaeCase(784, [256], 16, [256], ['tanh'], ['tanh']), X, 100
+
+    def storn():
+        X, _ = synthetic_sequences(50, n // 4, 16, 1)
+        return StornCase(16, [64], 8, [64], ['tanh'], ['tanh']), X, 100
+
+    return {
+        'estimate_nll.VariationalAutoEncoder': vae,
+        'estimate_nll.StochasticRnn': storn,
+    }
+
+
+def legacy_estimate_nll(model):
+    """Return a function ``f(X, n_samples)`` estimating the negative
+    log-likelihood of ``X`` with ``estimate_nll``, i.e. one importance sample
+    of all of ``X`` per call of four separate functions."""
+    ndim = model.vae.recog_sample.ndim
+    latent_sample = T.tensor3('sample') if ndim == 3 else T.matrix('sample')
+
+    nll_z = model.vae.prior.nll(latent_sample).sum(axis=ndim - 1)
+    nll_z = theano.clone(nll_z, {model.recog_sample: latent_sample})
+    f_nll_z = model.function([latent_sample], nll_z,
+                             on_unused_input='ignore')
+    nll_x_given_z = model.vae.gen.nll(model.inpt).sum(axis=ndim - 1)
+    f_nll_x_given_z = model.function(
+        [model.inpt, latent_sample], nll_x_given_z,
+        givens={model.vae.recog_sample: latent_sample})
+    nll_z_given_x = model.vae.recog.nll(latent_sample).sum(axis=ndim - 1)
+    f_nll_z_given_x = model.function(
+        [latent_sample, model.inpt], nll_z_given_x)
+    f_sample_z_given_x = model.function([model.inpt], model.vae.recog_sample)
+
+    def f(X, n_samples):
+        return estimate_nll(X, f_nll_z, f_nll_x_given_z, f_nll_z_given_x,
+                            f_sample_z_given_x, n_samples)
+    return f
+
+
+def numpy_cases(scale):
+    """Return a dictionary mapping names to functions returning a callable
+    and the data it is applied to."""
+    n = 256 * scale
+
+    def kmeans():
+        X, _ = synthetic_regression(n, 64, 1)
+
+        def run(X):
+            m = GainShapeKMeans(32, max_iter=5,
+                                random_state=np.random.RandomState(0))
+            m.fit(X)
+            return m.transform(X, 'identity')
+        return run, X
+
+    def pca():
+        X, _ = synthetic_regression(n, 256, 1)
+
+        def run(X):
+            m = Pca(32, whiten=True)
+            m.fit(X)
+            return m.transform(X)
+        return run, X
+
+    def zca():
+        X, _ = synthetic_regression(n, 256, 1)
+
+        def run(X):
+            m = Zca()
+            m.fit(X)
+            return m.transform(X)
+        return run, X
+
+    return {
+        'GainShapeKMeans': kmeans,
+        'Pca': pca,
+        'Zca': zca,
+    }
+
+
+# Losses taking targets of the same shape as the predictions; the
+# predictions are squashed into the range the loss expects.
+losses = {
+    'squared': (loss_.squared, lambda p: p),
+    'absolute': (loss_.absolute, lambda p: p),
+    'cat_ce': (loss_.cat_ce, T.nnet.softmax),
+    'ncat_ce': (loss_.ncat_ce, lambda p: p),
+    'bern_ces': (loss_.bern_ces, T.nnet.sigmoid),
+    'bern_bern_kl': (loss_.bern_bern_kl, T.nnet.sigmoid),
+    'fmeasure': (loss_.fmeasure, T.nnet.sigmoid),
+}
+
+
+def loss_cases(scale):
+    n = 1024 * scale
+
+    def make(name):
+        f_loss, squash = losses[name]
+
+        def case():
+            X, Z = synthetic_classification(n, 100, 100)
+            if name == 'ncat_ce':
+                Z = Z.argmax(axis=1).astype('int32')
+                target = T.ivector()
+            else:
+                target = T.matrix()
+            inpt = T.matrix()
+            loss = f_loss(target, squash(inpt)).mean()
+            return (inpt, target), T.grad(loss, inpt), (X, Z)
+        return case
+
+    return dict(('loss.%s' % i, make(i)) for i in losses)
+
+
+# Measurement.
+
+def max_rss():
+    """Return the peak resident set size of this process in bytes."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def time_steady(f, n_samples, min_time):
+    """Return samples per second of calling ``f`` repeatedly for at least
+    ``min_time`` seconds."""
+    n_calls = 0
+    start = time.time()
+    while True:
+        f()
+        n_calls += 1
+        elapsed = time.time() - start
+        if elapsed >= min_time:
+            return n_calls * n_samples / elapsed
+
+
+def measure_learner(make, min_time):
+    model, args = make()
+    init_parameters(model)
+    start = time.time()
+    _, f_d_loss = model._make_loss_functions()
+    compile_time = time.time() - start
+
+    pars = model.parameters.data
+    start = time.time()
+    f_d_loss(pars, *args)
+    first_call = time.time() - start
+
+    n_samples = args[0].shape[model.sample_dim[0]]
+    throughput = time_steady(lambda: f_d_loss(pars, *args), n_samples,
+                             min_time)
+    return compile_time, first_call, throughput
+
+
+def measure_estimate_nll(make, min_time):
+    model, X, n_samples = make()
+    init_parameters(model)
+    start = time.time()
+    f_log_weights = model._make_f_estimate_nll()
+    compile_time = time.time() - start
+
+    sample_axis = 1 if X.ndim == 3 else 0
+
+    def run():
+        return estimate_nll_batched(X, f_log_weights, n_samples,
+                                    sample_axis=sample_axis)
+
+    start = time.time()
+    run()
+    first_call = time.time() - start
+    n_points = X.shape[sample_axis]
+    throughput = time_steady(run, n_points, min_time)
+
+    f_legacy = legacy_estimate_nll(model)
+    f_legacy(X, 1)
+    legacy_throughput = time_steady(lambda: f_legacy(X, n_samples), n_points,
+                                    min_time)
+    return compile_time, first_call, throughput, {
+        'legacy_throughput': legacy_throughput,
+        'speedup': throughput / legacy_throughput,
+    }
+
+
+def measure_numpy(make, min_time):
+    run, X = make()
+    start = time.time()
+    run(X)
+    first_call = time.time() - start
+    return 0., first_call, time_steady(lambda: run(X), X.shape[0], min_time)
+
+
+def measure_loss(make, min_time):
+    inpts, grad, args = make()
+    start = time.time()
+    f = theano.function(list(inpts), grad)
+    compile_time = time.time() - start
+
+    start = time.time()
+    f(*args)
+    first_call = time.time() - start
+    return (compile_time, first_call,
+            time_steady(lambda: f(*args), args[0].shape[0], min_time))
+
+
+def _run_case(conn, measure, make, min_time):
+    try:
+        rss_before = max_rss()
+        res = measure(make, min_time)
+        compile_time, first_call, throughput = res[:3]
+        result = {
+            'compile_time': compile_time,
+            'first_call': first_call,
+            'throughput': throughput,
+            'peak_memory': max_rss() - rss_before,
+        }
+        # Further results particular to a kind of case.
+        if len(res) > 3:
+            result.update(res[3])
+        conn.send(result)
+    except Exception:
+        conn.send({'error': traceback.format_exc()})
+
+
+def run_case(measure, make, min_time):
+    """Run a case in a process of its own and return its results."""
+    conn, child_conn = multiprocessing.Pipe()
+    p = multiprocessing.Process(target=_run_case,
+                                args=(child_conn, measure, make, min_time))
+    p.start()
+    result = conn.recv()
+    p.join()
+    return result
+
+
+def all_cases(scale):
+    cases = {}
+    for name, make in learner_cases(scale).items():
+        cases[name] = measure_learner, make
+    for name, make in estimate_nll_cases(scale).items():
+        cases[name] = measure_estimate_nll, make
+    for name, make in numpy_cases(scale).items():
+        cases[name] = measure_numpy, make
+    for name, make in loss_cases(scale).items():
+        cases[name] = measure_loss, make
+    return cases
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'theano': theano.__version__,
+        'floatX': theano.config.floatX,
+        'device': theano.config.device,
+        'machine': platform.machine(),
+        'node': platform.node(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+# Comparison with a baseline.
+
+# For each metric, whether larger values are better.
+metrics = {
+    'compile_time': False,
+    'first_call': False,
+    'throughput': True,
+    'peak_memory': False,
+}
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of ``(case, metric, baseline value, value)`` tuples
+    for each metric that is worse than in ``baseline`` by more than the
+    fraction ``tolerance``."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None or 'error' in base or 'error' in result:
+            continue
+        for metric, larger_is_better in sorted(metrics.items()):
+            old, new = base[metric], result[metric]
+            if larger_is_better:
+                worse = new < old * (1 - tolerance)
+            else:
+                # Small values are dominated by noise.
+                worse = new > old * (1 + tolerance) and new - old > 1e-3 * (
+                    2 ** 20 if metric == 'peak_memory' else 1)
+            if worse:
+                regressions.append((name, metric, old, new))
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('cases', nargs='*', help='names of cases to run')
+    parser.add_argument('--out', help='file to write the results to')
+    parser.add_argument('--baseline', help='results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='fraction by which a metric may be worse')
+    parser.add_argument('--min-time', type=float, default=2.,
+                        help='seconds to measure the throughput for')
+    parser.add_argument('--quick', action='store_true',
+                        help='use small problem sizes')
+    args = parser.parse_args(argv)
+
+    cases = all_cases(1 if args.quick else 4)
+    names = args.cases or sorted(cases)
+    unknown = set(names) - set(cases)
+    if unknown:
+        parser.error('unknown cases: %s' % ', '.join(sorted(unknown)))
+
+    results = {}
+    print '%-28s %12s %12s %14s %12s' % (
+        'case', 'compile [s]', 'first [s]', 'samples/s', 'memory [MB]')
+    for name in names:
+        measure, make = cases[name]
+        result = results[name] = run_case(measure, make, args.min_time)
+        if 'error' in result:
+            print '%-28s failed' % name
+            print result['error']
+            continue
+        print '%-28s %12.3f %12.4f %14.1f %12.1f' % (
+            name, result['compile_time'], result['first_call'],
+            result['throughput'], result['peak_memory'] / 2. ** 20)
+        if 'speedup' in result:
+            print '%-28s %12s %12s %14.1f %12s  (%.1fx)' % (
+                '  legacy', '', '', result['legacy_throughput'], '',
+                result['speedup'])
+
+    if args.out:
+        with open(args.out, 'w') as fp:
+            json.dump({'environment': environment(), 'quick': args.quick,
+                       'results': results}, fp, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        if baseline.get('quick') != args.quick:
+            print 'warning: baseline was run with other problem sizes'
+        regressions = compare(results, baseline['results'], args.tolerance)
+        for name, metric, old, new in regressions:
+            print 'regression in %s: %s %g -> %g' % (name, metric, old, new)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+
+"""Module providing a persistent on-disk cache for compiled Theano functions.
+
+Compiling the functions of a model (e.g. ``f_predict`` or ``_f_dloss``) can
+take a considerable amount of time. Since compiled functions are dropped when
+a model is pickled, every unpickled model has to compile them again. The
+``FunctionCache`` stores compiled functions on disk, addressed by the content
+of the graph they were compiled from. A model which builds the same graph
+again will then load the function instead of compiling it.
+
+Example
+-------
+
+>>> from breze.arch.util import Model
+>>> Model.function_cache = FunctionCache('/tmp/breze-cache', max_size=2 ** 30)
+
+Caching can also be enabled for all models by setting the environment variable
+``BREZE_FUNCTION_CACHE`` to a directory.
+"""
+
+
+import cPickle
+import errno
+import hashlib
+import os
+import tempfile
+import warnings
+
+import numpy as np
+import theano
+import theano.printing
+from theano.compile.sharedvalue import SharedVariable
+
+
+def graph_key(inputs, outputs, *extra):
+    """Return a hex digest identifying the graph from ``inputs`` to
+    ``outputs``.
+
+    The key is computed from the structure of the graph, including the types
+    of all variables and the values of all constants. Variables are identified
+    by their position in the graph and not by their identity, so two
+    separately constructed but equal graphs yield the same key.
+
+    Parameters
+    ----------
+
+    inputs : list of Theano variables
+        Inputs of the function, in the order the function expects them.
+
+    outputs : list of Theano variables
+        Outputs of the function.
+
+    extra : strings
+        Additional items that discriminate functions from the same graph,
+        e.g. the compilation mode.
+
+    Returns
+    -------
+
+    key : string
+        Hex digest of the graph.
+    """
+    outputs = [getattr(i, 'variable', i) for i in outputs]
+    h = hashlib.sha1()
+    h.update(theano.printing.debugprint(
+        list(inputs) + list(outputs), file='str', ids='CHAR',
+        print_type=True))
+
+    # The debug print abbreviates large constants and those of inner graphs,
+    # which is why we add their values explicitly.
+    for const in _constants(outputs):
+        h.update(np.asarray(const.data).tostring())
+
+    for item in extra:
+        h.update(str(item))
+    return h.hexdigest()
+
+
+def _constants(outputs):
+    """Yield the constants of the graph computing ``outputs``, including
+    those of inner graphs of ops such as scan, in a deterministic order."""
+    for var in theano.gof.graph.ancestors(outputs):
+        if isinstance(var, theano.gof.Constant):
+            yield var
+        elif var.owner is not None:
+            inner = getattr(var.owner.op, 'outputs', None)
+            if isinstance(inner, list):
+                for const in _constants(inner):
+                    yield const
+
+
+def mode_key(mode):
+    """Return a string identifying the compilation mode ``mode``, or None if
+    it cannot be identified.
+
+    Names of modes identify themselves. ``theano.Mode`` objects are
+    identified by the class of their linker and their optimizer, if that is
+    given by name or by a query of the optimizer database. Modes wrapping
+    their linker, such as ``breze.arch.util.ProfileMode``, call back into
+    Python code and are never identified."""
+    if isinstance(mode, basestring):
+        return mode
+    linker = getattr(mode, 'linker', None)
+    if linker is None or isinstance(linker, theano.gof.link.WrapLinker):
+        return None
+    optimizer = getattr(mode, 'provided_optimizer', None)
+    if isinstance(optimizer, basestring):
+        optimizer_key = optimizer
+    elif isinstance(optimizer, theano.gof.Query):
+        optimizer_key = 'query(%s;%s;%s;%s)' % (
+            ','.join(sorted(optimizer.include)),
+            ','.join(sorted(optimizer.require)),
+            ','.join(sorted(optimizer.exclude)),
+            optimizer.position_cutoff)
+    else:
+        return None
+    return '%s:%s' % (type(linker).__name__, optimizer_key)
+
+
+def is_cacheable(outputs, updates=None, givens=None):
+    """Return True iff a function computing ``outputs`` can be cached.
+
+    Functions with updates or shared variables in their graph cannot be
+    cached, because a loaded function holds copies of the shared variables
+    which are detached from the model. Functions compiled with ``givens`` are
+    not cached either, since the substitutions are not part of the key."""
+    if updates or givens:
+        return False
+    outputs = [getattr(i, 'variable', i) for i in outputs]
+    return not any(isinstance(i, SharedVariable)
+                   for i in theano.gof.graph.inputs(outputs))
+
+
+class FunctionCache(object):
+    """FunctionCache class.
+
+    Stores compiled Theano functions in files inside a directory, one file per
+    function. Least recently used files are removed as soon as the total size
+    of the cache exceeds ``max_size``.
+
+    Attributes
+    ----------
+
+    directory : string
+        Directory holding the cached functions.
+
+    max_size : integer or None
+        Maximum size of the cache in bytes. If None, the cache is unbounded.
+
+    hits : integer
+        Number of functions that were loaded from the cache.
+
+    misses : integer
+        Number of functions that were not found in the cache.
+
+    evictions : integer
+        Number of functions that were removed from the cache to respect
+        ``max_size``.
+    """
+
+    suffix = '.pkl'
+
+    def __init__(self, directory, max_size=None):
+        """Create a FunctionCache object.
+
+        Parameters
+        ----------
+
+        directory : string
+            Directory holding the cached functions. Will be created if it
+            does not exist.
+
+        max_size : integer or None, optional, default: None
+            Maximum size of the cache in bytes. If None, the cache is
+            unbounded.
+        """
+        self.directory = os.path.expanduser(directory)
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        try:
+            os.makedirs(self.directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def key(self, inputs, outputs, mode, *extra):
+        """Return the key under which the function compiled from ``inputs``
+        to ``outputs`` with ``mode`` is stored, or None if the mode cannot be
+        identified; see ``mode_key``."""
+        mode = mode_key(mode)
+        if mode is None:
+            return None
+        return graph_key(inputs, outputs, mode, theano.config.floatX,
+                         theano.config.device, theano.__version__, *extra)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key):
+        """Return the function stored under ``key`` or None if there is
+        none."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fp:
+                # If supported by the installed Theano, do not run the graph
+                # optimizer on the unpickled function again; that would give
+                # away most of the gain of caching.
+                config = theano.config
+                reoptimize = getattr(
+                    config, 'reoptimize_unpickled_function', None)
+                if reoptimize is not None:
+                    config.reoptimize_unpickled_function = False
+                try:
+                    f = cPickle.load(fp)
+                finally:
+                    if reoptimize is not None:
+                        config.reoptimize_unpickled_function = reoptimize
+        except IOError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            warnings.warn('could not load cached function %s: %s' % (path, e))
+            self.misses += 1
+            return None
+
+        # Mark the file as recently used.
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return f
+
+    def put(self, key, f):
+        """Store the function ``f`` under ``key``."""
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.directory, suffix=self.suffix + '.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                cPickle.dump(f, fp, protocol=cPickle.HIGHEST_PROTOCOL)
+            # Renaming is atomic, thus concurrent readers never see partially
+            # written files.
+            os.rename(tmp_path, self._path(key))
+        except Exception as e:
+            warnings.warn('could not cache function: %s' % e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        self.evict()
+
+    def entries(self):
+        """Return a list of ``(path, size, last_used)`` triples for all cached
+        functions, least recently used first."""
+        entries = []
+        for fn in os.listdir(self.directory):
+            if not fn.endswith(self.suffix):
+                continue
+            path = os.path.join(self.directory, fn)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Removed by a concurrent process.
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        entries.sort(key=lambda x: x[2])
+        return entries
+
+    def size(self):
+        """Return the total size of the cache in bytes."""
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """Remove least recently used functions until the cache does not
+        exceed ``max_size``."""
+        if self.max_size is None:
+            return
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        """Remove all functions from the cache."""
+        for path, _, _ in self.entries():
+            os.remove(path)
+
+    def compile(self, inputs, outputs, mode=None, on_unused_input='raise',
+                **kwargs):
+        """Return a ``theano.function`` from ``inputs`` to ``outputs``, loading
+        it from the cache if possible and storing it otherwise.
+
+        All arguments are passed on to ``theano.function``. If the function
+        cannot be cached (see ``is_cacheable``), it is just compiled."""
+        if mode is None:
+            mode = theano.config.mode
+        outputs_list = outputs if isinstance(outputs, list) else [outputs]
+        if not is_cacheable(outputs_list, kwargs.get('updates'),
+                            kwargs.get('givens')):
+            return theano.function(inputs, outputs, mode=mode,
+                                   on_unused_input=on_unused_input, **kwargs)
+
+        # Whether outputs is a list determines the return type of the
+        # function, hence it is part of the key.
+        key = self.key(inputs, outputs_list, mode, on_unused_input,
+                       isinstance(outputs, list))
+        if key is None:
+            return theano.function(inputs, outputs, mode=mode,
+                                   on_unused_input=on_unused_input, **kwargs)
+        f = self.get(key)
+        if f is None:
+            f = theano.function(inputs, outputs, mode=mode,
+                                on_unused_input=on_unused_input, **kwargs)
+            self.put(key, f)
+        return f
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import theano.tensor as T
+from theano.tensor.extra_ops import repeat
 
 from breze.arch.component.varprop import transfer as _transfer
 from breze.arch.construct.base import Layer
@@ -10,6 +11,14 @@ from breze.arch.util import lookup
 
 
 class FDRecurrent(Layer):
+    """FDRecurrent class.
+
+    Represents a recurrent layer with fast dropout. Like ``Recurrent``, it
+    exposes the state carried from one time step to the next as the lists of
+    expressions ``carry_initial`` and ``carry_final``: mean and variance of
+    the output, preceded by those of the cell state for stateful transfer
+    functions.
+    """
 
     def __init__(self, inpt_mean, inpt_var, n_inpt, transfer, p_dropout,
                  declare=None, name=None):
@@ -34,25 +43,45 @@ class FDRecurrent(Layer):
         self.initial_std = self.declare((m,))
         self.weights = self.declare((m, n))
 
+        n_samples = self.inpt_mean.shape[1]
+        self.initial_hidden_mean = repeat(
+            self.initial_mean.dimshuffle('x', 0), n_samples, axis=0)
+        self.initial_hidden_var = repeat(
+            (self.initial_std ** 2 + 1e-8).dimshuffle('x', 0), n_samples,
+            axis=0)
+
         if getattr(f, 'stateful', False):
+            self.initial_state_mean = T.zeros_like(self.initial_hidden_mean)
+            self.initial_state_var = (
+                T.zeros_like(self.initial_hidden_mean) + 1e-8)
             res = recurrent_layer_stateful(
                 self.inpt_mean, self.inpt_var,
                 self.weights,
                 f,
-                self.initial_mean, self.initial_std ** 2 + 1e-8,
-                self.p_dropout)
+                self.initial_hidden_mean, self.initial_hidden_var,
+                self.p_dropout,
+                self.initial_state_mean, self.initial_state_var)
             (self.state_mean, self.state_var,
              self.output_in_mean, self.output_in_var,
              self.output_mean, self.output_var) = res
+            self.carry_initial = [
+                self.initial_state_mean, self.initial_state_var,
+                self.initial_hidden_mean, self.initial_hidden_var]
+            self.carry_final = [
+                self.state_mean[-1], self.state_var[-1],
+                self.output_mean[-1], self.output_var[-1]]
         else:
             res = recurrent_layer(
                 self.inpt_mean, self.inpt_var,
                 self.weights,
                 f,
-                self.initial_mean, self.initial_std ** 2 + 1e-8,
+                self.initial_hidden_mean, self.initial_hidden_var,
                 self.p_dropout)
             (self.output_in_mean, self.output_in_var,
              self.output_mean, self.output_var) = res
+            self.carry_initial = [
+                self.initial_hidden_mean, self.initial_hidden_var]
+            self.carry_final = [self.output_mean[-1], self.output_var[-1]]
 
         self.outputs = self.output_mean, self.output_var
 
@@ -332,7 +332,8 @@ class Rnn(Layer):
             declare=self.declare
             )
 
-        self.layers.append(affine)
+        self.output_affine = output_affine
+        self.layers.append(output_affine)
 
         output = output_affine.output.reshape(
             (n_time_steps, -1, self.n_output))
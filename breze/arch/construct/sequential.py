@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 
 
+import theano
+import theano.tensor as T
+from theano.tensor.extra_ops import repeat
+
 from breze.arch.component import transfer as _transfer
 from breze.arch.construct.base import Layer
 from breze.arch.model.rnn.rnn import recurrent_layer, recurrent_layer_stateful
@@ -12,6 +16,12 @@ class Recurrent(Layer):
     """Recurrent class.
 
     Represents a recurrent layer as found in neural networks.
+
+    The state carried from one time step to the next is given by the list of
+    expressions ``carry_initial`` for the first time step and ``carry_final``
+    after the last one: the cell state and the output for stateful transfer
+    functions, the pre-synaptic activation otherwise. Replacing the former
+    by the latter of a previous chunk of the sequences continues them.
     """
 
     def __init__(self, inpt, n_inpt, transfer='identity', declare=None,
@@ -34,12 +44,45 @@ class Recurrent(Layer):
         self.weights = self.declare((m, n))
         self.initial = self.declare((m,))
 
+        # One copy of the initial state per sample, spread over the samples
+        # as ``recurrent_layer`` and ``recurrent_layer_stateful`` do it.
+        n_samples = self.inpt.shape[1]
+        if getattr(f, 'stateful', False):
+            self.initial_hidden = repeat(
+                self.initial.dimshuffle('x', 0), n_samples, axis=0)
+        else:
+            self.initial_hidden = repeat(
+                self.initial, n_samples, axis=0).reshape((n_samples, m))
+
         if getattr(f, 'stateful', False):
+            self.initial_state = T.zeros_like(self.initial_hidden)
             self.state, self.output_in, self.output = recurrent_layer_stateful(
-                self.inpt, self.weights, f, self.initial)
+                self.inpt, self.weights, f, self.initial_hidden,
+                self.initial_state)
+            self.carry_initial = [self.initial_state, self.initial_hidden]
+            self.carry_final = [self.state[-1], self.output[-1]]
         else:
             self.output_in, self.output = recurrent_layer(
-                self.inpt, self.weights, f, self.initial)
+                self.inpt, self.weights, f, self.initial_hidden)
+            self.carry_initial = [self.initial_hidden]
+            self.carry_final = [self.output_in[-1]]
+
+
+def clone_with_carry(initial, exprs):
+    """Return a pair ``(carry, exprs)``.
+
+    ``carry`` is a list of matrices, one for each of the expressions in
+    ``initial``, typically the ``carry_initial`` expressions of recurrent
+    layers. The returned ``exprs`` are clones of the given ones in which the
+    expressions of ``initial`` are replaced by these. Thus the recurrent
+    layers continue from the states they are given, e.g. the ``carry_final``
+    expressions evaluated on a previous chunk of the sequences."""
+    carry = [T.matrix('carry-%i' % i) for i in range(len(initial))]
+    for c, i in zip(carry, initial):
+        if hasattr(i.tag, 'test_value'):
+            c.tag.test_value = i.tag.test_value
+    # Cloning all at once keeps the scans shared among the expressions.
+    return carry, theano.clone(exprs, replace=dict(zip(initial, carry)))
 
 
 class Pooling(Layer):
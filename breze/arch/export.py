@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+"""Module for exporting the forward pass of networks built from the layers in
+``breze.arch.construct`` for Theano free inference.
+
+The exporter walks the layer tree of a network and emits a plan, i.e. a list
+of operations such as affine transformations or convolutions, together with a
+flat vector holding all weights the plan refers to. The plan is stored as
+JSON, the weights as a ``.npy`` file. Both can be executed by
+``breze.runtime.Runtime``, which depends on numpy only.
+
+Example
+-------
+
+>>> model = Mlp(2, [10], 1, ['tanh'], 'identity', 'squared')
+>>> model.fit(X, Z)
+>>> export(model.mlp, model.parameters, 'mlp')
+
+And on a host without Theano:
+
+>>> from breze.runtime import Runtime
+>>> runtime = Runtime.load('mlp')
+>>> Y = runtime(X)
+"""
+
+
+import json
+
+import numpy as np
+
+from breze.arch.component import transfer as _transfer
+from breze.arch.construct import simple, sequential
+from breze.arch.construct.neural import base as neural
+
+
+def transfer_name(transfer):
+    """Return the name of ``transfer`` in ``breze.arch.component.transfer``.
+
+    ``transfer`` is either a name already or one of the functions of that
+    module."""
+    if isinstance(transfer, (str, unicode)):
+        name = transfer
+    else:
+        names = [k for k, v in vars(_transfer).items() if v is transfer]
+        if not names:
+            raise ValueError('cannot export transfer function %r' % transfer)
+        name = names[0]
+    if not callable(getattr(_transfer, name, None)):
+        raise ValueError('unknown transfer function %s' % name)
+    return name
+
+
+class Exporter(object):
+    """Exporter class.
+
+    Collects the operations and weights of a network while walking its
+    layers.
+
+    Attributes
+    ----------
+
+    parameters : ParameterSet object
+        Holds the weights of the network.
+
+    ops : list of dictionaries
+        Operations of the plan, in order of execution.
+
+    arrays : list of arrays
+        Weights referred to by the operations. Operations refer to them by
+        their index.
+    """
+
+    def __init__(self, parameters):
+        if parameters.quantized is not None:
+            raise ValueError('cannot export quantized parameters, dequantize '
+                             'first')
+        self.parameters = parameters
+        self.ops = []
+        self.arrays = []
+
+    def array(self, variable):
+        """Add the array of ``variable`` to the weights and return its
+        index."""
+        self.arrays.append(np.array(self.parameters[variable]))
+        return len(self.arrays) - 1
+
+    def add(self, layer):
+        """Add the operations of ``layer`` to the plan."""
+        handlers = [
+            (neural.Lenet, self.add_lenet),
+            (neural.Cnn2d, self.add_sequence),
+            (neural.SimpleCnn2d, self.add_simple_cnn),
+            (neural.Mlp, self.add_sequence),
+            (neural.Rnn, self.add_rnn),
+            (simple.AffineNonlinear, self.add_affine),
+            (simple.Conv2d, self.add_conv2d),
+            (simple.MaxPool2d, self.add_max_pool2d),
+            (sequential.Recurrent, self.add_recurrent),
+        ]
+        for cls, handler in handlers:
+            if isinstance(layer, cls):
+                handler(layer)
+                return
+        raise ValueError('cannot export layer of type %s'
+                         % layer.__class__.__name__)
+
+    def add_sequence(self, layer):
+        for i in layer.layers:
+            self.add(i)
+
+    def add_affine(self, layer, transfer=None):
+        self.ops.append({
+            'op': 'affine',
+            'weights': self.array(layer.weights),
+            'bias': self.array(layer.bias) if layer.use_bias else None,
+            'transfer': transfer_name(transfer or layer.transfer),
+        })
+
+    def add_conv2d(self, layer):
+        # The bias of a Conv2d layer is declared but not used.
+        self.ops.append({
+            'op': 'conv2d',
+            'weights': self.array(layer.weights),
+            'subsample': list(layer.subsample),
+            'transfer': transfer_name(layer.transfer),
+        })
+
+    def add_max_pool2d(self, layer):
+        self.ops.append({
+            'op': 'max_pool2d',
+            'pool_shape': [layer.pool_height, layer.pool_width],
+            'transfer': transfer_name(layer.transfer),
+        })
+
+    def add_recurrent(self, layer):
+        self.ops.append({
+            'op': 'recurrent',
+            'weights': self.array(layer.weights),
+            'initial': self.array(layer.initial),
+            'transfer': transfer_name(layer.transfer),
+        })
+
+    def add_lenet(self, layer):
+        self.add(layer.cnn)
+        self.ops.append({'op': 'flatten'})
+        self.add(layer.mlp)
+
+    def add_simple_cnn(self, layer):
+        self.add_sequence(layer)
+        self.ops.append({'op': 'flatten'})
+        self.add(layer.final_layer)
+
+    def add_rnn(self, layer):
+        for i in layer.layers:
+            if i is layer.output_affine:
+                continue
+            if isinstance(i, simple.AffineNonlinear):
+                # The affine layers in front of the recurrent ones have an
+                # anonymous identity as transfer function.
+                self.add_affine(i, transfer='identity')
+            else:
+                self.add(i)
+        self.add(layer.output_affine)
+        if layer.pooling:
+            self.ops.append({'op': 'pooling', 'type': layer.pooling})
+
+    def plan(self):
+        """Return the plan and the flat weight vector."""
+        offset = 0
+        arrays = []
+        for arr in self.arrays:
+            arrays.append({'offset': offset, 'shape': list(arr.shape)})
+            offset += arr.size
+        if self.arrays:
+            flat = np.concatenate([i.ravel() for i in self.arrays])
+        else:
+            flat = np.empty(0, dtype=self.parameters.data.dtype)
+        plan = {
+            'version': 1,
+            'dtype': str(flat.dtype),
+            'arrays': arrays,
+            'ops': self.ops,
+        }
+        return plan, flat
+
+
+def export(layer, parameters, path=None):
+    """Export the forward pass of ``layer``.
+
+    Parameters
+    ----------
+
+    layer : Layer object
+        Network to export, e.g. ``.mlp`` of a ``breze.learn.mlp.Mlp``.
+        Supported are ``Lenet``, ``Cnn2d``, ``SimpleCnn2d``, ``Mlp`` and
+        ``Rnn`` as well as the layers they are made of.
+
+    parameters : ParameterSet object
+        Parameters of the network.
+
+    path : string, optional
+        If given, the plan is written to ``path + '.json'`` and the weights to
+        ``path + '.npy'``.
+
+    Returns
+    -------
+
+    plan : dictionary
+        Plan of the forward pass; can be serialized as JSON.
+
+    weights : array_like
+        Flat vector of all weights the plan refers to.
+    """
+    exporter = Exporter(parameters)
+    exporter.add(layer)
+    plan, weights = exporter.plan()
+    if path is not None:
+        with open(path + '.json', 'w') as fp:
+            json.dump(plan, fp, indent=2)
+        np.save(path + '.npy', weights)
+    return plan, weights
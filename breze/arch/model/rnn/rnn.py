@@ -7,17 +7,27 @@ from theano.tensor.extra_ops import repeat
 
 
 def recurrent_layer(hidden_inpt, hidden_to_hidden, f, initial_hidden):
+    """Return a pair ``(hidden_in_rec, hidden_rec)`` of the pre-synaptic and
+    the post-synaptic activations of a recurrent layer over time.
+
+    ``initial_hidden`` is the pre-synaptic activation before the first time
+    step. It is either a vector shared by all samples or a matrix holding one
+    row per sample, e.g. the last row of ``hidden_in_rec`` of a previous
+    chunk of the sequences."""
     def step(x, hi_tm1):
         h_tm1 = f(hi_tm1)
         hi = T.dot(h_tm1, hidden_to_hidden) + x
         return hi
 
-    # Modify the initial hidden state to obtain several copies of
-    # it, one per sample.
-    # TODO check if this is correct; FD-RNNs do it right.
-    initial_hidden_b = repeat(initial_hidden, hidden_inpt.shape[1], axis=0)
-    initial_hidden_b = initial_hidden_b.reshape(
-        (hidden_inpt.shape[1], hidden_inpt.shape[2]))
+    if initial_hidden.ndim == 1:
+        # Modify the initial hidden state to obtain several copies of
+        # it, one per sample.
+        # TODO check if this is correct; FD-RNNs do it right.
+        initial_hidden_b = repeat(initial_hidden, hidden_inpt.shape[1], axis=0)
+        initial_hidden_b = initial_hidden_b.reshape(
+            (hidden_inpt.shape[1], hidden_inpt.shape[2]))
+    else:
+        initial_hidden_b = initial_hidden
 
     hidden_in_rec, _ = theano.scan(
         step,
@@ -29,21 +39,35 @@ def recurrent_layer(hidden_inpt, hidden_to_hidden, f, initial_hidden):
     return hidden_in_rec, hidden_rec
 
 
-def recurrent_layer_stateful(hidden_inpt, hidden_to_hidden, f, initial_hidden):
+def recurrent_layer_stateful(hidden_inpt, hidden_to_hidden, f, initial_hidden,
+                             initial_state=None):
+    """Return a triple ``(states, hidden_in_rec, hidden_rec)`` of the cell
+    states, the pre-synaptic and the post-synaptic activations of a recurrent
+    layer with a stateful transfer function, such as an LSTM, over time.
+
+    ``initial_hidden`` is the post-synaptic activation before the first time
+    step, either a vector shared by all samples or a matrix holding one row
+    per sample. ``initial_state`` is a matrix of the cell states before the
+    first time step; they are zero if not given."""
     def step(x, s_m1, hi_tm1, h_tm1):
         hi = T.dot(h_tm1, hidden_to_hidden)
         hi += x
         s, h = f(s_m1, hi)
         return s, hi, h
 
-    initial_hidden_b = repeat(
-        initial_hidden.dimshuffle('x', 0), hidden_inpt.shape[1], axis=0)
+    if initial_hidden.ndim == 1:
+        initial_hidden_b = repeat(
+            initial_hidden.dimshuffle('x', 0), hidden_inpt.shape[1], axis=0)
+    else:
+        initial_hidden_b = initial_hidden
+    if initial_state is None:
+        initial_state = T.zeros_like(initial_hidden_b)
 
     (states, hidden_in_rec, hidden_rec), _ = theano.scan(
         step,
         sequences=hidden_inpt,
         outputs_info=[
-            T.zeros_like(initial_hidden_b),
+            initial_state,
             T.zeros_like(hidden_inpt[0]),
             initial_hidden_b])
 
@@ -156,7 +156,7 @@ def recurrent_layer(in_mean, in_var, weights, f,
 
 def recurrent_layer_stateful(
         in_mean, in_var, weights, f, initial_hidden_mean, initial_hidden_var,
-        p_dropout):
+        p_dropout, initial_state_mean=None, initial_state_var=None):
     # TODO: documentation needs to explain the stateful thing.
     """Return a theano variable representing a recurrent layer.
 
@@ -185,6 +185,10 @@ def recurrent_layer_stateful(
     p_dropout : Theano variable
         Scalar representing the probability that unit is dropped out.
 
+    initial_state_mean, initial_state_var : Theano variable, optional
+        Theano matrices of shape ``(n, d)`` representing mean and variance of
+        the initial cell state. Zero and a tiny variance if not given.
+
 
     Returns
     -------
@@ -232,13 +236,17 @@ def recurrent_layer_stateful(
     if initial_hidden_var.ndim == 1:
         initial_hidden_var = repeat(
             initial_hidden_var.dimshuffle('x', 0), in_mean.shape[1], axis=0)
+    if initial_state_mean is None:
+        initial_state_mean = T.zeros_like(initial_hidden_mean)
+    if initial_state_var is None:
+        initial_state_var = T.zeros_like(initial_hidden_mean) + 1e-8
 
     (state_mean, state_var, hidden_in_mean_rec, hidden_in_var_rec,
     hidden_mean_rec, hidden_var_rec), _ = theano.scan(
         step,
         sequences=[in_mean, in_var],
-        outputs_info=[T.zeros_like(initial_hidden_mean),
-                      T.zeros_like(initial_hidden_mean) + 1e-8,
+        outputs_info=[initial_state_mean,
+                      initial_state_var,
                       T.zeros_like(in_mean[0]),
                       T.zeros_like(in_mean[0]),
                       initial_hidden_mean,
@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 
+import json
+import mmap
 import os
 import sys
+import time
 import collections
 import numpy as np
 import theano
@@ -9,6 +12,7 @@ import theano.tensor as T
 import theano.sandbox.cuda
 import theano.sandbox.cuda.var
 
+from breze.arch.cache import FunctionCache
 from breze.utils import dictlist
 
 
@@ -29,6 +33,12 @@ if GPU:
     import theano.misc.gnumpy_utils as gput
 
 
+if os.environ.get('BREZE_FUNCTION_CACHE'):
+    FUNCTION_CACHE = FunctionCache(os.environ['BREZE_FUNCTION_CACHE'])
+else:
+    FUNCTION_CACHE = None
+
+
 def flatten(nested):
     """Flatten nested tuples and/or lists into a flat list."""
     if isinstance(nested, (tuple, list)):
@@ -262,6 +272,21 @@ def tell_variable_in_expr(variable, expr):
     return False
 
 
+def half_bits_to_float(bits):
+    """Return a Theano expression for the values of the float16 numbers whose
+    bit patterns are given by the integer tensor ``bits``.
+
+    Infinities and NaNs are not supported."""
+    bits = T.cast(bits, 'int32')
+    sign = 1 - 2 * (bits // 2 ** 15)
+    exponent = (bits // 2 ** 10) % 2 ** 5
+    mantissa = T.cast(bits % 2 ** 10, theano.config.floatX)
+    normal = (1 + mantissa / 2. ** 10) * T.pow(2., exponent - 15)
+    subnormal = mantissa * 2. ** -24
+    return T.cast(sign * T.switch(T.eq(exponent, 0), subnormal, normal),
+                  theano.config.floatX)
+
+
 class ParameterSet(object):
     """ParameterSet class.
 
@@ -298,8 +323,38 @@ class ParameterSet(object):
     views : dict
         All parameter arrays can be accessed by with their identifier as key
         in this dictionary.
+
+    storage : None, string
+        Where ``data`` lives; see ``alloc``.
+
+    quantized : array_like or None
+        If not None, the parameters are stored in reduced precision in this
+        array instead of in ``data``; see ``quantize``.
+
+    scales : array_like or None
+        Scale factor for each declared array of ``quantized``.
+
+    The flat parameter array can be placed in memory shared between processes,
+    so that several processes serving the same model hold only a single copy
+    of the parameters. With ``storage='shared'``, it is placed in anonymous
+    shared memory which is inherited by forked processes. If ``storage`` is a
+    file name, the parameters are stored in a memory mapped file; other
+    processes can then ``attach`` to it. Using a file in ``/dev/shm`` gives
+    POSIX shared memory.
+
+    Since the views of a ParameterSet are always taken of ``data``, writing to
+    ``data`` in one process, e.g. after a training step, updates the
+    parameters of all processes sharing it.
+
+    >>> model.parameters.relocate('/dev/shm/model-pars')  # In the trainer.
+    >>> model.parameters.attach('/dev/shm/model-pars')  # In a server.
     """
 
+    storage = None
+    quantized = None
+    scales = None
+    _data = None
+
     def __init__(self):
         self._alloced = False
         self._n_pars = 0
@@ -338,18 +393,187 @@ class ParameterSet(object):
         start, stop = self._var_to_slice[variable]
         return flat_arr[start:stop].reshape(self._var_to_shape[variable])
 
-    def alloc(self):
+    @property
+    def data(self):
+        if self._data is None and self.quantized is not None:
+            raise ValueError('parameters are quantized, call dequantize '
+                             'first')
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
+    def _alloc_data(self, storage):
+        if storage is None:
+            if GPU:
+                return gnumpy.zeros(self._n_pars)
+            return np.empty(self._n_pars).astype(theano.config.floatX)
+
+        if GPU:
+            raise ValueError('parameters on the GPU cannot be shared')
+        dtype = np.dtype(theano.config.floatX)
+        if storage == 'shared':
+            buf = mmap.mmap(-1, max(self._n_pars, 1) * dtype.itemsize)
+            return np.frombuffer(buf, dtype=dtype, count=self._n_pars)
+        return np.memmap(storage, dtype=dtype, mode='w+',
+                         shape=(self._n_pars,))
+
+    def _set_data(self, data, storage):
+        self.data = data
+        self.storage = storage
+        if theano.config.compute_test_value:
+            self.flat.tag.test_value = self.data
+
+    def alloc(self, storage=None):
+        """Allocate the flat parameter array ``data``.
+
+        Parameters
+        ----------
+
+        storage : None or string, optional, default: None
+            If None, the array is private to the process. If ``'shared'``, it
+            is placed in anonymous shared memory, which is inherited by forked
+            processes. Otherwise, it is taken as the name of a file which will
+            be created to hold the array as a memory map.
+        """
         if self._alloced:
             raise ValueError('cannot alloc ParameterSet more than once')
         self._alloced = True
+        self._set_data(self._alloc_data(storage), storage)
+
+    def relocate(self, storage):
+        """Move the parameters to ``storage``, keeping their values.
+
+        See ``alloc`` for the possible values of ``storage``."""
+        data = self._alloc_data(storage)
+        data[...] = self.data
+        if isinstance(data, np.memmap):
+            data.flush()
+        self._set_data(data, storage)
+
+    def attach(self, filename, writable=False):
+        """Use the parameters stored in the memory mapped file ``filename``,
+        e.g. by another process which called ``relocate(filename)``.
+
+        Parameters
+        ----------
+
+        filename : string
+            File holding the parameters.
 
+        writable : boolean, optional, default: False
+            If True, changes to the parameters are written to the file and
+            thus visible to all processes attached to it.
+        """
+        if GPU:
+            raise ValueError('parameters on the GPU cannot be shared')
+        dtype = np.dtype(theano.config.floatX)
+        size = os.path.getsize(filename)
+        if size != self._n_pars * dtype.itemsize:
+            raise ValueError('%s holds %i bytes, need %i' % (
+                filename, size, self._n_pars * dtype.itemsize))
+        data = np.memmap(filename, dtype=dtype, mode='r+' if writable else 'r',
+                         shape=(self._n_pars,))
+        self._set_data(data, filename)
+
+    def _slices(self):
+        """Return the pairs ``(start, stop)`` of all declared arrays in the
+        order of their declaration."""
+        return sorted(self._var_to_slice.values())
+
+    def quantize(self, dtype='int8'):
+        """Store the parameters in reduced precision, e.g. for inference on
+        models whose parameters would otherwise not fit into the cache.
+
+        Each declared array gets a scale factor, so that its values are
+        represented as ``scale * quantized``. For ``int8``, the scale maps the
+        largest absolute value of the array to 127; for ``float16``, it only
+        makes sure there is no overflow.
+
+        Afterwards accessing ``data``, and thus views of the parameters,
+        raises a ValueError. Functions compiled by a ``Model`` without
+        explicit parameters then dequantize the parameters as part of the
+        graph. Use ``dequantize`` to go back to full precision.
+
+        Parameters
+        ----------
+
+        dtype : string, optional, default: 'int8'
+            Either ``'int8'`` or ``'float16'``.
+        """
         if GPU:
-            self.data = gnumpy.zeros(self._n_pars)
+            raise ValueError('parameters on the GPU cannot be quantized')
+        if dtype == 'int8':
+            max_value = 127.
+        elif dtype == 'float16':
+            max_value = float(np.finfo('float16').max)
         else:
-            self.data = np.empty(self._n_pars).astype(theano.config.floatX)
+            raise ValueError('cannot quantize to %s' % dtype)
+
+        slices = self._slices()
+        quantized = np.empty(self._n_pars, dtype=dtype)
+        scales = np.ones(len(slices), dtype=theano.config.floatX)
+        for i, (start, stop) in enumerate(slices):
+            arr = self.data[start:stop]
+            abs_max = abs(arr).max() if stop > start else 0
+            if dtype == 'int8' and abs_max > 0:
+                scales[i] = abs_max / max_value
+            elif abs_max > max_value:
+                scales[i] = abs_max / max_value
+            scaled = arr / scales[i]
+            if dtype == 'int8':
+                scaled = np.round(scaled).clip(-max_value, max_value)
+            quantized[start:stop] = scaled
+
+        self.quantized = quantized
+        self.scales = scales
+        self._data = None
+        self.storage = None
+
+    def dequantize(self):
+        """Restore ``data`` in full precision from the quantized parameters."""
+        data = self._alloc_data(None)
+        for i, (start, stop) in enumerate(self._slices()):
+            data[start:stop] = self.quantized[start:stop] * self.scales[i]
+        self.quantized = None
+        self.scales = None
+        self._set_data(data, None)
+
+    def quantized_input(self):
+        """Return the quantized parameters in the form compiled functions
+        expect them, see ``dequantize_expr``."""
+        if self.quantized.dtype == np.float16:
+            return self.quantized.view('uint16')
+        return self.quantized
+
+    def dequantize_expr(self, quantized, scales):
+        """Return a Theano expression for the flat parameter vector given
+        variables for the quantized parameters and the scales.
+
+        Theano has no C implementation for float16, which is why float16
+        parameters are passed as their bit patterns, i.e. as a ``uint16``
+        vector; see ``quantized_input``."""
+        if quantized.dtype == 'uint16':
+            quantized = half_bits_to_float(quantized)
+        parts = [T.cast(quantized[start:stop], theano.config.floatX)
+                 * scales[i]
+                 for i, (start, stop) in enumerate(self._slices())]
+        return T.concatenate(parts)
 
-        if theano.config.compute_test_value:
-            self.flat.tag.test_value = self.data
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Pickled parameters are private to the process loading them.
+        if state.get('storage') is not None:
+            state['_data'] = np.array(state['_data'])
+            state['storage'] = None
+        return state
+
+    def __setstate__(self, state):
+        # Parameter sets pickled before ``data`` became a property.
+        if 'data' in state:
+            state['_data'] = state.pop('data')
+        self.__dict__.update(state)
 
     def __contains__(self, key):
         return key in self._var_to_slice
@@ -408,8 +632,51 @@ class Model(object):
 
     updates : dict
         Containing update variables, e.g. due to the use of ``theano.scan``.
+
+    function_cache : FunctionCache object or None
+        If not None, compiled functions are loaded from and stored in this
+        cache. Defaults to a cache in the directory given by the environment
+        variable ``BREZE_FUNCTION_CACHE``, if set. See
+        ``breze.arch.cache.FunctionCache``.
     """
 
+    function_cache = FUNCTION_CACHE
+
+    def quantize(self, dtype='int8'):
+        """Switch the model to reduced precision parameters for inference.
+
+        Compiled functions are dropped, so that they are compiled anew for the
+        quantized parameters on first use. See ``ParameterSet.quantize``."""
+        self.parameters.quantize(dtype)
+        self._drop_functions()
+
+    def dequantize(self):
+        """Switch the model back to full precision parameters."""
+        self.parameters.dequantize()
+        self._drop_functions()
+
+    def start_profiling(self, optimizer='fast_compile'):
+        """Compile all functions in a ``ProfileMode`` from now on, and return
+        it.
+
+        Compiled functions are dropped, so that they are compiled anew for
+        profiling on first use."""
+        self._mode_before_profiling = getattr(self, 'mode', None)
+        self.mode = ProfileMode(optimizer)
+        self._drop_functions()
+        return self.mode
+
+    def stop_profiling(self):
+        """Compile functions in the mode used before ``start_profiling``
+        again."""
+        self.mode = self.__dict__.pop('_mode_before_profiling', None)
+        self._drop_functions()
+
+    def _drop_functions(self):
+        for key, value in self.__dict__.items():
+            if callable(value) and getattr(value, 'breze_func', False):
+                setattr(self, key, None)
+
     def __init__(self):
         self.updates = collections.defaultdict(dict)
 
@@ -474,7 +741,7 @@ class Model(object):
 
     def function(self, variables, exprs, mode=None, explicit_pars=False,
                  givens=None,
-                 on_unused_input='raise', numpy_result=False):
+                 on_unused_input='raise', numpy_result=False, name=None):
         """Return a compiled function for the given `exprs` given `variables`.
 
 
@@ -514,6 +781,10 @@ class Model(object):
         numpy_result : boolean, optional, default: False
             If set to True, a numpy array is always returned, even if the
             computation is done on the GPU and a gnumpy array was more natural.
+
+        name : string or None, optional, default: None
+            Name of the function, under which it is reported by a
+            ``ProfileMode``. If None, it is made from the names of ``exprs``.
         """
         if mode is None:
             if getattr(self, 'mode', None) is None:
@@ -521,6 +792,11 @@ class Model(object):
             else:
                 mode = self.mode
 
+        if name is None:
+            names = [i if isinstance(i, str) else getattr(i, 'name', None)
+                     for i in (exprs if isinstance(exprs, list) else [exprs])]
+            name = ','.join(i or 'expr' for i in names)
+
         # Get variables and expressions into a canonical form first that is
         # assumed below.
         variables = [self._lookup(self.exprs, i) for i in variables]
@@ -568,17 +844,54 @@ class Model(object):
                            if any(tell_variable_in_expr(old, e) for e in exprs)]
             givens.update(dict(more_givens))
 
-        variables = [self.parameters.flat] + variables
+        quantized = self.parameters.quantized
+        if quantized is not None and not explicit_pars:
+            # Parameters are passed in reduced precision and dequantized
+            # within the function.
+            quantized = self.parameters.quantized_input()
+            q = T.vector('quantized-parameters', dtype=str(quantized.dtype))
+            scales = T.vector('parameter-scales')
+            if theano.config.compute_test_value != 'off':
+                q.tag.test_value = quantized
+                scales.tag.test_value = self.parameters.scales
+            flat = self.parameters.dequantize_expr(q, scales)
+            replace = {self.parameters.flat: flat}
+            exprs = [theano.clone(e, replace) for e in exprs]
+            updates = dict((k, theano.clone(v, replace))
+                           for k, v in updates.items())
+            variables = [q, scales] + variables
+        else:
+            quantized = None
+            variables = [self.parameters.flat] + variables
+
+        profiling = isinstance(mode, ProfileMode)
+        if profiling:
+            tag_layers(self)
 
-        f = theano.function(
+        if self.function_cache is not None and not profiling:
+            compile_ = self.function_cache.compile
+        else:
+            compile_ = theano.function
+        f = compile_(
             variables,
             exprs[0] if exprs_not_list else exprs,
             givens=givens, mode=mode,
             on_unused_input=on_unused_input, updates=updates)
 
+        if profiling:
+            mode.register(f, name)
+
         if GPU:
             f = gnumpy_func_wrap(f)
 
+        if quantized is not None:
+            def f_implicit_pars(*args, **kwargs):
+                return f(self.parameters.quantized_input(),
+                         self.parameters.scales, *args, **kwargs)
+            f_implicit_pars.theano_func = f
+            f_implicit_pars.breze_func = True
+            return f_implicit_pars
+
         if not explicit_pars:
             def f_implicit_pars(*args, **kwargs):
                 return f(self.parameters.data, *args, **kwargs)
@@ -677,6 +990,218 @@ class WarnNaNMode(theano.Mode):
             wrap_linker, optimizer='fast_compile')
 
 
+def _iter_theano_variables(obj):
+    if isinstance(obj, theano.Variable):
+        yield obj
+    elif isinstance(obj, (list, tuple)):
+        for i in obj:
+            for j in _iter_theano_variables(i):
+                yield j
+
+
+def iter_layers(obj, seen=None):
+    """Yield all layers found in the attributes of ``obj``, recursively.
+
+    Inner layers are yielded before the layers containing them."""
+    from breze.arch.construct.base import Layer
+    seen = set() if seen is None else seen
+    values = list(obj.__dict__.values())
+    while values:
+        value = values.pop()
+        if isinstance(value, (list, tuple)):
+            values.extend(value)
+        elif isinstance(value, Layer) and id(value) not in seen:
+            seen.add(id(value))
+            for i in iter_layers(value, seen):
+                yield i
+            yield value
+
+
+def tag_layers(model):
+    """Tag each node of the graphs of the layers of ``model`` with the name of
+    the innermost layer it belongs to, as ``node.tag.breze_layer``.
+
+    A node belongs to a layer if it computes one of the variables of the
+    layer from its input ``.inpt`` or from the variables of layers which
+    neither contain it nor are contained in it."""
+    layers = list(iter_layers(model))
+    inner = dict((id(i), set(id(j) for j in iter_layers(i))) for i in layers)
+    variables = dict(
+        (id(i), set(_iter_theano_variables(
+            [v for k, v in i.__dict__.items() if k != 'inpt'])))
+        for i in layers)
+
+    for layer in layers:
+        related = set(id(i) for i in layers
+                      if id(i) in inner[id(layer)]
+                      or id(layer) in inner[id(i)])
+        related.add(id(layer))
+        stops = set(_iter_theano_variables(getattr(layer, 'inpt', None)))
+        for i in layers:
+            if id(i) not in related:
+                stops |= variables[id(i)]
+
+        stack = list(variables[id(layer)])
+        seen = set()
+        while stack:
+            var = stack.pop()
+            if var in stops or var.owner is None or var.owner in seen:
+                continue
+            node = var.owner
+            seen.add(node)
+            if getattr(node.tag, 'breze_layer', None) is None:
+                node.tag.breze_layer = layer.name
+            stack.extend(node.inputs)
+
+
+class ProfileMode(theano.Mode):
+    """ProfileMode class.
+
+    Mode which measures the time spent in each node of compiled functions and
+    the size of the arrays it allocates, accumulated over all calls. Nodes
+    are attributed to the op they apply, to the function (given by the
+    ``name`` argument of ``Model.function``) and to the breze layer they stem
+    from (see ``tag_layers``).
+
+    Attribution to layers relies on tags of the nodes, which graph
+    optimizations do not keep in general. Thus functions are compiled with
+    the ``fast_compile`` optimizer by default; nodes introduced by
+    optimizations are attributed to the layer of the nodes using their
+    results, or else of the nodes computing their inputs.
+
+    Example
+    -------
+
+    >>> profile = model.start_profiling()
+    >>> model.fit(X, Z)
+    >>> model.predict(X)
+    >>> print profile.report()
+    >>> model.stop_profiling()
+
+    Attributes
+    ----------
+
+    node_stats : dictionary
+        Maps ``(function, layer, op)`` triples to lists of the number of
+        calls, the total time in seconds and the total number of bytes
+        allocated.
+
+    function_calls : Counter
+        Number of calls of each function.
+    """
+
+    # Not picklable, since it holds graphs and callbacks. A model drops it on
+    # pickling, like compiled functions.
+    breze_func = True
+
+    unattributed = '<unattributed>'
+
+    def __init__(self, optimizer='fast_compile'):
+        self.node_stats = collections.defaultdict(lambda: [0, 0., 0])
+        self.function_calls = collections.Counter()
+        self._node_keys = {}
+        self._first_nodes = {}
+
+        def profile_eval(i, node, fn):
+            start = time.time()
+            fn()
+            elapsed = time.time() - start
+            key = self._node_keys.get(node)
+            if key is None:
+                key = None, self.unattributed, str(node.op)
+            n_bytes = 0
+            for output in fn.outputs:
+                n_bytes += getattr(output[0], 'nbytes', 0)
+            stats = self.node_stats[key]
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] += n_bytes
+            if node in self._first_nodes:
+                self.function_calls[self._first_nodes[node]] += 1
+
+        wrap_linker = theano.gof.WrapLinkerMany(
+            [theano.gof.OpWiseCLinker()], [profile_eval])
+        super(ProfileMode, self).__init__(wrap_linker, optimizer=optimizer)
+
+    def register(self, f, name):
+        """Attribute the nodes of the compiled function ``f`` to ``name`` and
+        to the layers given by their tags."""
+        nodes = f.maker.fgraph.toposort()
+        layers = {}
+        # Nodes without tag take the layer of a node using their results,
+        # otherwise that of a node computing their inputs.
+        for node in reversed(nodes):
+            layer = getattr(node.tag, 'breze_layer', None)
+            if layer is None:
+                for out in node.outputs:
+                    for client, _ in getattr(out, 'clients', []):
+                        layer = layers.get(client)
+                        if layer is not None:
+                            break
+                    if layer is not None:
+                        break
+            layers[node] = layer
+        for node in nodes:
+            if layers[node] is None:
+                for inpt in node.inputs:
+                    if inpt.owner is not None and layers.get(inpt.owner):
+                        layers[node] = layers[inpt.owner]
+                        break
+            self._node_keys[node] = (
+                name, layers[node] or self.unattributed, str(node.op))
+        if nodes:
+            self._first_nodes[nodes[0]] = name
+
+    def reset(self):
+        """Forget all measurements."""
+        self.node_stats.clear()
+        self.function_calls.clear()
+
+    def stats(self, by='layer', function=None):
+        """Return the measurements aggregated by ``'layer'`` or ``'op'``, as a
+        list of ``(key, calls, seconds, bytes)`` tuples, hottest first.
+
+        If ``function`` is given, only nodes of that function are
+        considered."""
+        index = {'layer': 1, 'op': 2}[by]
+        agg = collections.defaultdict(lambda: [0, 0., 0])
+        for key, (calls, seconds, n_bytes) in self.node_stats.items():
+            if function is not None and key[0] != function:
+                continue
+            this = agg[key[index]]
+            this[0] += calls
+            this[1] += seconds
+            this[2] += n_bytes
+        res = [(k,) + tuple(v) for k, v in agg.items()]
+        res.sort(key=lambda x: -x[2])
+        return res
+
+    def report(self, n=10, by='layer'):
+        """Return a table of the ``n`` hottest layers or ops of each
+        function as a string."""
+        lines = []
+        functions = sorted(set(k[0] for k in self.node_stats), key=str)
+        for function in functions:
+            stats = self.stats(by, function)
+            total = sum(i[2] for i in stats) or 1.
+            lines.append('%s (%i calls, %.6fs)' % (
+                function, self.function_calls[function], total))
+            for key, calls, seconds, n_bytes in stats[:n]:
+                lines.append('  %-40s %6.2f%% %12.6fs %14i bytes' % (
+                    key, 100 * seconds / total, seconds, n_bytes))
+        return '\n'.join(lines)
+
+    def export(self, path):
+        """Write the measurements per function, layer and op to ``path`` as
+        JSON."""
+        rows = [{'function': f, 'layer': l, 'op': o, 'calls': c,
+                 'seconds': t, 'bytes': b}
+                for (f, l, o), (c, t, b) in self.node_stats.items()]
+        with open(path, 'w') as fp:
+            json.dump({'function_calls': dict(self.function_calls),
+                       'nodes': rows}, fp, indent=2)
+
+
 def array_partition_views(array, partition):
     """Return a dictlist with different items corresponding to different sub
     views into an array.
@@ -4,9 +4,14 @@
 learning algorithms."""
 
 
+import collections
+import hashlib
 import itertools
+import sys
+import threading
 import warnings
 import signal
+import weakref
 
 import climin
 import climin.util
@@ -25,6 +30,102 @@ if GPU:
 
 
 from breze.arch.util import Model
+from breze.learn.data import iter_shuffled_minibatches
+from breze.learn.dataset import is_on_disk, iter_chunks
+from breze.learn.parallel import GradientPool
+from breze.learn.prefetch import Prefetcher
+from breze.learn.trainer.best import BestParameters
+from breze.learn.trainer.score import MinibatchScore
+
+
+# Maps ids of arrays passed to ``prepare_array`` to pairs of a weak reference
+# to the array and its prepared version.
+_prepared = {}
+
+# Counts the implicit conversions done by ``cast_array_to_local_type`` per
+# calling location, see ``conversion_counts``.
+_conversion_counts = collections.Counter()
+_conversion_lock = threading.Lock()
+
+
+def prepare_array(arr):
+    """Return an array holding the data of ``arr`` that matches the current
+    theano configuration and can be passed to compiled functions without any
+    further conversion.
+
+    That is, a C-contiguous array of dtype ``theano.config.floatX`` or, if the
+    current device is GPU, a gnumpy.garray. ``arr`` is only copied if
+    necessary.
+
+    The result is remembered for as long as ``arr`` is alive. Passing ``arr``
+    to ``cast_array_to_local_type`` (e.g. by handing it to ``fit`` or
+    ``score``) or to this function again then returns the prepared array
+    instead of converting ``arr`` anew. Minibatches sliced from the prepared
+    array are views which need no conversion either.
+
+    The prepared array is a copy unless ``arr`` already matches, and it is not
+    kept in sync with ``arr``. Hence ``arr`` must not be modified in place
+    afterwards, e.g. by ``breze.learn.data.shuffle``; modify the prepared
+    array instead or call ``unprepare_array`` after modifying ``arr``."""
+    res = _lookup_prepared(arr)
+    if res is not None:
+        return res
+
+    if GPU:
+        res = arr if isinstance(arr, gp.garray) else gp.as_garray(arr)
+    else:
+        res = np.ascontiguousarray(arr, dtype=theano.config.floatX)
+
+    if res is not arr:
+        key = id(arr)
+        try:
+            ref = weakref.ref(arr, lambda _: _prepared.pop(key, None))
+        except TypeError:
+            # Not weak referencable, so we cannot know when the id is reused.
+            return res
+        _prepared[key] = ref, res
+    return res
+
+
+def unprepare_array(arr):
+    """Forget the prepared version of ``arr``, if any, so that ``arr`` is
+    converted anew wherever it is used. Needed after ``arr`` has been
+    modified in place, see ``prepare_array``."""
+    if _lookup_prepared(arr) is not None:
+        del _prepared[id(arr)]
+
+
+def _lookup_prepared(arr, default=None):
+    entry = _prepared.get(id(arr))
+    if entry is not None and entry[0]() is arr:
+        return entry[1]
+    return default
+
+
+def _count_conversion(depth=2):
+    frame = sys._getframe(depth)
+    location = '%s:%i (%s)' % (
+        frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name)
+    with _conversion_lock:
+        _conversion_counts[location] += 1
+
+
+def conversion_counts():
+    """Return a ``collections.Counter`` holding the number of implicit
+    conversions done by ``cast_array_to_local_type``, keyed by the location of
+    the calling code.
+
+    Code paths that show up here with counts growing with the number of
+    iterations copy their data on every step and should work on prepared
+    arrays instead, see ``prepare_array``."""
+    with _conversion_lock:
+        return collections.Counter(_conversion_counts)
+
+
+def reset_conversion_counts():
+    """Reset the counts returned by ``conversion_counts``."""
+    with _conversion_lock:
+        _conversion_counts.clear()
 
 
 def cast_array_to_local_type(arr):
@@ -33,18 +134,39 @@ def cast_array_to_local_type(arr):
 
     That is, if the current device is GPU, make it a gnumpy.garry. If the
     current theano.config.floatX does not match the dtype of arr, return an
-    array that does."""
+    array that does.
+
+    If ``arr`` has been passed to ``prepare_array`` before, the prepared array
+    is returned. Every other conversion is counted, see
+    ``conversion_counts``."""
+    res = _lookup_prepared(arr)
+    if res is not None:
+        return res
+
     res = arr
     if GPU and not isinstance(arr, gp.garray):
         warnings.warn('Implicilty converting numpy.ndarray to gnumpy.garray')
+        _count_conversion()
         res = gp.as_garray(res)
     elif isinstance(arr, np.ndarray) and arr.dtype != theano.config.floatX:
+        _count_conversion()
         res = arr.astype(theano.config.floatX)
     return res
 
 theanox = cast_array_to_local_type
 
 
+def score_on_disk(f_score, arrays, sample_dims):
+    """Return the score of ``f_score`` on ``arrays``, of which at least one is
+    a ``DiskArray``, by averaging over chunks."""
+    chunk_size = min(i.chunk_size for i in arrays if is_on_disk(i))
+
+    def f_score_local(*chunk):
+        return f_score(*[cast_array_to_local_type(i) for i in chunk])
+
+    return MinibatchScore(chunk_size, sample_dims)(f_score_local, *arrays)
+
+
 def assert_ndarray(arr):
     """If ``arr`` is a ``gnumpy.garray``, convert it to a ``numpy.ndarray``.
     Otherwise pass silently."""
@@ -53,19 +175,217 @@ def assert_ndarray(arr):
     return arr
 
 
+def apply_batchwise(f, X, sample_dims, batch_size=None, max_memory=None,
+                    out=None, n_workers=0):
+    """Return the result of applying ``f`` to ``X``, processing ``X`` in
+    batches along its sample dimension.
+
+    The results of the batches are written into a single preallocated array,
+    so that besides the output only the intermediate results of a single
+    batch are held in memory at any time.
+
+    Parameters
+    ----------
+
+    f : callable
+        Function mapping a batch of inputs to a batch of outputs, e.g.
+        ``f_predict`` of a model.
+
+    X : array_like
+        Inputs; numpy arrays, memory maps and ``DiskArray`` objects are
+        supported.
+
+    sample_dims : pair of integers
+        Axes along which the samples are stored in the input and the output.
+
+    batch_size : integer, optional
+        Number of samples per batch.
+
+    max_memory : integer, optional
+        Upper bound in bytes for the input and output of a batch; used to
+        determine the batch size if ``batch_size`` is not given. Intermediate
+        results of ``f`` grow with the batch size as well, so this has to be
+        chosen accordingly.
+
+    out : array_like, optional
+        Array to write the result into, e.g. a ``np.memmap``. If not given, a
+        new array is allocated.
+
+    n_workers : integer, optional, default: 0
+        If positive, that many threads slice and cast the upcoming batches
+        while ``f`` is applied to the current one.
+
+    Returns
+    -------
+
+    out : array_like
+        Result of ``f`` on all of ``X``.
+    """
+    in_dim, out_dim = sample_dims
+    n_samples = X.shape[in_dim]
+    if batch_size is None and max_memory is None:
+        batch_size = X.chunk_size if is_on_disk(X) else n_samples
+    if (batch_size is not None and batch_size >= n_samples and out is None
+            and not is_on_disk(X)):
+        return f(cast_array_to_local_type(X))
+
+    def batch(arr, dim, start, stop):
+        return arr[(slice(None),) * dim + (slice(start, stop),)]
+
+    # Find out the shape and size of the output from a single sample.
+    probe = assert_ndarray(f(cast_array_to_local_type(
+        np.asarray(batch(X, in_dim, 0, 1)))))
+    if batch_size is None:
+        in_bytes = np.dtype(theano.config.floatX).itemsize * (
+            np.prod(X.shape) // max(n_samples, 1))
+        batch_size = max(1, int(max_memory // (in_bytes + probe.nbytes)))
+
+    out_shape = list(probe.shape)
+    out_shape[out_dim] = n_samples
+    if out is None:
+        out = np.empty(out_shape, dtype=probe.dtype)
+    elif tuple(out.shape) != tuple(out_shape):
+        raise ValueError('out has shape %s, need %s' % (
+            tuple(out.shape), tuple(out_shape)))
+
+    if n_workers or is_on_disk(X):
+        n_workers = max(n_workers, 1)
+        batches = Prefetcher(
+            [X], batch_size, [in_dim], n_workers=n_workers,
+            queue_size=2 * n_workers, sequential=True, n_cycles=1,
+            transform=None if GPU else cast_array_to_local_type)
+    else:
+        batches = ((batch(X, in_dim, i, i + batch_size),)
+                   for i in range(0, n_samples, batch_size))
+
+    try:
+        start = 0
+        for x, in batches:
+            y = assert_ndarray(f(cast_array_to_local_type(x)))
+            stop = start + y.shape[out_dim]
+            out[(slice(None),) * out_dim + (slice(start, stop),)] = y
+            start = stop
+    finally:
+        if isinstance(batches, Prefetcher):
+            batches.close()
+
+    return out
+
+
+def clip_length(arr, threshold):
+    """Rescale ``arr`` in place so that its length does not exceed
+    ``threshold`` and return it."""
+    length = np.sqrt((arr ** 2).sum())
+    if  length > threshold:
+        arr /= length
+        arr *= threshold
+    return arr
+
+
 def make_clipper(threshold):
     def clip_if_long(func):
         def inner(*args, **kwargs):
             res = func(*args, **kwargs)
-            length = np.sqrt((res ** 2).sum())
-            if  length > threshold:
-                res /= length
-                res *= threshold
-            return res
+            return clip_length(res, threshold)
         return inner
     return clip_if_long
 
 
+def split_fused(f_loss_dloss, clip_threshold=None):
+    """Given a function returning the pair ``(loss, d_loss)``, return a pair
+    of functions ``(f_loss, f_d_loss)`` which return one item each.
+
+    Both functions evaluate ``f_loss_dloss`` and pick the respective item. The
+    fused function is exposed as the ``fused`` attribute of both, so that
+    callers needing loss and gradient at the same time can evaluate it only
+    once.
+
+    If ``clip_threshold`` is not None, the gradient is rescaled to be not
+    longer than it."""
+    if clip_threshold is not None:
+        f_unclipped = f_loss_dloss
+
+        def f_loss_dloss(*args, **kwargs):
+            loss, d_loss = f_unclipped(*args, **kwargs)
+            return loss, clip_length(d_loss, clip_threshold)
+        f_loss_dloss.breze_func = True
+
+    def f_loss(*args, **kwargs):
+        return f_loss_dloss(*args, **kwargs)[0]
+
+    def f_d_loss(*args, **kwargs):
+        return f_loss_dloss(*args, **kwargs)[1]
+
+    for f in f_loss, f_d_loss:
+        f.fused = f_loss_dloss
+        f.breze_func = True
+
+    return f_loss, f_d_loss
+
+
+def parameter_fingerprint(arr):
+    """Return a short digest of the contents of the numpy array ``arr``."""
+    return hashlib.sha1(np.ascontiguousarray(arr)).digest()
+
+
+def memoize_loss(f_loss, f_d_loss, f_loss_dloss=None):
+    """Return a pair ``(f, fprime)`` of functions backed by ``f_loss`` and
+    ``f_d_loss`` and, if given, by ``f_loss_dloss``, which returns the pair
+    ``(loss, d_loss)``.
+
+    Both functions share a cache holding the results of the last evaluation.
+    The cache is keyed on a fingerprint of the parameters and on the identity
+    of the remaining arguments. Repeated calls at the same parameters and
+    data, as performed by line search optimizers, are thus served from the
+    cache. If ``f_loss_dloss`` is given, it computes both values at once;
+    consecutive calls to ``f`` and ``fprime`` then evaluate it only once.
+
+    Since optimizers might modify gradients in place, a cached gradient is
+    handed out as is only once and copied afterwards."""
+    last = {'key': None}
+
+    def entry(pars, args, kwargs):
+        key = (parameter_fingerprint(pars),
+               tuple(id(i) for i in args),
+               tuple(sorted((k, id(v)) for k, v in kwargs.items())))
+        if last['key'] != key:
+            # Holding references to the arguments makes sure that their ids
+            # are not reused by other objects while they are part of the key.
+            last.clear()
+            last.update(key=key, refs=(args, kwargs), d_loss_served=False)
+        return last
+
+    def evaluate(pars, args, kwargs, item):
+        cached = entry(pars, args, kwargs)
+        if item not in cached:
+            if f_loss_dloss is not None:
+                cached['loss'], cached['d_loss'] = f_loss_dloss(
+                    pars, *args, **kwargs)
+            elif item == 'loss':
+                cached['loss'] = f_loss(pars, *args, **kwargs)
+            else:
+                cached['d_loss'] = f_d_loss(pars, *args, **kwargs)
+        return cached
+
+    def f(pars, *args, **kwargs):
+        return evaluate(pars, args, kwargs, 'loss')['loss']
+
+    def fprime(pars, *args, **kwargs):
+        cached = evaluate(pars, args, kwargs, 'd_loss')
+        if cached['d_loss_served']:
+            return cached['d_loss'].copy()
+        cached['d_loss_served'] = True
+        return cached['d_loss']
+
+    return f, fprime
+
+
+def memoize_fused(f_loss_dloss):
+    """Return a pair ``(f, fprime)`` of functions backed by ``f_loss_dloss``,
+    which returns the pair ``(loss, d_loss)``; see ``memoize_loss``."""
+    return memoize_loss(None, None, f_loss_dloss)
+
+
 class BrezeWrapperBase(object):
     """Class that helps with wrapping Breze models."""
 
@@ -75,11 +395,172 @@ class BrezeWrapperBase(object):
     # default.
     imp_weight = False
 
+    # If True, the loss and its gradient are compiled into a single function
+    # which evaluates both in one pass; see ``_make_fused_loss_functions``.
+    # ``score`` then uses that function as well, unless the model scores
+    # another expression than its loss, and is not compiled separately.
+    fuse_loss = True
+
+    # Number of threads preparing minibatches in the background during
+    # ``iter_fit``. If 0, minibatches are prepared on demand. See
+    # ``breze.learn.prefetch.Prefetcher`` for the meaning of the others.
+    # ``prefetch_shuffle`` applies without workers as well; minibatches are
+    # then gathered through a permutation, see
+    # ``breze.learn.data.iter_shuffled_minibatches``.
+    n_prefetch_workers = 0
+    prefetch_queue_size = 4
+    prefetch_shuffle = False
+
+    # Prefetcher of the running call to ``iter_fit``, if any. Holds counters on
+    # how long training waited for data. Closed once fitting ends.
+    prefetcher = None
+
+    # If any of these is set, ``predict``, ``transform`` and ``reconstruct``
+    # process their input in batches to bound memory usage; see
+    # ``apply_batchwise``.
+    predict_batch_size = None
+    predict_max_memory = None
+    n_predict_workers = 0
+
+    # If positive, ``iter_fit`` computes losses and gradients data parallel in
+    # that many processes; see ``breze.learn.parallel.GradientPool``.
+    n_grad_workers = 0
+    grad_pool = None
+
+    # If set, ``powerfit`` keeps the best parameters in a memory mapped file
+    # of that name instead of in memory.
+    best_pars_storage = None
+
+    def _apply_batchwise(self, f, X, sample_dims, batch_size=None, out=None):
+        if batch_size is None:
+            batch_size = self.predict_batch_size
+        return apply_batchwise(
+            f, X, sample_dims, batch_size=batch_size,
+            max_memory=self.predict_max_memory, out=out,
+            n_workers=self.n_predict_workers)
+
+    def _close_prefetcher(self):
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+            self.prefetcher = None
+
+    def _iter_minibatches(self, arrays, sample_dims):
+        """Return an iterator over tuples of minibatches of ``arrays``, cast
+        to the local type.
+
+        If ``.n_prefetch_workers`` is positive, the minibatches are prepared by
+        background threads. This is always the case if any of ``arrays`` is
+        stored on disk."""
+        self._close_prefetcher()
+
+        # Slicing prepared arrays gives minibatches which need no conversion.
+        arrays = [_lookup_prepared(i, i) for i in arrays]
+
+        n_workers = self.n_prefetch_workers
+        if any(is_on_disk(i) for i in arrays):
+            n_workers = max(n_workers, 1)
+
+        if not n_workers:
+            if self.prefetch_shuffle:
+                data = iter_shuffled_minibatches(
+                    arrays, self.batch_size, sample_dims)
+            else:
+                data = iter_minibatches(arrays, self.batch_size, sample_dims)
+            return (tuple(cast_array_to_local_type(i) for i in batch)
+                    for batch in data)
+
+        # Transfers to the GPU are left to the training thread.
+        self.prefetcher = Prefetcher(
+            arrays, self.batch_size, sample_dims,
+            n_workers=n_workers,
+            queue_size=max(self.prefetch_queue_size, n_workers),
+            shuffle=self.prefetch_shuffle,
+            transform=None if GPU else cast_array_to_local_type)
+        if GPU:
+            return (tuple(cast_array_to_local_type(i) for i in batch)
+                    for batch in self.prefetcher)
+        return self.prefetcher
+
+    def _make_grad_pool(self, f_loss, f_d_loss, sample_dims):
+        """Return a pair ``(f_loss, f_d_loss)`` of functions which evaluate the
+        given ones data parallel in ``.n_grad_workers`` processes.
+
+        The pool of processes is kept in ``.grad_pool``; a previous one is
+        stopped. Parameters private to the process are moved to shared memory
+        first, so that the workers read them in place."""
+        if GPU:
+            raise ValueError('data parallel gradients are not supported on '
+                             'the GPU')
+        if self.grad_pool is not None:
+            self.grad_pool.close()
+        if self.parameters.storage is None:
+            self.parameters.relocate('shared')
+        self.grad_pool = GradientPool(
+            f_loss, f_d_loss, self.parameters.data, sample_dims,
+            self.n_grad_workers)
+        return self.grad_pool.f, self.grad_pool.fprime
+
     def _d_loss(self):
         """Return a theano expression for the gradient of the loss wrt the
         flat parameters of the model."""
         return T.grad(self.exprs['loss'], self.parameters.flat)
 
+    def _make_fused_loss_functions(self, inpts, d_loss=None, mode=None,
+                                   givens=None, on_unused_input='raise',
+                                   clip_threshold=None):
+        """Return pair (f_loss, f_d_loss) of functions which share a single
+        compiled function.
+
+        Loss and gradient are declared as the outputs of one Theano function.
+        The graph optimizer thus only runs once over their common subgraph and
+        both are obtained from a single forward and backward pass. The
+        compiled function is available as the ``fused`` attribute of each of
+        the returned functions.
+
+        Parameters
+        ----------
+
+        inpts : list
+            Inputs of the functions, passed on to ``.function()``.
+
+        d_loss : Theano expression, optional
+            Gradient of the loss wrt the flat parameters. If None,
+            ``._d_loss()`` is used.
+
+        clip_threshold : float, optional
+            If given, gradients are rescaled to be not longer than this.
+        """
+        if d_loss is None:
+            d_loss = self._d_loss()
+        givens = {} if givens is None else givens
+        f_loss_dloss = self.function(
+            inpts, ['loss', d_loss], explicit_pars=True, mode=mode,
+            givens=givens, on_unused_input=on_unused_input,
+            name='loss,d_loss')
+        return split_fused(f_loss_dloss, clip_threshold)
+
+    def _make_fused_score_function(self, imp_weight=False):
+        """Return a score function slicing the compiled function of the loss
+        and its gradient, which is compiled if necessary, or None if the
+        model does not score its loss with a fused function.
+
+        Scoring thus does not compile a function of its own, at the cost of a
+        needless backward pass per call."""
+        if (not self.fuse_loss or 'true_loss' in self.exprs
+                or imp_weight != bool(self.imp_weight)):
+            return None
+        if self._f_loss is None or self._f_dloss is None:
+            self._f_loss, self._f_dloss = self._make_loss_functions(
+                imp_weight=imp_weight)
+        fused = getattr(self._f_loss, 'fused', None)
+        if fused is None:
+            return None
+
+        def f_score(*data):
+            return fused(self.parameters.data, *data)[0]
+        f_score.breze_func = True
+        return f_score
+
     def _make_optimizer(self, f, fprime, args, wrt=None, f_Hp=None, info=None):
         if isinstance(self.optimizer, (str, unicode)):
             ident = self.optimizer
@@ -92,6 +573,14 @@ class BrezeWrapperBase(object):
         # unpicklability of the object.
         kwargs = kwargs.copy()
 
+        # Make sure loss and gradient are only evaluated once per parameter
+        # vector; if they stem from a single compiled function, both at once.
+        if not GPU:
+            fused = getattr(fprime, 'fused', None)
+            if fused is None or getattr(f, 'fused', None) is not fused:
+                fused = None
+            f, fprime = memoize_loss(f, fprime, fused)
+
         kwargs['f'] = f
         kwargs['fprime'] = fprime
 
@@ -122,7 +611,10 @@ class BrezeWrapperBase(object):
         optimize the loss. It is augmented with the keys `loss`, `best_pars`
         and `best_loss`. The best loss is obtained by evaluating the loss of
         the model (given by model.exprs['loss']) on `eval_data`, while training
-        is done on `fit_data`.
+        is done on `fit_data`. `best_pars` refers to the buffer of a
+        ``breze.learn.trainer.best.BestParameters`` object, which is updated in
+        place; if ``.best_pars_storage`` is set, it is memory mapped to the
+        file of that name.
 
         This method respects a ``true_loss`` entry in the ``exprs``
         dictionary: if it is present, it will be used for reporting the loss
@@ -146,8 +638,7 @@ class BrezeWrapperBase(object):
         self.CTRL_C_FLAG = False
         signal.signal(signal.SIGINT, self._ctrl_c_handler)
 
-        best_pars = None
-        best_loss = float('inf')
+        best = BestParameters(self.best_pars_storage)
 
         for info in self.iter_fit(*fit_data):
             if report(info):
@@ -160,12 +651,10 @@ class BrezeWrapperBase(object):
                         info['loss'] = 0.
                 info['val_loss'] = ma.scalar(self.score(*eval_data))
 
-                if info['val_loss'] < best_loss:
-                    best_loss = info['val_loss']
-                    best_pars = self.parameters.data.copy()
-
-                info['best_loss'] = best_loss
-                info['best_pars'] = best_pars
+                best.update(info['val_loss'], self.parameters.data,
+                            info.get('n_iter'))
+                info['best_loss'] = best.loss
+                info['best_pars'] = best.data
 
                 yield info
 
@@ -227,18 +716,28 @@ class SupervisedModel(Model, BrezeWrapperBase):
 
          - f_loss returns the current loss,
          - f_d_loss returns the gradient of that loss wrt parameters,
+
+        If ``.fuse_loss`` is True, both are backed by a single compiled
+        function, see ``._make_fused_loss_functions()``.
         """
-        d_loss = self._d_loss()
         givens = {} if givens is None else givens
         inpts = ['inpt', 'target']
         if imp_weight:
             inpts += ['imp_weight']
+
+        if self.fuse_loss:
+            return self._make_fused_loss_functions(
+                inpts, mode=mode, givens=givens,
+                on_unused_input=on_unused_input,
+                clip_threshold=self.gradient_clip_threshold)
+
+        d_loss = self._d_loss()
         f_loss = self.function(inpts, 'loss', explicit_pars=True,
                                mode=mode, givens=givens,
                                on_unused_input=on_unused_input)
         f_d_loss = self.function(
             inpts, d_loss, explicit_pars=True, mode=mode,
-            givens=givens, on_unused_input=on_unused_input)
+            givens=givens, on_unused_input=on_unused_input, name='d_loss')
 
         if self.gradient_clip_threshold is not None:
             clipper = make_clipper(self.gradient_clip_threshold)
@@ -248,6 +747,8 @@ class SupervisedModel(Model, BrezeWrapperBase):
 
     def _make_args(self, X, Z, imp_weight=None):
         batch_size = getattr(self, 'batch_size', None)
+        if batch_size is None and any(is_on_disk(i) for i in (X, Z)):
+            raise ValueError('need a batch size to fit data stored on disk')
         if batch_size is None:
             X, Z = cast_array_to_local_type(X), cast_array_to_local_type(Z)
             if imp_weight is not None:
@@ -259,17 +760,11 @@ class SupervisedModel(Model, BrezeWrapperBase):
             raise ValueError('need strictly positive batch size')
         else:
             if imp_weight is not None:
-                data = iter_minibatches([X, Z, imp_weight], self.batch_size,
-                                        list(self.sample_dim) + [self.sample_dim[0]])
-                data = ((cast_array_to_local_type(x),
-                         cast_array_to_local_type(z),
-                         cast_array_to_local_type(w)) for x, z, w in data)
+                data = self._iter_minibatches(
+                    [X, Z, imp_weight],
+                    list(self.sample_dim) + [self.sample_dim[0]])
             else:
-                data = iter_minibatches([X, Z], self.batch_size,
-                                        self.sample_dim)
-
-                data = ((cast_array_to_local_type(x),
-                         cast_array_to_local_type(z)) for x, z in data)
+                data = self._iter_minibatches([X, Z], self.sample_dim)
 
         args = ((i, {}) for i in data)
         return args
@@ -296,11 +791,24 @@ class SupervisedModel(Model, BrezeWrapperBase):
             self._f_loss, self._f_dloss = self._make_loss_functions(
                 imp_weight=(imp_weight is not None))
 
-        args = self._make_args(X, Z, imp_weight)
-        opt = self._make_optimizer(self._f_loss, self._f_dloss, args, info=info_opt)
+        f_loss, f_dloss = self._f_loss, self._f_dloss
+        if self.n_grad_workers:
+            # Fork before any prefetching threads are started.
+            f_loss, f_dloss = self._make_grad_pool(
+                f_loss, f_dloss,
+                list(self.sample_dim) + [self.sample_dim[0]])
+
+        try:
+            args = self._make_args(X, Z, imp_weight)
+            opt = self._make_optimizer(f_loss, f_dloss, args, info=info_opt)
 
-        for i, info in enumerate(opt):
-            yield info
+            for i, info in enumerate(opt):
+                yield info
+        finally:
+            if self.n_grad_workers:
+                self.grad_pool.close()
+                self.grad_pool = None
+            self._close_prefetcher()
 
     def fit(self, X, Z, imp_weight=None):
         """Fit the parameters of the model to the given data with the
@@ -324,9 +832,9 @@ class SupervisedModel(Model, BrezeWrapperBase):
 
     def _make_predict_functions(self):
         """Return a function to predict targets from input sequences."""
-        return self.function(['inpt'], 'output')
+        return self.function(['inpt'], 'output', name='predict')
 
-    def predict(self, X):
+    def predict(self, X, batch_size=None, out=None):
         """Return the prediction of the model given the input.
 
         Parameters
@@ -335,25 +843,34 @@ class SupervisedModel(Model, BrezeWrapperBase):
         X : array_like
             Input to the model.
 
+        batch_size : integer, optional
+            If given, ``X`` is processed in batches of that many samples.
+            Defaults to ``.predict_batch_size``.
+
+        out : array_like, optional
+            Array to write the prediction into, e.g. a ``np.memmap``.
+
         Returns
         -------
 
         Y : array_like
         """
-        X = cast_array_to_local_type(X)
         if self.f_predict is None:
             self.f_predict = self._make_predict_functions()
-        Y = self.f_predict(X)
 
-        return Y
+        return self._apply_batchwise(self.f_predict, X, self.sample_dim,
+                                     batch_size, out)
 
     def _make_score_function(self, imp_weight=False):
         """Return a function to predict targets from input sequences."""
+        f_score = self._make_fused_score_function(imp_weight)
+        if f_score is not None:
+            return f_score
         key = 'true_loss' if 'true_loss' in self.exprs else 'loss'
         inpts = ['inpt', 'target']
         if imp_weight:
             inpts += ['imp_weight']
-        return self.function(inpts, key)
+        return self.function(inpts, key, name='score')
 
     def score(self, X, Z, imp_weight=None):
         """Return the score of the model given the input and targets.
@@ -373,13 +890,20 @@ class SupervisedModel(Model, BrezeWrapperBase):
         l : scalar
             Score of the model.
         """
+        if self.f_score is None:
+            self.f_score = self._make_score_function(
+                imp_weight=(imp_weight is not None))
+
+        data = [X, Z] if imp_weight is None else [X, Z, imp_weight]
+        if any(is_on_disk(i) for i in data):
+            sample_dims = list(self.sample_dim) + [self.sample_dim[0]]
+            return score_on_disk(self.f_score, data,
+                                 sample_dims[:len(data)])
+
         X = cast_array_to_local_type(X)
         Z = cast_array_to_local_type(Z)
         if imp_weight is not None:
             imp_weight = cast_array_to_local_type(imp_weight)
-        if self.f_score is None:
-            self.f_score = self._make_score_function(
-                imp_weight=(imp_weight is not None))
         if imp_weight is None:
             return self.f_score(X, Z)
         return self.f_score(X, Z, imp_weight)
@@ -426,17 +950,26 @@ class UnsupervisedModel(Model, BrezeWrapperBase):
 
          - f_loss returns the current loss,
          - f_d_loss returns the gradient of that loss wrt parameters,
+
+        If ``.fuse_loss`` is True, both are backed by a single compiled
+        function, see ``._make_fused_loss_functions()``.
         """
-        d_loss = self._d_loss()
         givens = {} if givens is None else givens
 
         args = ['inpt'] if not imp_weight else ['inpt', 'imp_weight']
 
+        if self.fuse_loss:
+            return self._make_fused_loss_functions(
+                args, mode=mode, givens=givens,
+                on_unused_input=on_unused_input,
+                clip_threshold=self.gradient_clip_threshold)
+
+        d_loss = self._d_loss()
         f_loss = self.function(args, 'loss', explicit_pars=True, mode=mode,
                                givens=givens, on_unused_input=on_unused_input)
         f_d_loss = self.function(
             args, d_loss, explicit_pars=True, givens=givens, mode=mode,
-            on_unused_input=on_unused_input)
+            on_unused_input=on_unused_input, name='d_loss')
 
         if self.gradient_clip_threshold is not None:
             clipper = make_clipper(self.gradient_clip_threshold)
@@ -467,11 +1000,15 @@ class UnsupervisedModel(Model, BrezeWrapperBase):
             raise ValueError('do not need ``W``.')
 
         arg_args = [X, W] if use_imp_weight else [X]
-        args = self._make_args(*arg_args)
-        opt = self._make_optimizer(self._f_loss, self._f_dloss, args, info=info_opt)
+        try:
+            args = self._make_args(*arg_args)
+            opt = self._make_optimizer(self._f_loss, self._f_dloss, args,
+                                       info=info_opt)
 
-        for i, info in enumerate(opt):
-            yield info
+            for i, info in enumerate(opt):
+                yield info
+        finally:
+            self._close_prefetcher()
 
     def fit(self, X, W=None):
         """Fit the parameters of the model.
@@ -506,26 +1043,32 @@ class UnsupervisedModel(Model, BrezeWrapperBase):
         if use_imp_weight:
             sample_dim.append(sample_dim[0])
 
+        if batch_size is None and any(is_on_disk(i) for i in item):
+            raise ValueError('need a batch size to fit data stored on disk')
         if batch_size is None:
             data = itertools.repeat(item)
+            if use_imp_weight:
+                data = ((cast_array_to_local_type(x),
+                         cast_array_to_local_type(w))
+                        for x, w in data)
+            else:
+                data = ((cast_array_to_local_type(x),)
+                        for x, in data)
         elif batch_size < 1:
             raise ValueError('need strictly positive batch size')
         else:
-            data = iter_minibatches(item, self.batch_size, sample_dim)
-        if use_imp_weight:
-            data = ((cast_array_to_local_type(x), cast_array_to_local_type(w))
-                    for x, w in data)
-        else:
-            data = ((cast_array_to_local_type(x),)
-                    for x, in data)
+            data = self._iter_minibatches(item, sample_dim)
         args = ((i, {}) for i in data)
         return args
 
     def _make_score_function(self):
         """Return a function to predict targets from input sequences."""
+        f_score = self._make_fused_score_function(bool(self.imp_weight))
+        if f_score is not None:
+            return f_score
         key = 'true_loss' if 'true_loss' in self.exprs else 'loss'
         args = ['inpt'] if not self.imp_weight else ['inpt', 'imp_weight']
-        return self.function(args, key)
+        return self.function(args, key, name='score')
 
     def score(self, X, W=None):
         """Return the score of the model given the input and targets.
@@ -542,10 +1085,15 @@ class UnsupervisedModel(Model, BrezeWrapperBase):
         l : scalar
             Score of the model.
         """
-        X = cast_array_to_local_type(X)
         if self.f_score is None:
             self.f_score = self._make_score_function()
         args = [X] if W is None else [X, W]
+        if any(is_on_disk(i) for i in args):
+            sample_dims = list(self.sample_dim) * len(args)
+            return score_on_disk(self.f_score, args, sample_dims[:len(args)])
+
+        X = cast_array_to_local_type(X)
+        args = [X] if W is None else [X, W]
         l = self.f_score(*args)
 
         return l
@@ -559,10 +1107,11 @@ class TransformBrezeWrapperMixin(object):
     def _make_transform_function(self):
         """Return a callable f which does the feature transform of this model.
         """
-        f_transform = self.function(['inpt'], self.transform_expr_name)
+        f_transform = self.function(['inpt'], self.transform_expr_name,
+                                    name='transform')
         return f_transform
 
-    def transform(self, X):
+    def transform(self, X, batch_size=None, out=None):
         """Return the feature representation of the model given X.
 
         Parameters
@@ -571,18 +1120,24 @@ class TransformBrezeWrapperMixin(object):
         X : array_like
             Represents the inputs to be transformed.
 
+        batch_size : integer, optional
+            If given, ``X`` is processed in batches of that many samples.
+            Defaults to ``.predict_batch_size``.
+
+        out : array_like, optional
+            Array to write the features into, e.g. a ``np.memmap``.
+
         Returns
         -------
 
         Y : array_like
             Transformation of X under the model.
         """
-        X = cast_array_to_local_type(X)
         if self.f_transform is None:
             self.f_transform = self._make_transform_function()
-        Y = self.f_transform(X)
-
-        return Y
+        sample_dim = self.sample_dim[0]
+        return self._apply_batchwise(self.f_transform, X,
+                                     (sample_dim, sample_dim), batch_size, out)
 
 
 class ReconstructBrezeWrapperMixin(object):
@@ -590,15 +1145,20 @@ class ReconstructBrezeWrapperMixin(object):
     def _make_reconstruct_function(self):
         """Return a callable f which does the reconstruction of this model.
         """
-        f_reconstruct = self.function(['inpt'], 'output')
+        f_reconstruct = self.function(['inpt'], 'output', name='reconstruct')
         return f_reconstruct
 
-    def reconstruct(self, X):
+    def reconstruct(self, X, batch_size=None, out=None):
         """Return the input reconstruction of the model given X.
 
         :param X: An array representing the inputs.
+        :param batch_size: If given, ``X`` is processed in batches of that
+            many samples. Defaults to ``.predict_batch_size``.
+        :param out: Array to write the reconstructions into.
         :returns: An array representing the reconstructions of the input.
         """
         if self.f_reconstruct is None:
             self.f_reconstruct = self._make_reconstruct_function()
-        return self.f_reconstruct(X)
+        sample_dim = self.sample_dim[0]
+        return self._apply_batchwise(self.f_reconstruct, X,
+                                     (sample_dim, sample_dim), batch_size, out)
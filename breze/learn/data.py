@@ -5,6 +5,9 @@ import random
 
 import numpy as np
 import scipy.interpolate
+import theano
+
+from numpy.lib.stride_tricks import as_strided
 
 from sklearn.utils import check_random_state
 
@@ -27,29 +30,108 @@ def one_hot(array, n_classes=None):
     return arr
 
 
-def shuffle(data):
-    """Shuffle the first dimension of an indexable object in place."""
-    for i in range(len(data) - 2):
-        swappartner = random.randint(i + 1, len(data) - 1)
-        a, b = data[swappartner][:], data[i][:]
-        data[i][:], data[swappartner][:] = b, a
-
+def shuffle(data, random_state=None, chunk_size=None):
+    """Shuffle the first dimension of an indexable object in place.
 
-def shuffle_many(arrays, axes, random_state=None):
+    Arrays are shuffled with ``shuffle_many``; other objects, such as lists,
+    need to support slice assignment."""
+    if isinstance(data, np.ndarray):
+        shuffle_many([data], [0], random_state, chunk_size)
+        return
     rng = check_random_state(random_state)
+    permutation = rng.permutation(len(data))
+    data[:] = [data[i] for i in permutation]
+
+
+def _chunk_size(arrays, max_bytes=2 ** 26):
+    row_bytes = max(max(i[0].nbytes for i in arrays), 1)
+    return max(max_bytes // row_bytes, 1)
 
+
+def permute_many(arrays, axes, permutation, chunk_size=None):
+    """Permute the arrays in ``arrays`` along the corresponding axes in
+    ``axes`` in place, such that the element at index ``i`` afterwards is the
+    one at index ``permutation[i]`` before.
+
+    The permutation is applied blockwise with fancy indexing, with blocks of
+    ``chunk_size`` elements along the axis. Besides index arrays, the memory
+    needed is bounded by twice a block. If ``chunk_size`` is not given, blocks
+    are about 64MB."""
     # We need to swap the axes of the arrays so that the axes along to shuffle
     # is the first for each. We don't need to swap back, since these will be
     # views.
     arrays = [i.swapaxes(0, j) for i, j in zip(arrays, axes)]
+    n = arrays[0].shape[0]
+    if any(i.shape[0] != n for i in arrays[1:]):
+        raise ValueError('arrays to be permuted have different lengths')
+    if n == 0:
+        return
+    if chunk_size is None:
+        chunk_size = _chunk_size(arrays)
+
+    permutation = np.asarray(permutation)
+    # For each position the original index of the element at it, and for
+    # each original index its position.
+    occupant = np.arange(n)
+    location = np.arange(n)
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        wanted = permutation[start:stop]
+        # Positions before start are final, so the wanted elements are all at
+        # or after it.
+        sources = location[wanted]
+        targets = np.arange(start, stop)
+
+        # Elements in the block which are not wanted there move to the
+        # positions the wanted ones leave.
+        vacated = sources[sources >= stop]
+        displaced = targets[~np.in1d(targets, sources, assume_unique=True)]
 
-    assert all(i.shape[0] == arrays[0].shape[0] for i in arrays[1:])
+        for a in arrays:
+            block = a[sources]
+            a[vacated] = a[displaced]
+            a[start:stop] = block
 
-    permutation = rng.permutation(arrays[0].shape[0])
+        moved = occupant[displaced]
+        occupant[vacated] = moved
+        location[moved] = vacated
+        occupant[start:stop] = wanted
+        location[wanted] = targets
 
-    for old_index, new_index in enumerate(permutation):
-        for a in arrays:
-            a[old_index], a[new_index] = a[new_index], a[old_index]
+
+def shuffle_many(arrays, axes, random_state=None, chunk_size=None):
+    """Shuffle the arrays in ``arrays`` along the corresponding axes in
+    ``axes`` in place, all with the same permutation.
+
+    See ``permute_many`` for ``chunk_size``."""
+    rng = check_random_state(random_state)
+    n = arrays[0].shape[axes[0]]
+    permute_many(arrays, axes, rng.permutation(n), chunk_size)
+
+
+def iter_shuffled_minibatches(arrays, batch_size, sample_dims,
+                              random_state=None, n_cycles=False):
+    """Return an iterator over tuples of minibatches of ``arrays``, with the
+    samples permuted anew for each pass over the data.
+
+    Instead of shuffling the data, the samples of each minibatch are gathered
+    with an index array. The indices are sorted within a minibatch, which
+    makes gathering faster and works for arrays supporting indexing with
+    sorted indices only, such as ``h5py`` datasets.
+
+    If ``n_cycles`` is False, the passes continue forever."""
+    rng = check_random_state(random_state)
+    n = arrays[0].shape[sample_dims[0]]
+    if any(a.shape[d] != n for a, d in zip(arrays[1:], sample_dims[1:])):
+        raise ValueError('arrays to be batched have different lengths')
+    cycle = 0
+    while n_cycles is False or cycle < n_cycles:
+        permutation = rng.permutation(n)
+        for start in range(0, n, batch_size):
+            idxs = np.sort(permutation[start:start + batch_size])
+            yield tuple(a[(slice(None),) * d + (idxs,)]
+                        for a, d in zip(arrays, sample_dims))
+        cycle += 1
 
 
 def padzeros(lst, front=True, return_mask=False):
@@ -87,6 +169,67 @@ def padzeros(lst, front=True, return_mask=False):
     return data
 
 
+def pad_sequences(seqs, length=None):
+    """Return an array of shape `(length, n, d)` holding the `n` sequences of
+    shape `(t, d)` in the list `seqs`, each padded with zeros at the end to
+    `length`, and a mask of the same shape which is 1 for time steps of the
+    sequences and 0 for padding. The mask is of ``theano.config.floatX``,
+    whatever the type of the sequences.
+
+    If `length` is not given, the length of the longest sequence is used."""
+    if length is None:
+        length = max(len(i) for i in seqs)
+    dim = seqs[0].shape[1]
+    padded = np.zeros((length, len(seqs), dim), dtype=seqs[0].dtype)
+    mask = np.zeros((length, len(seqs), dim), dtype=theano.config.floatX)
+    for i, seq in enumerate(seqs):
+        padded[:len(seq), i] = seq
+        mask[:len(seq), i] = 1
+    return padded, mask
+
+
+def iter_bucketed_minibatches(X, Z, batch_size, W=None, random_state=None,
+                              n_cycles=False, normalize=True):
+    """Return an iterator over minibatches `(X, Z, W)` of sequences of
+    similar length, padded to the longest sequence in the minibatch.
+
+    `X` and `Z` are lists of input and target sequences of shape `(t, d)`,
+    where `t` may vary between pairs. For each pass over the data, the
+    sequences are sorted by length, with ties broken randomly, and split
+    into minibatches of `batch_size`, which are yielded in random order.
+
+    Inputs and targets are given as arrays of shape `(t, n, d)`, i.e. with
+    samples along axis 1, as recurrent networks expect them. `W` holds
+    importance weights of the shape of the targets, which are 0 for padding.
+    They are the given weights, a list of arrays like `Z`, if any, and 1
+    otherwise. If `normalize` is True, the weights are scaled such that a
+    loss averaging over all time steps and samples averages over the steps
+    of the sequences only.
+
+    If `n_cycles` is False, the passes continue forever."""
+    rng = check_random_state(random_state)
+    if len(X) != len(Z):
+        raise ValueError('need as many targets as inputs')
+    lengths = np.array([len(i) for i in X])
+    cycle = 0
+    while n_cycles is False or cycle < n_cycles:
+        order = np.lexsort((rng.random_sample(len(X)), lengths))
+        batches = [order[i:i + batch_size]
+                   for i in range(0, len(X), batch_size)]
+        rng.shuffle(batches)
+        for idxs in batches:
+            inpt, _ = pad_sequences([X[i] for i in idxs])
+            target, mask = pad_sequences([Z[i] for i in idxs])
+            if W is not None:
+                weights, _ = pad_sequences([W[i] for i in idxs])
+                mask *= weights
+            if normalize:
+                n_steps = lengths[idxs].sum()
+                mask *= float(target.shape[0] * target.shape[1]) / n_steps
+            yield inpt, target, mask
+        cycle += 1
+
+
 def collapse_seq_borders(arr):
     """Given an array of ndim 3, return a view of ndim 2 where the first
     dimension is flattened out."""
@@ -154,14 +297,33 @@ def n_windows(X, size, offset):
     return max(int(math.ceil((X.shape[0] - size + 1.) / offset)), 0)
 
 
+def window_view(seq, size, offset=1):
+    """Return a read only view on the sequence `seq`, an array representing a
+    sequence along its first axis, of shape `(n, size) + seq.shape[1:]`,
+    holding the `n` windows of `size` with `offset` that fit into it.
+
+    No data is copied; the windows share the memory of `seq`."""
+    n = n_windows(seq, size, offset)
+    if n == 0:
+        return np.empty((0, size) + seq.shape[1:], dtype=seq.dtype)
+    strides = (seq.strides[0] * offset,) + seq.strides
+    return as_strided(seq, shape=(n, size) + seq.shape[1:], strides=strides,
+                      writeable=False)
+
+
 def windowify(X, size, offset=1):
     """Return a static array that represents a sliding window dataset of size
     `size` given by the list of arrays `."""
-    windows = []
-    for i, window in enumerate(iter_windows(X, size, offset)):
-        windows.append(window[np.newaxis])
-
-    return np.concatenate(windows)
+    if not len(X):
+        raise ValueError('need at least one sequence to windowify')
+    views = [window_view(seq, size, offset) for seq in X]
+    windows = np.empty((sum(len(i) for i in views),) + views[0].shape[1:],
+                       dtype=np.result_type(*views))
+    start = 0
+    for view in views:
+        windows[start:start + len(view)] = view
+        start += len(view)
+    return windows
 
 
 def iter_windows(X, size, offset=1):
@@ -169,12 +331,78 @@ def iter_windows(X, size, offset=1):
     time window.
 
     `X` is expected to be a list of arrays, where each array represents a
-    sequence along its first axis."""
+    sequence along its first axis. The windows are writable views on the
+    sequences; see `window_view` for read only windows of all of a sequence
+    at once."""
     for seq in X:
-        for j in [k * offset for k in range(n_windows(seq, size, offset))]:
+        for j in xrange(0, n_windows(seq, size, offset) * offset, offset):
             yield seq[j:j + size]
 
 
+class WindowBatch(object):
+    """WindowBatch class.
+
+    Batch of windows taken from several sequences, as given by
+    `iter_window_batches`. The windows are held as views on the sequences
+    until they are materialized into an array of shape
+    `(len(batch), size) + seq.shape[1:]`, either explicitly or by using the
+    batch where numpy expects an array.
+
+    Attributes
+    ----------
+
+    pieces : list of arrays
+        Consecutive windows of a sequence each, as given by `window_view`.
+    """
+
+    def __init__(self, pieces):
+        self.pieces = pieces
+
+    def __len__(self):
+        return sum(len(i) for i in self.pieces)
+
+    def materialize(self, out=None):
+        """Return the windows as an array, written into `out` if given."""
+        if out is None:
+            out = np.empty((len(self),) + self.pieces[0].shape[1:],
+                           dtype=self.pieces[0].dtype)
+        elif out.shape[0] != len(self):
+            out = out[:len(self)]
+        start = 0
+        for piece in self.pieces:
+            out[start:start + len(piece)] = piece
+            start += len(piece)
+        return out
+
+    def __array__(self, dtype=None):
+        arr = self.materialize()
+        return arr if dtype is None else arr.astype(dtype)
+
+
+def iter_window_batches(X, size, offset=1, batch_size=128):
+    """Return an iterator over batches of `batch_size` sliding windows of
+    `size` with `offset`, taken from the sequences in the list `X` in order.
+
+    The batches are `WindowBatch` objects, which do not copy any data until
+    they are materialized. The last batch might be smaller."""
+    pieces = []
+    n = 0
+    for seq in X:
+        view = window_view(seq, size, offset)
+        start = 0
+        while start < len(view):
+            stop = min(start + batch_size - n, len(view))
+            pieces.append(view[start:stop])
+            n += stop - start
+            start = stop
+            if n == batch_size:
+                yield WindowBatch(pieces)
+                pieces = []
+                n = 0
+    if pieces:
+        yield WindowBatch(pieces)
+
+
 def split(X, maxlength):
     """Return a list of sequences where each sequence has a length of at most
     `maxlength`.
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+"""Module for data sets that are stored on disk.
+
+Learners usually expect their data to be given as in memory arrays. Data sets
+which do not fit into memory can be wrapped into a ``DiskArray``, which reads
+only the parts currently needed from a memory mapped file or an HDF5 data set.
+``iter_fit``, ``score`` and ``predict`` of the learners in ``breze.learn``
+then stream over the data in chunks, reading the next chunks from disk in the
+background while the current one is processed.
+
+Example
+-------
+
+>>> X = DiskArray.from_hdf5('data.h5', 'train/inpt', chunk_size=4096)
+>>> Z = DiskArray.from_hdf5('data.h5', 'train/target', chunk_size=4096)
+>>> model = Mlp(X.shape[1], [512], Z.shape[1], ['tanh'], 'identity',
+...             'squared', batch_size=128)
+>>> model.fit(X, Z)
+>>> Y = model.predict(X)
+>>> X.close()
+>>> Z.close()
+"""
+
+
+import numpy as np
+
+from breze.learn.prefetch import Prefetcher
+
+
+class DiskArray(object):
+    """DiskArray class.
+
+    Wraps an array like object stored on disk, such as an ``np.memmap`` or an
+    ``h5py`` data set. Indexing a ``DiskArray`` reads the corresponding part
+    from disk into a numpy array.
+
+    Code which is not aware of ``DiskArray`` objects can still use them, since
+    they can be converted to a numpy array via ``np.asarray``. This reads the
+    whole array into memory, though.
+
+    Attributes
+    ----------
+
+    source : array_like
+        Object holding the data. Has to support ``.shape``, ``.dtype`` and
+        slicing.
+
+    chunk_size : integer
+        Number of samples that are read at once when streaming over the
+        data.
+
+    read_ahead : integer
+        Number of chunks that are read in the background while the current
+        chunk is being processed.
+
+    file : file like or None
+        File opened for ``source`` by the DiskArray, which is closed by
+        ``close`` or when leaving a ``with`` block.
+    """
+
+    file = None
+
+    def __init__(self, source, chunk_size=1024, read_ahead=2):
+        """Create a DiskArray object.
+
+        Parameters
+        ----------
+
+        source : array_like
+            Object holding the data, e.g. an ``np.memmap`` or an ``h5py``
+            data set.
+
+        chunk_size : integer, optional, default: 1024
+            Number of samples that are read at once when streaming over the
+            data.
+
+        read_ahead : integer, optional, default: 2
+            Number of chunks that are read in the background while the current
+            chunk is being processed.
+        """
+        self.source = source
+        self.chunk_size = chunk_size
+        self.read_ahead = read_ahead
+
+    @classmethod
+    def from_memmap(cls, filename, dtype, shape, offset=0, **kwargs):
+        """Return a DiskArray for a read only memory mapped file.
+
+        All further keyword arguments are passed on to ``__init__``."""
+        source = np.memmap(filename, dtype=dtype, mode='r', offset=offset,
+                           shape=shape)
+        return cls(source, **kwargs)
+
+    @classmethod
+    def from_hdf5(cls, filename, path, **kwargs):
+        """Return a DiskArray for the data set at ``path`` in the HDF5 file
+        ``filename``.
+
+        All further keyword arguments are passed on to ``__init__``."""
+        import h5py
+        f = h5py.File(filename, 'r')
+        try:
+            arr = cls(f[path], **kwargs)
+        except Exception:
+            f.close()
+            raise
+        arr.file = f
+        return arr
+
+    def close(self):
+        """Close the file opened for the data, if any."""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def shape(self):
+        return self.source.shape
+
+    @property
+    def ndim(self):
+        return len(self.source.shape)
+
+    @property
+    def dtype(self):
+        return self.source.dtype
+
+    def __len__(self):
+        return self.source.shape[0]
+
+    def __getitem__(self, index):
+        # Copying makes sure the data is actually read here and not when the
+        # pages of a memory map are first touched.
+        return np.array(self.source[index])
+
+    def __array__(self, dtype=None):
+        arr = self[...]
+        if dtype is not None:
+            arr = arr.astype(dtype)
+        return arr
+
+
+def is_on_disk(arr):
+    """Return True iff ``arr`` is a ``DiskArray``."""
+    return isinstance(arr, DiskArray)
+
+
+def iter_chunks(arrays, sample_dims, chunk_size=None, read_ahead=None,
+                transform=None):
+    """Return an iterator over consecutive chunks of ``arrays``.
+
+    Each item is a tuple holding the chunk of each array; chunks are aligned
+    along the sample dimensions. The iterator stops after one pass over the
+    data. Chunks are read in a background thread.
+
+    Parameters
+    ----------
+
+    arrays : list of array_like
+        Arrays to iterate over; ``DiskArray`` objects and numpy arrays can be
+        mixed.
+
+    sample_dims : list of integers
+        For each array, the axis along which the samples are stored.
+
+    chunk_size : integer, optional
+        Number of samples per chunk. Defaults to the smallest ``chunk_size``
+        of the ``DiskArray`` objects in ``arrays``.
+
+    read_ahead : integer, optional
+        Number of chunks to read ahead. Defaults to the largest
+        ``read_ahead`` of the ``DiskArray`` objects in ``arrays``.
+
+    transform : callable, optional
+        Applied to each array of each chunk in the background thread, e.g. to
+        cast it to the right type.
+
+    Returns
+    -------
+
+    chunks : Prefetcher object
+        Iterator over tuples of arrays.
+    """
+    on_disk = [i for i in arrays if is_on_disk(i)]
+    if chunk_size is None:
+        chunk_size = min(i.chunk_size for i in on_disk)
+    if read_ahead is None:
+        read_ahead = max(i.read_ahead for i in on_disk) if on_disk else 1
+    return Prefetcher(arrays, chunk_size, sample_dims, n_workers=1,
+                      queue_size=max(read_ahead, 1), sequential=True,
+                      transform=transform, n_cycles=1)
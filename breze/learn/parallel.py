@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+"""Module for computing losses and gradients data parallel over several
+processes.
+
+A ``GradientPool`` forks a number of worker processes, each of which holds its
+own copy of the compiled loss and gradient functions of a model. A minibatch is
+split into one shard per worker; the workers evaluate the functions on their
+shards and the results are combined into the loss and gradient of the whole
+minibatch.
+
+Parameters and gradients are exchanged through shared memory: the workers
+read the parameters in place from a shared buffer, which is best the parameter
+array of the model itself (see ``breze.arch.util.ParameterSet.alloc``), and
+each worker writes its gradient into its own row of a shared buffer. Only the
+shards of the minibatch are sent through pipes.
+
+Since losses are averages over samples, the results of the shards are
+averaged with weights proportional to the number of samples in them. This
+gives the exact loss and gradient of the minibatch, including constant terms
+such as weight decay.
+
+Example
+-------
+
+>>> model = Mlp(784, [800], 10, ['tanh'], 'softmax', 'nce', batch_size=1024)
+>>> model.n_grad_workers = 8
+>>> model.fit(X, Z)
+"""
+
+
+import ctypes
+import multiprocessing
+import traceback
+
+import numpy as np
+import theano
+
+
+def _shared_array(shape, dtype):
+    """Return a numpy array of ``shape`` and ``dtype`` in shared memory which
+    is inherited by forked processes."""
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape))
+    buf = multiprocessing.RawArray(ctypes.c_char, max(size, 1) * dtype.itemsize)
+    return np.frombuffer(buf, dtype=dtype, count=size).reshape(shape)
+
+
+def _same_array(a, b):
+    """Return whether ``a`` and ``b`` are views of the same memory."""
+    a, b = np.asarray(a), np.asarray(b)
+    return (a.__array_interface__['data'][0] ==
+            b.__array_interface__['data'][0]
+            and a.shape == b.shape and a.strides == b.strides
+            and a.dtype == b.dtype)
+
+
+def split_batch(args, sample_dims, n_shards):
+    """Return a list of at most ``n_shards`` tuples, splitting each of the
+    arrays in ``args`` along its sample dimension into consecutive parts of
+    nearly equal size.
+
+    Empty shards are left out."""
+    n_samples = args[0].shape[sample_dims[0]]
+    bounds = np.linspace(0, n_samples, n_shards + 1).astype('int64')
+    shards = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        if start == stop:
+            continue
+        shards.append(tuple(
+            a[(slice(None),) * d + (slice(start, stop),)]
+            for a, d in zip(args, sample_dims)))
+    return shards
+
+
+def _work(conn, funcs, pars, losses, grads, idx):
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        which, args, kwargs = msg
+        try:
+            if which == 'f':
+                losses[idx] = funcs[0](pars, *args, **kwargs)
+            else:
+                grads[idx] = funcs[1](pars, *args, **kwargs)
+            conn.send(None)
+        except Exception:
+            conn.send(traceback.format_exc())
+
+
+class GradientPool(object):
+    """GradientPool class.
+
+    Evaluates a loss function and its gradient data parallel over a pool of
+    worker processes. The functions are inherited by the workers on forking,
+    thus compiled functions work without being pickled.
+
+    Attributes
+    ----------
+
+    n_workers : integer
+        Number of worker processes.
+
+    sample_dims : list of integers
+        For each argument of the loss, the axis along which the samples are
+        stored.
+
+    f : callable
+        Computes the loss of the whole minibatch given the parameters and the
+        minibatch, with the same signature as the wrapped loss.
+
+    fprime : callable
+        Computes the gradient of the whole minibatch, just like ``f``.
+    """
+
+    # Tag this object to be removed on pickling a model, like compiled
+    # functions; see ``breze.arch.util.Model.__getstate__``.
+    breze_func = True
+
+    def __init__(self, f_loss, f_d_loss, pars, sample_dims, n_workers):
+        """Create a GradientPool object and start the workers.
+
+        Parameters
+        ----------
+
+        f_loss : callable
+            Loss function, called as ``f_loss(pars, *args, **kwargs)``.
+
+        f_d_loss : callable
+            Gradient of ``f_loss`` with the same signature.
+
+        pars : integer or array_like
+            Either the number of parameters, for which a shared buffer is
+            allocated, or a flat array in shared memory inherited by forked
+            processes, e.g. ``ParameterSet.data`` after ``alloc('shared')``.
+            The workers read the parameters from it in place; only parameters
+            passed in other arrays are copied into it before an evaluation.
+
+        sample_dims : list of integers
+            For each array of a minibatch, the axis along which the samples
+            are stored.
+
+        n_workers : integer
+            Number of worker processes.
+        """
+        if n_workers < 1:
+            raise ValueError('need at least one worker')
+        self.n_workers = n_workers
+        self.sample_dims = sample_dims
+
+        dtype = theano.config.floatX
+        if isinstance(pars, (int, long)):
+            pars = _shared_array((pars,), dtype)
+        self.pars = pars
+        self.grads = _shared_array((n_workers, pars.size), dtype)
+        self.losses = _shared_array((n_workers,), 'float64')
+
+        self.conns = []
+        self.processes = []
+        for i in range(n_workers):
+            conn, child_conn = multiprocessing.Pipe()
+            p = multiprocessing.Process(
+                target=_work,
+                args=(child_conn, (f_loss, f_d_loss), self.pars, self.losses,
+                      self.grads, i))
+            p.daemon = True
+            p.start()
+            self.conns.append(conn)
+            self.processes.append(p)
+
+        self.f = self._make_func('f')
+        self.fprime = self._make_func('fprime')
+
+    def _run(self, which, pars, args, kwargs):
+        if not _same_array(pars, self.pars):
+            self.pars[...] = pars
+        shards = split_batch(args, self.sample_dims, self.n_workers)
+        for conn, shard in zip(self.conns, shards):
+            conn.send((which, shard, kwargs))
+
+        errors = [conn.recv() for conn in self.conns[:len(shards)]]
+        errors = [i for i in errors if i is not None]
+        if errors:
+            raise RuntimeError('error in gradient worker:\n%s' % errors[0])
+
+        n_samples = args[0].shape[self.sample_dims[0]]
+        weights = np.array([float(s[0].shape[self.sample_dims[0]]) / n_samples
+                            for s in shards])
+        if which == 'f':
+            return np.dot(weights, self.losses[:len(shards)])
+        return np.dot(weights, self.grads[:len(shards)]).astype(
+            self.grads.dtype)
+
+    def _make_func(self, which):
+        def inner(pars, *args, **kwargs):
+            return self._run(which, pars, args, kwargs)
+        inner.breze_func = True
+        return inner
+
+    def close(self):
+        """Stop the worker processes."""
+        for conn in self.conns:
+            try:
+                conn.send(None)
+            except (IOError, OSError):
+                pass
+        for p in self.processes:
+            p.join()
+        self.conns = []
+        self.processes = []
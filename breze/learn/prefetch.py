@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+
+"""Module for preparing minibatches in the background.
+
+Training loops spend a part of every iteration on slicing minibatches out of
+the data and converting them to the right type (see
+``breze.learn.base.cast_array_to_local_type``). The ``Prefetcher`` moves this
+work to a pool of worker threads, which prepare upcoming minibatches while the
+compiled functions of a model run on the current one.
+
+Since the heavy lifting (copying, casting, gathering rows) is done by numpy,
+which releases the GIL for these operations, the worker threads run
+concurrently with Theano.
+"""
+
+
+import Queue
+import threading
+import time
+
+import numpy as np
+
+
+class Prefetcher(object):
+    """Prefetcher class.
+
+    Iterator over minibatches of several arrays which are prepared by
+    background threads. The semantics follow those of
+    ``climin.util.iter_minibatches``: the arrays are split into consecutive
+    minibatches along their sample dimensions and the minibatches are visited
+    in random order, cycling forever. If ``shuffle`` is True, the samples are
+    permuted anew for every pass over the data instead. If ``sequential`` is
+    True, the minibatches are visited in order, which is useful for streaming
+    over data stored on disk.
+
+    The arrays only need to support slicing (and, for ``shuffle``, indexing
+    with sorted index arrays) along their sample dimension. This makes it
+    possible to read minibatches from ``h5py`` datasets or memory mapped
+    files in the background.
+
+    The order in which minibatches are yielded does not depend on the number
+    of workers.
+
+    Attributes
+    ----------
+
+    n_workers : integer
+        Number of worker threads.
+
+    queue_size : integer
+        Maximum number of minibatches that are being prepared or ready to be
+        consumed at any time.
+
+    n_batches : integer
+        Number of minibatches yielded so far.
+
+    n_stalls : integer
+        Number of times a minibatch was requested but not ready yet.
+
+    wait_time : float
+        Total time in seconds spent waiting for minibatches.
+    """
+
+    # Tag this object to be removed on pickling a model, like compiled
+    # functions; see ``breze.arch.util.Model.__getstate__``.
+    breze_func = True
+
+    poll_interval = 0.1
+
+    def __init__(self, arrays, batch_size, sample_dims, n_workers=1,
+                 queue_size=4, shuffle=False, sequential=False,
+                 transform=None, n_cycles=False, random_state=None):
+        """Create a Prefetcher object.
+
+        Parameters
+        ----------
+
+        arrays : list of array_like
+            Arrays to draw minibatches from. All have to hold the same number of
+            samples.
+
+        batch_size : integer
+            Number of samples per minibatch.
+
+        sample_dims : list of integers
+            For each array, the axis along which the samples are stored.
+
+        n_workers : integer, optional, default: 1
+            Number of worker threads.
+
+        queue_size : integer, optional, default: 4
+            Maximum number of minibatches being prepared or ready at any time.
+            Has to be at least ``n_workers``.
+
+        shuffle : boolean, optional, default: False
+            If True, samples are permuted for every pass over the data.
+            Otherwise only the order of the minibatches is.
+
+        sequential : boolean, optional, default: False
+            If True, minibatches are yielded in the order they appear in the
+            data. Cannot be combined with ``shuffle``.
+
+        transform : callable, optional, default: None
+            If given, applied to each array of a minibatch by the workers, e.g.
+            ``breze.learn.base.cast_array_to_local_type``.
+
+        n_cycles : integer or False, optional, default: False
+            Number of passes over the data. If False, cycle forever.
+
+        random_state : np.random.RandomState or None, optional
+            Random number generator for the order of minibatches and samples.
+        """
+        if batch_size < 1:
+            raise ValueError('need strictly positive batch size')
+        if queue_size < n_workers:
+            raise ValueError('queue_size has to be at least n_workers')
+        if shuffle and sequential:
+            raise ValueError('cannot shuffle sequentially')
+
+        n_samples = [a.shape[d] for a, d in zip(arrays, sample_dims)]
+        if any(n != n_samples[0] for n in n_samples[1:]):
+            raise ValueError('arrays to be batched have different lengths')
+
+        self.arrays = arrays
+        self.batch_size = batch_size
+        self.sample_dims = sample_dims
+        self.n_samples = n_samples[0]
+        self.n_workers = n_workers
+        self.queue_size = queue_size
+        self.shuffle = shuffle
+        self.sequential = sequential
+        self.transform = transform
+        self.n_cycles = n_cycles
+        if random_state is None:
+            random_state = np.random.RandomState()
+        self.random_state = random_state
+
+        self.n_batches = 0
+        self.n_stalls = 0
+        self.wait_time = 0.
+
+        self._tasks = Queue.Queue()
+        self._slots = Queue.Queue(maxsize=queue_size)
+        self._results = {}
+        self._results_cond = threading.Condition()
+        self._next_seq = 0
+        self._n_seq = None
+        self._stopped = threading.Event()
+
+        self._threads = [threading.Thread(target=self._feed)]
+        self._threads += [threading.Thread(target=self._work)
+                          for _ in range(n_workers)]
+        for t in self._threads:
+            t.daemon = True
+            t.start()
+
+    def iter_indices(self):
+        """Return an iterator over the indices of the minibatches, i.e. slices
+        or, if ``shuffle`` is True, arrays of sample indices."""
+        n_cycles = 0
+        starts = range(0, self.n_samples, self.batch_size)
+        while True:
+            if self.shuffle:
+                perm = self.random_state.permutation(self.n_samples)
+                # Sorting the indices of a minibatch makes gathering the rows
+                # more cache friendly.
+                for start in starts:
+                    yield np.sort(perm[start:start + self.batch_size])
+            elif self.sequential:
+                for start in starts:
+                    yield slice(start, start + self.batch_size)
+            else:
+                for i in self.random_state.permutation(len(starts)):
+                    yield slice(starts[i], starts[i] + self.batch_size)
+
+            n_cycles += 1
+            if self.n_cycles and n_cycles >= self.n_cycles:
+                break
+
+    def make_batch(self, index):
+        """Return the minibatch given by ``index`` as a tuple of arrays."""
+        batch = []
+        for arr, d in zip(self.arrays, self.sample_dims):
+            item = arr[(slice(None),) * d + (index,)]
+            if self.transform is not None:
+                item = self.transform(item)
+            batch.append(item)
+        return tuple(batch)
+
+    def _feed(self):
+        seq = 0
+        for index in self.iter_indices():
+            # Wait for a free slot, so that at most ``queue_size`` minibatches
+            # are in the pipeline.
+            while not self._stopped.is_set():
+                try:
+                    self._slots.put(None, timeout=self.poll_interval)
+                    break
+                except Queue.Full:
+                    pass
+            if self._stopped.is_set():
+                return
+            self._tasks.put((seq, index))
+            seq += 1
+
+        with self._results_cond:
+            self._n_seq = seq
+            self._results_cond.notify_all()
+
+        # Tell the workers that there is nothing left to do.
+        for _ in range(self.n_workers):
+            self._tasks.put(None)
+
+    def _work(self):
+        while not self._stopped.is_set():
+            try:
+                task = self._tasks.get(timeout=self.poll_interval)
+            except Queue.Empty:
+                continue
+            if task is None:
+                return
+            seq, index = task
+            try:
+                result = self.make_batch(index), None
+            except Exception as e:
+                result = None, e
+            with self._results_cond:
+                self._results[seq] = result
+                self._results_cond.notify_all()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self._stopped.is_set():
+            raise StopIteration()
+        seq = self._next_seq
+        with self._results_cond:
+            if seq not in self._results:
+                self.n_stalls += 1
+                start = time.time()
+                while seq not in self._results:
+                    if self._n_seq is not None and seq >= self._n_seq:
+                        raise StopIteration()
+                    if self._stopped.is_set():
+                        raise StopIteration()
+                    if self._n_seq is None and not self._threads[0].is_alive():
+                        raise RuntimeError('prefetcher stopped feeding '
+                                           'minibatches unexpectedly')
+                    self._results_cond.wait(self.poll_interval)
+                self.wait_time += time.time() - start
+            batch, error = self._results.pop(seq)
+
+        self._slots.get()
+        if error is not None:
+            self.close()
+            raise error
+        self._next_seq += 1
+        self.n_batches += 1
+        return batch
+
+    def close(self):
+        """Stop the worker threads and wait for them to finish."""
+        self._stopped.set()
+        for t in self._threads:
+            t.join()
+
+    @property
+    def stats(self):
+        """Dictionary holding the counters ``n_batches``, ``n_stalls`` and
+        ``wait_time``."""
+        return {
+            'n_batches': self.n_batches,
+            'n_stalls': self.n_stalls,
+            'wait_time': self.wait_time,
+        }
@@ -11,8 +11,10 @@ import theano.tensor as T
 from breze.arch.component.misc import project_into_l2_ball
 from breze.arch.component.varprop import loss as vp_loss
 from breze.arch.util import ParameterSet, lookup
-from breze.learn.base import SupervisedModel, theanox
-from breze.arch.construct import simple, neural
+from breze.learn.base import (SupervisedModel, theanox,
+                              cast_array_to_local_type, split_fused)
+from breze.learn.data import iter_bucketed_minibatches
+from breze.arch.construct import simple, neural, sequential
 
 
 # TODO check docstrings (e.g. loss is wrong)
@@ -77,9 +79,36 @@ class BaseRnn(object):
 
     verbose : boolean
         Flag indicating whether to print out information during fitting.
+
+    tbptt_steps : integer, None
+        If given, training uses truncated backpropagation through time:
+        the sequences are processed in consecutive chunks of that many time
+        steps, and the gradient of each chunk is only propagated back to its
+        beginning. The state of the recurrent layers at the end of a chunk is
+        the initial state of the next one. Thus memory does not depend on the
+        length of the sequences. None means to backpropagate through whole
+        sequences.
+
+    With ``tbptt_steps``, each iteration of the optimizer processes one
+    chunk. After the last chunk of the sequences of a batch, the next batch
+    starts from the initial state of the model again; the initial state is
+    not adapted during training then.
+
+    Sequences of different lengths can be fit by passing lists of input and
+    target sequences of shape ``(t, d)`` to ``.fit()`` and ``.iter_fit()``.
+    Minibatches are then formed from sequences of similar length and padded
+    only to the longest of them, see
+    ``breze.learn.data.iter_bucketed_minibatches``. The padding is masked out
+    by importance weights, thus the model has to be created with
+    ``imp_weight=True``; giving importance weights is optional in that case.
     """
     # TODO: document imp_weight, ideally with an example.
 
+    # Input of the chunk given to the optimizer last and the states the
+    # recurrent layers ended with on it; see ``_iter_tbptt_args``.
+    _tbptt_chunk = None
+    _tbptt_carry = None
+
     def __init__(self, n_inpt, n_hiddens, n_output,
                  hidden_transfers, out_transfer='identity',
                  loss='squared', pooling=None,
@@ -88,7 +117,10 @@ class BaseRnn(object):
                  batch_size=None,
                  imp_weight=False,
                  max_iter=1000,
-                 verbose=False):
+                 verbose=False,
+                 tbptt_steps=None):
+        if tbptt_steps is not None and pooling is not None:
+            raise ValueError('cannot truncate backpropagation with pooling')
         self.n_inpt = n_inpt
         self.n_hiddens = n_hiddens
         self.n_output = n_output
@@ -102,6 +134,7 @@ class BaseRnn(object):
         self.batch_size = batch_size
         self.max_iter = max_iter
         self.verbose = verbose
+        self.tbptt_steps = tbptt_steps
 
         self._init_exprs()
 
@@ -130,6 +163,9 @@ class BaseRnn(object):
          - f_d_loss returns the gradient of that loss wrt parameters,
            matrix of the loss.
         """
+        if getattr(self, 'tbptt_steps', None):
+            return self._make_tbptt_loss_functions(mode, imp_weight)
+
         d_loss = self._d_loss()
         if self.gradient_clip:
             d_loss = project_into_l2_ball(d_loss, self.gradient_clip)
@@ -137,13 +173,156 @@ class BaseRnn(object):
         args = list(self.data_arguments)
         if imp_weight:
             args += ['imp_weight']
+
+        if self.fuse_loss:
+            return self._make_fused_loss_functions(args, d_loss, mode=mode)
+
         f_loss = self.function(args, 'loss', explicit_pars=True, mode=mode)
         f_d_loss = self.function(args, d_loss, explicit_pars=True, mode=mode)
         return f_loss, f_d_loss
 
+    def _make_fused_score_function(self, imp_weight=False):
+        if getattr(self, 'tbptt_steps', None):
+            # The training function takes the carried states as well.
+            return None
+        return super(BaseRnn, self)._make_fused_score_function(imp_weight)
+
+    def _recurrent_layers(self):
+        return [i for i in getattr(self.rnn, 'layers', [])
+                if hasattr(i, 'carry_initial')]
+
+    def _initial_carry(self, n_samples):
+        """Return the list of arrays the recurrent layers start from for
+        ``n_samples`` sequences, matching the ``carry_initial`` expressions of
+        the layers."""
+        if getattr(self, '_f_initial_carry', None) is None:
+            initial = sum([i.carry_initial for i in self._recurrent_layers()],
+                          [])
+            self._f_initial_carry = self.function(
+                ['inpt'], initial, name='initial_carry')
+        # The initial states only depend on the number of samples.
+        inpt = cast_array_to_local_type(np.zeros((1, n_samples, self.n_inpt)))
+        return list(self._f_initial_carry(inpt))
+
+    def _clone_with_carry(self, exprs):
+        """Return a pair ``(carry, exprs)``.
+
+        ``carry`` is a list of matrices, one for each of the expressions
+        ``carry_initial`` of the recurrent layers. The returned ``exprs`` are
+        clones of the given ones, in which the recurrent layers start from
+        these instead of the initial state of the model. The given ``exprs``
+        may include the ``carry_final`` expressions of the layers."""
+        layers = self._recurrent_layers()
+        if not layers:
+            raise ValueError('model does not support carrying the state of '
+                             'its recurrent layers')
+        initial = sum([i.carry_initial for i in layers], [])
+        return sequential.clone_with_carry(initial, exprs)
+
+    def _make_tbptt_loss_functions(self, mode=None, imp_weight=False):
+        """Return pair `f_loss, f_d_loss` of functions for truncated
+        backpropagation through time.
+
+        Both take the states the recurrent layers start from as additional
+        arguments, following the data; see ``._iter_tbptt_args()``. The
+        states the layers end with are computed along with the loss, and those
+        of the first evaluation on the current chunk are kept for the next
+        one."""
+        # The carried states are inputs to the cloned graph; thus no gradient
+        # flows into the previous chunk.
+        final = sum([i.carry_final for i in self._recurrent_layers()], [])
+        carry, exprs = self._clone_with_carry([self.exprs['loss']] + final)
+        loss, final = exprs[0], exprs[1:]
+        d_loss = T.grad(loss, self.parameters.flat)
+        if self.gradient_clip:
+            d_loss = project_into_l2_ball(d_loss, self.gradient_clip)
+
+        args = list(self.data_arguments)
+        if imp_weight:
+            args += ['imp_weight']
+        f = self.function(args + carry, [loss, d_loss] + final,
+                          explicit_pars=True, mode=mode, name='tbptt')
+
+        def f_loss_dloss(pars, *args):
+            res = f(pars, *args)
+            if self._tbptt_carry is None and args[0] is self._tbptt_chunk:
+                self._tbptt_carry = list(res[2:])
+            return res[0], res[1]
+        f_loss_dloss.breze_func = True
+
+        return split_fused(f_loss_dloss)
+
+    def _iter_tbptt_args(self, X, Z, imp_weight=None):
+        """Yield the arguments for truncated backpropagation through time.
+
+        The samples are taken in batches; the time steps of each batch in
+        chunks of ``.tbptt_steps``, each followed by the states the
+        recurrent layers ended with on the previous chunk.
+
+        These states are returned by the loss function along with the loss,
+        see ``._make_tbptt_loss_functions()``. They are taken from the first
+        evaluation on the previous chunk, which is the one at the parameters
+        the optimizer started the chunk with; further evaluations, e.g. by a
+        line search, do not affect them."""
+        n_time_steps, n_samples = X.shape[:2]
+        batch_size = self.batch_size or n_samples
+        k = self.tbptt_steps
+        while True:
+            for start in range(0, n_samples, batch_size):
+                samples = slice(start, start + batch_size)
+                carry = self._initial_carry(X[:, samples].shape[1])
+                for t in range(0, n_time_steps, k):
+                    data = [X[t:t + k, samples], Z[t:t + k, samples]]
+                    if imp_weight is not None:
+                        data.append(imp_weight[t:t + k, samples])
+                    args = [cast_array_to_local_type(i) for i in data]
+                    self._tbptt_chunk, self._tbptt_carry = args[0], None
+                    yield tuple(args + carry), {}
+                    if t + k < n_time_steps:
+                        if self._tbptt_carry is None:
+                            raise RuntimeError('loss was not evaluated on '
+                                               'the previous chunk')
+                        carry = self._tbptt_carry
+
+    def streaming_predictor(self, n_streams=1):
+        """Return a ``StreamingPredictor`` advancing ``n_streams`` sequences
+        with the current parameters of the model."""
+        return StreamingPredictor(self, n_streams)
+
+    def iter_fit(self, X, Z, imp_weight=None, info_opt=None):
+        if isinstance(X, list) and imp_weight is None and self.imp_weight:
+            # Masks are made when batching, see ``_make_args``.
+            imp_weight = []
+        return super(BaseRnn, self).iter_fit(X, Z, imp_weight, info_opt)
+
+    def _make_args(self, X, Z, imp_weight=None):
+        if getattr(self, 'tbptt_steps', None):
+            if isinstance(X, list):
+                raise ValueError('cannot truncate backpropagation for '
+                                 'sequences of different lengths')
+            if self.n_grad_workers:
+                raise ValueError('cannot truncate backpropagation with '
+                                 'gradient workers')
+            return self._iter_tbptt_args(X, Z, imp_weight)
+        if not isinstance(X, list):
+            return super(BaseRnn, self)._make_args(X, Z, imp_weight)
+        if not self.imp_weight:
+            raise ValueError('need imp_weight=True to fit sequences of '
+                             'different lengths')
+        if self.pooling:
+            raise ValueError('cannot fit sequences of different lengths with '
+                             'pooling')
+        batch_size = self.batch_size or len(X)
+        data = iter_bucketed_minibatches(X, Z, batch_size,
+                                         W=imp_weight or None)
+        return ((tuple(cast_array_to_local_type(i) for i in batch), {})
+                for batch in data)
+
     def __getstate__(self):
         state = self.__dict__.copy()
-        unpicklables = '_f_loss _f_dloss f_predict f_score'.split()
+        unpicklables = ('_f_loss _f_dloss f_predict f_score prefetcher '
+                        'grad_pool _f_initial_carry _tbptt_chunk '
+                        '_tbptt_carry').split()
         for i in unpicklables:
             if i in state:
                 del state[i]
@@ -151,6 +330,108 @@ class BaseRnn(object):
         return state
 
 
+class StreamingPredictor(object):
+    """StreamingPredictor class.
+
+    Predicts the outputs of a recurrent network for many sequences whose time
+    steps arrive one at a time, such as sensor streams. The state of the
+    recurrent layers is kept for each stream between calls, so that each new
+    time step costs the same, instead of the whole sequence being processed
+    again as by ``.predict()`` of the model.
+
+    Example
+    -------
+
+    >>> predictor = model.streaming_predictor(n_streams=1000)
+    >>> for x in arriving_samples:    # x is of shape (1000, n_inpt).
+    ...     y = predictor.step(x)     # y is of shape (1000, n_output).
+
+    Attributes
+    ----------
+
+    model : BaseRnn
+        Model the outputs of which are predicted. Its parameters are used as
+        they are at the time of each call.
+
+    n_streams : integer
+        Number of streams.
+
+    state : list of arrays
+        States of the recurrent layers, each of shape ``(n_streams, d)``;
+        see ``carry_initial`` of ``breze.arch.construct.sequential.Recurrent``.
+        They are updated in place.
+    """
+
+    def __init__(self, model, n_streams=1):
+        """Create a StreamingPredictor object.
+
+        Parameters
+        ----------
+
+        model : BaseRnn
+            Model the outputs of which are predicted. Must not pool over time.
+
+        n_streams : integer, optional, default: 1
+            Number of streams.
+        """
+        if model.pooling:
+            raise ValueError('cannot stream predictions with pooling')
+        self.model = model
+        self.n_streams = n_streams
+
+        final = sum([i.carry_final for i in model._recurrent_layers()], [])
+        carry, exprs = model._clone_with_carry(
+            [model.exprs['output']] + final)
+        self._f_step = model.function(['inpt'] + carry, exprs, name='step')
+        self._initial = model._initial_carry(n_streams)
+        self.state = [np.array(i) for i in self._initial]
+
+    def reset(self, streams=None):
+        """Start the streams of index ``streams``, or all if not given, from
+        the initial state of the model again."""
+        if streams is None:
+            streams = slice(None)
+        for state, initial in zip(self.state, self._initial):
+            state[streams] = initial[streams]
+
+    def advance(self, X, streams=None):
+        """Return the outputs for the next time steps ``X`` of the streams.
+
+        Parameters
+        ----------
+
+        X : array_like
+            Array of shape ``(t, n, d)``, holding the next ``t`` time steps of
+            ``n`` streams.
+
+        streams : array_like, optional
+            Indices of the ``n`` streams in ``X``. If not given, ``X`` holds
+            all streams in order.
+
+        Returns
+        -------
+
+        Y : array_like
+            Array of shape ``(t, n, o)`` holding the outputs.
+        """
+        if streams is None:
+            carry = self.state
+        else:
+            carry = [i[streams] for i in self.state]
+        res = self._f_step(cast_array_to_local_type(X), *carry)
+        for state, new in zip(self.state, res[1:]):
+            if streams is None:
+                state[...] = new
+            else:
+                state[streams] = new
+        return res[0]
+
+    def step(self, x, streams=None):
+        """Return the outputs for the next time step ``x``, an array of shape
+        ``(n, d)``, of the streams; see ``.advance()``."""
+        return self.advance(x[np.newaxis], streams)[0]
+
+
 class SupervisedRnn(BaseRnn, SupervisedModel):
     # TODO document
 
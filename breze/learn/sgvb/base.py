@@ -52,6 +52,71 @@ def estimate_nll(X, f_nll_z, f_nll_x_given_z, f_nll_z_given_x,
     return -ll
 
 
+def estimate_nll_batched(X, f_log_weights, n_samples, sample_axis=0,
+                         batch_size=None, sample_batch_size=128):
+    """Return the same importance sampling estimate of the negative
+    log-likelihood of ``X`` as ``estimate_nll``, drawing the importance
+    samples in batches.
+
+    Parameters
+    ----------
+
+    X : array_like
+        Data to estimate the likelihood of.
+
+    f_log_weights : callable
+        Function taking a part of ``X`` and a number ``k`` and returning, for
+        each of ``k`` samples ``z`` drawn from ``q(z|x)`` for all of the part,
+        the sum of the log importance weights ``log p(x, z) - log q(z|x)``
+        over the part.
+
+    n_samples : integer
+        Number of importance samples.
+
+    sample_axis : integer, optional, default: 0
+        Axis of ``X`` along which its samples are arranged.
+
+    batch_size : integer, optional
+        Number of samples of ``X`` passed to ``f_log_weights`` at a time. All
+        of them if not given.
+
+    sample_batch_size : integer, optional, default: 128
+        Largest number ``k`` of importance samples drawn in one call to
+        ``f_log_weights``.
+
+    The log weights of each batch of importance samples are summed over the
+    parts of ``X`` and then accumulated by an online log-sum-exp, so that
+    memory depends on ``batch_size`` and ``sample_batch_size`` but not on
+    ``n_samples``.
+    """
+    if X.ndim not in (2, 3):
+        raise ValueError('unexpected ndim for X, can be 2 or 3')
+    n_points = X.shape[sample_axis]
+    batch_size = batch_size or n_points
+
+    index = [slice(None)] * X.ndim
+    chunks = []
+    for start in range(0, n_points, batch_size):
+        index[sample_axis] = slice(start, start + batch_size)
+        chunks.append(X[tuple(index)])
+
+    log_sum = -np.inf
+    n_drawn = 0
+    while n_drawn < n_samples:
+        k = min(sample_batch_size, n_samples - n_drawn)
+        d = sum(ma.assert_numpy(f_log_weights(chunk, k)) for chunk in chunks)
+        log_sum = np.logaddexp(log_sum, logsumexp(d))
+        n_drawn += k
+
+    ll = log_sum - np.log(n_samples)
+
+    # Normalize to average.
+    ll /= X.shape[0]
+    if X.ndim == 3:
+        ll /= X.shape[1]
+    return -ll
+
+
 class GenericVariationalAutoEncoder(UnsupervisedModel,
                                     TransformBrezeWrapperMixin,
                                     ReconstructBrezeWrapperMixin):
@@ -222,12 +287,18 @@ class GenericVariationalAutoEncoder(UnsupervisedModel,
                 ['inpt', self.vae.recog_sample], self.rec_loss_sample_wise)
         return self.f_rec_loss_of_sample(X, S)
 
-    def estimate_nll(self, X, n_samples=10):
+    def estimate_nll(self, X, n_samples=10, batch_size=None,
+                     sample_batch_size=128):
         """Return an estimate of the negative log-likelihood of ``X``.
 
         The estimate is obtained via importance sampling, as described in the
         appendix of [DLGM]_.
 
+        The importance samples are drawn within a single compiled function,
+        for which ``X`` is repeated along its sample axis; the results of
+        several calls are combined by an online log-sum-exp. See
+        ``breze.learn.sgvb.base.estimate_nll_batched``.
+
         Parameters
         ----------
 
@@ -238,64 +309,61 @@ class GenericVariationalAutoEncoder(UnsupervisedModel,
             Number of samples for importance sampling. The more, the more
             reliable the estimator becomes.
 
+        batch_size : int, optional
+            Number of samples of ``X`` processed at a time. All if not given.
+
+        sample_batch_size : int, optional, default: 128
+            Number of importance samples drawn at a time. Memory grows with
+            the product of this and ``batch_size``, but not with
+            ``n_samples``.
+
         Returns
         -------
 
-        nll : array_like
-            Array of shape ``(n,)`` where each entry corresponds to the nll of
-            corresponding sample in ``X``.
+        nll : float
+            Estimate of the negative log-likelihood of all of ``X``, divided
+            by the number of its samples and, for sequences, time steps.
         """
         if getattr(self, 'f_estimate_nll', None) is None:
             self.f_estimate_nll = self._make_f_estimate_nll()
-        return self.f_estimate_nll(X, n_samples)
+        sample_axis = 1 if X.ndim == 3 else 0
+        return estimate_nll_batched(
+            X, self.f_estimate_nll, n_samples, sample_axis=sample_axis,
+            batch_size=batch_size, sample_batch_size=sample_batch_size)
 
     def _make_f_estimate_nll(self):
+        """Return a function ``f(X, k)`` giving, for each of ``k`` samples
+        ``z`` drawn from ``q(z|x)`` for all of ``X``, the sum of the log
+        importance weights ``log p(x, z) - log q(z|x)`` over ``X``."""
         ndim = self.vae.recog_sample.ndim
-        if ndim == 3:
-            latent_sample = T.tensor3('sample')
-            latent_sample.tag.test_value = np.zeros(
-                (self.exprs['inpt'].tag.test_value.shape[0],
-                 self.exprs['inpt'].tag.test_value.shape[1],
-                 self.n_latent)).astype(theano.config.floatX)
-        elif ndim == 2:
-            latent_sample = T.matrix('sample')
-            latent_sample.tag.test_value = np.zeros(
-                (self.exprs['inpt'].tag.test_value.shape[0],
-                 self.n_latent)).astype(theano.config.floatX)
-        else:
+        if ndim not in (2, 3):
             raise ValueError('unexpected ndim for samples')
+        sample_axis = 1 if ndim == 3 else 0
+
+        X = self.inpt.type('X')
+        k = T.iscalar('k')
+        if theano.config.compute_test_value != 'off':
+            X.tag.test_value = self.inpt.tag.test_value
+            k.tag.test_value = 1
+
+        # Each sample is repeated k times, so that a sample z is drawn for
+        # each copy of it by the recognition model in the same pass.
+        X_rep = T.repeat(X, k, axis=sample_axis)
+
+        z = self.vae.recog_sample
+        log_prior = -self.vae.prior.nll(z).sum(axis=ndim - 1)
+        log_posterior = -self.vae.gen.nll(self.inpt).sum(axis=ndim - 1)
+        log_recog = -self.vae.recog.nll(z).sum(axis=ndim - 1)
+        log_weights = log_prior + log_posterior - log_recog
+        if ndim == 3:
+            # Sequences have a single weight over all of their time steps.
+            log_weights = log_weights.sum(axis=0)
 
-        # Map a sample s to the prior log probability p(z)
-        nll_z = self.vae.prior.nll(latent_sample).sum(axis=ndim - 1)
-
-        # Depends on the shape of the input otherwis.
-        nll_z = theano.clone(nll_z, {self.recog_sample: latent_sample})
-
-        f_nll_z = self.function([latent_sample], nll_z,
-                                on_unused_input='ignore')
-
-        # Map a given visible x and a sample z to the generating
-        # probability p(x|z).
-        nll_x_given_z = self.vae.gen.nll(
-            self.inpt, self.output).sum(axis=ndim - 1)
-        f_nll_x_given_z = self.function(
-            [self.inpt, latent_sample], nll_x_given_z,
-            givens={self.vae.recog_sample: latent_sample})
-
-        # Map a given visible x and a sample z to the recognition
-        # probability q(z|x).
-        nll_z_given_x = self.vae.recog.nll(latent_sample).sum(axis=ndim - 1)
-        f_nll_z_given_x = self.function(
-            [latent_sample, self.inpt], nll_z_given_x)
-
-        # Sample some z from q(z|x).
-        f_sample_z_given_x = self.function([self.inpt], self.vae.recog_sample)
-
-        def inner(X, n):
-            return estimate_nll(X, f_nll_z, f_nll_x_given_z, f_nll_z_given_x,
-                                f_sample_z_given_x, n)
-
-        # So it gets deleted before pickling.
-        inner.breze_func = True
+        # The copies of a sample are consecutive; the i'th copies of all
+        # samples make up the i'th importance sample of X.
+        log_weights = log_weights.reshape((-1, k)).sum(axis=0)
 
-        return inner
+        # Giving the replacement of the input as ``givens`` instead of
+        # cloning makes sure that the random state is updated properly.
+        return self.function([X, k], log_weights, givens={self.inpt: X_rep},
+                             name='estimate_nll')
@@ -12,6 +12,7 @@ from theano.compile import optdb
 from breze.arch.construct.layer.distributions import NormalGauss
 from breze.arch.construct.layer.varprop.sequential import FDRecurrent
 from breze.arch.construct.layer.varprop.simple import AffineNonlinear
+from breze.arch.construct.sequential import clone_with_carry
 from breze.arch.construct.neural import distributions as neural_dists
 from breze.learn.utils import theano_floatx
 
@@ -183,43 +184,95 @@ class StochasticRnn(GenericVariationalAutoEncoder):
     #        self.f_gen_hiddens = self._make_gen_hidden()
     #    return self.f_gen_hiddens(X)
 
-    def sample(self, n_time_steps, prefix=None, visible_map=False):
+    def _make_gen_step(self):
+        """Return a pair of functions ``(f_initial, f_step)`` running the
+        generating network incrementally.
+
+        Both take the visible values of the previous time steps and the
+        latent samples of the current ones, arrays of shape ``(t, n, d)``.
+        ``f_initial`` returns the initial states of the recurrent layers for
+        them. ``f_step`` takes these states as further arguments and returns
+        the output of the network followed by the states after the last time
+        step."""
+        inpt_m1 = T.tensor3('inpt_m1')
+        inpt_m1.tag.test_value = np.zeros((3, 2, self.n_inpt))
+
+        latent_prior_sample = T.tensor3('latent_prior_sample')
+        latent_prior_sample.tag.test_value = np.zeros((3, 2, self.n_latent))
+
+        gen_inpt_sub = T.concatenate([latent_prior_sample, inpt_m1], axis=2)
+
+        layers = [i for i in self.vae.gen.rnn.layers
+                  if hasattr(i, 'carry_initial')]
+        initial = sum([i.carry_initial for i in layers], [])
+        final = sum([i.carry_final for i in layers], [])
+        exprs = theano.clone(
+            [self.vae.gen.rnn.output] + final + initial,
+            {self.vae.gen.inpt: gen_inpt_sub})
+        output, final, initial = (
+            exprs[0], exprs[1:len(final) + 1], exprs[len(final) + 1:])
+
+        f_initial = self.function(
+            [inpt_m1, latent_prior_sample], initial,
+            on_unused_input='ignore', name='gen_initial')
+
+        carry, exprs = clone_with_carry(initial, [output] + final)
+        f_step = self.function(
+            [inpt_m1, latent_prior_sample] + carry, exprs,
+            on_unused_input='warn', name='gen_step')
+        return f_initial, f_step
+
+    def sample(self, n_time_steps, prefix=None, visible_map=False,
+               n_paths=None):
+        """Return samples of the visibles following ``prefix``.
+
+        The generating network is run over the prefix once; afterwards, each
+        time step is a single step of the network from the state it ended
+        with, so the cost is linear in the number of time steps. All
+        sequences are advanced together.
+
+        Parameters
+        ----------
+
+        n_time_steps : integer
+            Number of time steps to generate.
+
+        prefix : array_like
+            Array of shape ``(t, n, d)`` holding the beginnings of ``n``
+            sequences to continue.
+
+        visible_map : boolean, optional, default: False
+            If True, the most probable visibles are taken at each time step
+            instead of samples.
+
+        n_paths : integer, optional
+            If given, that many independent paths are sampled for each
+            sequence of the prefix. The paths of a sequence are consecutive
+            along the second axis of the result.
+
+        Returns
+        -------
+
+        S : array_like
+            Array of shape ``(n_time_steps - 1, n, d)``, or ``(n_time_steps -
+            1, n * n_paths, d)``, holding the sampled visibles after the first
+            one.
+        """
         if prefix is None:
             raise ValueError('need to give prefix')
+        if n_paths is not None:
+            prefix = np.repeat(prefix, n_paths, axis=1)
 
-        if not hasattr(self, 'f_gen'):
-            vis_sample = self.vae.gen.inpt
+        if getattr(self, '_f_gen_step', None) is None:
+            self._f_gen_initial, self._f_gen_step = self._make_gen_step()
 
-            inpt_m1 = T.tensor3('inpt_m1')
-            inpt_m1.tag.test_value = np.zeros((3, 2, self.n_inpt))
-
-            latent_prior_sample = T.tensor3('latent_prior_sample')
-            latent_prior_sample.tag.test_value = np.zeros((3, 2, self.n_latent))
-
-            gen_inpt_sub = T.concatenate([latent_prior_sample, inpt_m1], axis=2)
-
-            vis_sample = theano.clone(
-                vis_sample,
-                {self.vae.gen.inpt: gen_inpt_sub}
-            )
-
-            gen_out_sub = theano.clone(
-                self.vae.gen.rnn.output, {self.vae.gen.inpt: gen_inpt_sub})
-            self._f_gen_output = self.function(
-                [inpt_m1, latent_prior_sample],
-                gen_out_sub, mode='FAST_COMPILE',
-                on_unused_input ='warn')
-
-            out = self.vae.gen.sample() if not visible_map else self.vae.gen.maximum
-            self._f_visible_sample_by_gen_output = self.function(
-                [self.vae.gen.rnn.output], out,
-                on_unused_input ='warn')
-
-            def f_gen(inpt_m1, latent_prior_sample):
-                rnn_out = self._f_gen_output(inpt_m1, latent_prior_sample)
-                return self._f_visible_sample_by_gen_output(rnn_out)
-
-            self.f_gen = f_gen
+        attr = '_f_visible_map' if visible_map else '_f_visible_sample'
+        if getattr(self, attr, None) is None:
+            out = (self.vae.gen.maximum if visible_map
+                   else self.vae.gen.sample())
+            setattr(self, attr, self.function(
+                [self.vae.gen.rnn.output], out, on_unused_input='warn'))
+        f_visible = getattr(self, attr)
 
         prefix_length = prefix.shape[0]
         S = np.empty(
@@ -232,10 +285,16 @@ class StochasticRnn(GenericVariationalAutoEncoder):
             ).astype(theano.config.floatX)
         latent_samples[prefix_length:] = np.random.standard_normal(
             (n_time_steps, prefix.shape[1], self.n_latent))
+
+        # Time step t of the network sees the visibles of step t, and its
+        # output at step t gives the visibles of step t + 1.
+        start, stop = 0, prefix_length
+        carry = self._f_gen_initial(S[:1], latent_samples[:1])
         for i in range(n_time_steps):
-            p = self.f_gen(
-                S[:prefix_length + i], latent_samples[:prefix_length + i]
-            )[-1, :, :self.n_inpt]
-            S[prefix_length + i] = p
+            res = self._f_gen_step(
+                S[start:stop], latent_samples[start:stop], *carry)
+            rnn_out, carry = res[0], res[1:]
+            S[stop] = f_visible(rnn_out[-1:])[-1, :, :self.n_inpt]
+            start, stop = stop, stop + 1
 
         return S[prefix_length + 1:]
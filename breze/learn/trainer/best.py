@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+"""Module for keeping track of the best parameters found during training.
+
+Whenever the validation loss improves, the parameters are copied into a
+single buffer which is allocated once, instead of into a new array. The
+buffer can be a memory mapped file, so that the best parameters of a large
+model do not need to be held in memory twice.
+
+Info dictionaries hold the buffer itself under ``best_pars``, not a copy of
+the parameters. The store can also be used in place of an array where numpy
+expects one:
+
+>>> best = BestParameters()
+>>> best.update(0.5, model.parameters.data)
+True
+>>> model.parameters.data[...] = best
+"""
+
+
+import numpy as np
+
+
+class BestParameters(object):
+    """BestParameters class.
+
+    Attributes
+    ----------
+
+    storage : string or None
+        If None, the best parameters are held in memory. Otherwise they are
+        stored in a memory mapped file of that name.
+
+    data : array_like or None
+        Best parameters found so far, or None if there have not been any
+        yet. The same array is overwritten with each improvement.
+
+    loss : float
+        Loss of ``data``.
+
+    n_iter : integer or None
+        Iteration in which ``data`` was found, if given to ``update``.
+
+    n_updates : integer
+        Number of improvements so far.
+    """
+
+    def __init__(self, storage=None):
+        """Create a BestParameters object.
+
+        Parameters
+        ----------
+
+        storage : string or None, optional, default: None
+            If given, name of a file to which the best parameters are memory
+            mapped.
+        """
+        self.storage = storage
+        self.data = None
+        self.loss = float('inf')
+        self.n_iter = None
+        self.n_updates = 0
+
+    def _alloc(self, pars):
+        if self.storage is None:
+            return np.empty_like(pars)
+        return np.memmap(self.storage, dtype=pars.dtype, mode='w+',
+                         shape=pars.shape)
+
+    def update(self, loss, pars, n_iter=None):
+        """Store ``pars`` if ``loss`` is lower than that of the best
+        parameters so far; return True if it is."""
+        if not loss < self.loss:
+            return False
+        if (self.data is None or self.data.shape != pars.shape
+                or self.data.dtype != pars.dtype):
+            self.data = self._alloc(pars)
+        self.data[...] = pars
+        self.loss = loss
+        self.n_iter = n_iter
+        self.n_updates += 1
+        return True
+
+    def set(self, pars, loss=None, n_iter=None):
+        """Store ``pars`` regardless of their loss, e.g. to restore them.
+
+        If ``loss`` is not given, the loss of the stored parameters is kept.
+        Passing None for ``pars`` forgets the best parameters."""
+        if pars is None:
+            self.data = None
+        else:
+            pars = np.asarray(pars)
+            if (self.data is None or self.data.shape != pars.shape
+                    or self.data.dtype != pars.dtype):
+                self.data = self._alloc(pars)
+            self.data[...] = pars
+        if loss is not None:
+            self.loss = loss
+        self.n_iter = n_iter
+
+    def flush(self):
+        """Write the best parameters to disk, if memory mapped."""
+        if isinstance(self.data, np.memmap):
+            self.data.flush()
+
+    def copy(self):
+        """Return a copy of the best parameters as an array."""
+        return None if self.data is None else np.array(self.data)
+
+    def __array__(self, dtype=None):
+        if self.data is None:
+            raise ValueError('no best parameters yet')
+        return np.asarray(self.data, dtype=dtype)
+
+    def __nonzero__(self):
+        return self.data is not None
+
+    def __repr__(self):
+        return '<BestParameters loss=%r n_iter=%r>' % (self.loss, self.n_iter)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if isinstance(self.data, np.memmap):
+            # Only the file name is pickled.
+            self.flush()
+            state['data'] = (self.data.dtype.str, self.data.shape)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.storage is not None and isinstance(self.data, tuple):
+            dtype, shape = self.data
+            self.data = np.memmap(self.storage, dtype=dtype, mode='r+',
+                                  shape=shape)
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+
+"""Module for periodically saving the state of a training run to disk.
+
+A checkpoint holds the parameters of the model, the state of the optimizer
+as found in the climin info dictionary and the bookkeeping of the trainer,
+such as the best parameters and the list of infos. It does not hold the
+model itself; training is resumed by restoring a checkpoint into a trainer of
+the same model, so no functions need to be compiled again.
+
+Each checkpoint is a ``.npz`` file in a directory. It is written to a
+temporary file first, which is renamed once it is complete; thus a crash
+never leaves a partial checkpoint behind, and writing a checkpoint does not
+touch the earlier ones. Only the most recent ones are kept.
+
+The state is copied in the training thread, which is cheap; compressing and
+writing it happens in a background thread. The list of infos only grows, so
+each info is pickled once, by the background thread, and the pickles are
+reused for all later checkpoints.
+
+Example
+-------
+
+>>> checkpointer = Checkpointer('checkpoints', every_seconds=600)
+>>> trainer = Trainer(model, data, stop, checkpointer=checkpointer)
+>>> checkpointer.restore(trainer)  # Resume, if there is a checkpoint.
+>>> trainer.fit()
+"""
+
+
+import cPickle
+import cStringIO
+import glob
+import os
+import Queue
+import threading
+import time
+
+import numpy as np
+
+from climin.util import is_array
+
+
+class Checkpointer(object):
+    """Checkpointer class.
+
+    Attributes
+    ----------
+
+    directory : string
+        Directory the checkpoints are written to.
+
+    every_n_iter : integer or None
+        Save a checkpoint every that many iterations.
+
+    every_seconds : float or None
+        Save a checkpoint if that many seconds have passed since the last.
+
+    keep : integer
+        Number of checkpoints to keep.
+
+    compress : boolean
+        If True, checkpoints are compressed.
+    """
+
+    prefix = 'checkpoint-'
+    suffix = '.npz'
+
+    def __init__(self, directory, every_n_iter=None, every_seconds=None,
+                 keep=3, compress=False):
+        """Create a Checkpointer object.
+
+        Parameters
+        ----------
+
+        directory : string
+            Directory the checkpoints are written to. It is created if it
+            does not exist.
+
+        every_n_iter : integer, optional
+            Save a checkpoint every that many iterations.
+
+        every_seconds : float, optional
+            Save a checkpoint if that many seconds have passed since the last.
+
+        keep : integer, optional, default: 3
+            Number of checkpoints to keep.
+
+        compress : boolean, optional, default: False
+            If True, checkpoints are compressed.
+        """
+        if every_n_iter is None and every_seconds is None:
+            raise ValueError('need every_n_iter or every_seconds')
+        if keep < 1:
+            raise ValueError('need to keep at least one checkpoint')
+        self.directory = directory
+        self.every_n_iter = every_n_iter
+        self.every_seconds = every_seconds
+        self.keep = keep
+        self.compress = compress
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._last_time = time.time()
+        self._init_background()
+
+    def _init_background(self):
+        self._queue = Queue.Queue()
+        self._thread = None
+        self._error = None
+
+        # Infos of the trainer handed to the writer so far, and their pickles
+        # made by the writer.
+        self._infos = None
+        self._n_infos = 0
+        self._pickled_infos = []
+
+    def due(self, n_iter):
+        """Return whether a checkpoint is due at iteration ``n_iter``."""
+        if self.every_n_iter is not None and n_iter % self.every_n_iter == 0:
+            return True
+        if (self.every_seconds is not None
+                and time.time() - self._last_time >= self.every_seconds):
+            return True
+        return False
+
+    def path(self, n_iter):
+        return os.path.join(self.directory,
+                            '%s%010d%s' % (self.prefix, n_iter, self.suffix))
+
+    def checkpoints(self):
+        """Return the paths of all checkpoints, oldest first."""
+        return sorted(glob.glob(os.path.join(
+            self.directory, self.prefix + '*' + self.suffix)))
+
+    def latest(self):
+        """Return the path of the most recent checkpoint or None."""
+        paths = self.checkpoints()
+        return paths[-1] if paths else None
+
+    def snapshot(self, trainer, info):
+        """Return the arrays making up a checkpoint of ``trainer`` at ``info``,
+        except for the list of infos; see ``save``.
+
+        All arrays are copies, so that training can continue while they are
+        written."""
+        arrays = {'parameters': np.array(trainer.model.parameters.data)}
+
+        # The best parameters are stored by value, since a memory mapped
+        # store pickles its file name only, which is overwritten later on.
+        best = trainer.best
+        if best.data is not None:
+            arrays['best/data'] = np.array(best.data)
+        arrays['best/loss'] = np.array(best.loss)
+        arrays['best/n_updates'] = np.array(best.n_updates)
+        if best.n_iter is not None:
+            arrays['best/n_iter'] = np.array(best.n_iter)
+
+        scalars = {}
+        for key, value in info.items():
+            if key in ('args', 'kwargs', 'best_pars'):
+                continue
+            if is_array(value):
+                arrays['info/' + key] = np.array(value)
+            else:
+                scalars[key] = value
+
+        bookkeeping = {
+            'info': scalars,
+            'stopped': trainer.stopped,
+        }
+        arrays['bookkeeping'] = np.frombuffer(
+            cPickle.dumps(bookkeeping, cPickle.HIGHEST_PROTOCOL),
+            dtype='uint8')
+        return arrays
+
+    def save(self, trainer, info):
+        """Save a checkpoint of ``trainer`` at ``info`` in the background."""
+        self.raise_error()
+        self._last_time = time.time()
+
+        # Only infos added since the last checkpoint are handed over, unless
+        # the trainer has started a new list.
+        infos = trainer.infos
+        if infos is not self._infos or len(infos) < self._n_infos:
+            self._infos, self._n_infos = infos, 0
+        start, self._n_infos = self._n_infos, len(infos)
+
+        self._queue.put((info['n_iter'], self.snapshot(trainer, info),
+                         start, infos[start:]))
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._work)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def maybe_save(self, trainer, info):
+        """Save a checkpoint of ``trainer`` at ``info`` if one is due; return
+        whether it was."""
+        if not self.due(info['n_iter']):
+            return False
+        self.save(trainer, info)
+        return True
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    break
+                if self._error is None:
+                    n_iter, arrays, start, new_infos = item
+                    arrays['infos'] = self._pickle_infos(start, new_infos)
+                    self.write(n_iter, arrays)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _pickle_infos(self, start, new_infos):
+        """Return the infos as an array of concatenated pickles, given the
+        ones from index ``start`` on."""
+        del self._pickled_infos[start:]
+        self._pickled_infos.extend(
+            cPickle.dumps(i, cPickle.HIGHEST_PROTOCOL) for i in new_infos)
+        return np.frombuffer(''.join(self._pickled_infos), dtype='uint8')
+
+    def write(self, n_iter, arrays):
+        """Write ``arrays`` as the checkpoint of iteration ``n_iter`` and
+        remove old checkpoints."""
+        path = self.path(n_iter)
+        tmp_path = path + '.tmp'
+        save = np.savez_compressed if self.compress else np.savez
+        with open(tmp_path, 'wb') as fp:
+            save(fp, **arrays)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.rename(tmp_path, path)
+        self._sync_directory()
+
+        for old in self.checkpoints()[:-self.keep]:
+            os.remove(old)
+
+    def _sync_directory(self):
+        # Make the rename durable.
+        try:
+            fd = os.open(self.directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def raise_error(self):
+        """Raise an error that occurred while writing in the background."""
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def flush(self):
+        """Wait until all pending checkpoints are written."""
+        if self._thread is not None:
+            self._queue.join()
+        self.raise_error()
+
+    def close(self):
+        """Write all pending checkpoints and stop the background thread."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self.raise_error()
+
+    @staticmethod
+    def load(path):
+        """Return the parameters, the info dictionary and the trainer
+        bookkeeping stored in the checkpoint at ``path``."""
+        with np.load(path) as f:
+            parameters = f['parameters']
+            bookkeeping = cPickle.loads(f['bookkeeping'].tostring())
+            info = bookkeeping.pop('info')
+            bookkeeping['infos'] = _unpickle_all(f['infos'].tostring())
+            best = bookkeeping.setdefault('best', {})
+            for key in f.files:
+                if key.startswith('info/'):
+                    info[key[len('info/'):]] = f[key]
+                elif key.startswith('best/'):
+                    best[key[len('best/'):]] = f[key]
+        return parameters, info, bookkeeping
+
+    def restore(self, trainer, path=None):
+        """Restore ``trainer`` and its model from the checkpoint at ``path``,
+        or the most recent one if not given.
+
+        Training is continued from the checkpoint by the next call to
+        ``trainer.fit`` or ``trainer.iter_fit``. Return the info dictionary
+        of the checkpoint, or None if there is none."""
+        if path is None:
+            path = self.latest()
+            if path is None:
+                return None
+        parameters, info, bookkeeping = self.load(path)
+        trainer.model.parameters.data[...] = parameters
+        trainer.infos = bookkeeping['infos']
+        best = bookkeeping['best']
+        n_iter = best.get('n_iter')
+        trainer.best.set(best.get('data'), float(best['loss']),
+                         None if n_iter is None else int(n_iter))
+        trainer.best.n_updates = int(best['n_updates'])
+        trainer.stopped = bookkeeping['stopped']
+        info['best_loss'] = trainer.best.loss
+        info['best_pars'] = trainer.best.data
+        trainer.current_info = info
+        return info
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('_queue', '_thread', '_error', '_infos', '_n_infos',
+                    '_pickled_infos'):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_background()
+
+
+def _unpickle_all(string):
+    """Return the list of objects pickled one after the other in
+    ``string``."""
+    stream = cStringIO.StringIO(string)
+    objects = []
+    while stream.tell() < len(string):
+        objects.append(cPickle.load(stream))
+    return objects
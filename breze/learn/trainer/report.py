@@ -3,6 +3,10 @@
 """Module for various reporting strategies."""
 
 import json
+import numbers
+import os
+import Queue
+import threading
 import types
 
 import numpy as np
@@ -106,3 +110,232 @@ class JsonPrinter(object):
 def point_print(info):
     """Print a point to stdout."""
     print '.'
+
+
+def _is_numeric_scalar(value):
+    if isinstance(value, (bool, numbers.Number, np.number, np.bool_)):
+        return True
+    return isinstance(value, np.ndarray) and value.size == 1
+
+
+def _npz_part_path(path, i):
+    root, ext = os.path.splitext(path)
+    return '%s-%06d%s' % (root, i, ext)
+
+
+def _npz_parts(path):
+    parts = []
+    while os.path.exists(_npz_part_path(path, len(parts))):
+        parts.append(_npz_part_path(path, len(parts)))
+    return parts
+
+
+class MetricsRecorder(object):
+    """MetricsRecorder class.
+
+    Records numeric scalars of info dictionaries and appends them to a file,
+    without printing anything. Meant to be used as a report of a ``Trainer``
+    with a pause after every iteration.
+
+    Values are stored in preallocated columns of a fixed capacity, one per
+    key. When they are full, they are handed over to a background thread
+    which converts them to an array and appends them to the file, and fresh
+    columns are used. Thus a call does no more than setting an item per
+    key.
+
+    The format of the file is one of ``'csv'``, ``'jsonl'`` (one JSON object
+    per line) or ``'npz'``. Since npz files cannot be appended to, each batch
+    of rows is written to a file of its own next to ``path``, with a running
+    number appended to its name; see ``parts`` and ``load_npz``.
+
+    Attributes
+    ----------
+
+    path : string
+        File the values are written to.
+
+    keys : list of strings
+        Keys of the info dictionaries to record. Missing values are recorded
+        as NaN.
+
+    fmt : string
+        Format of the file.
+
+    capacity : integer
+        Number of rows held in memory before they are written.
+
+    n_rows : integer
+        Number of rows recorded so far.
+    """
+
+    formats = 'csv', 'jsonl', 'npz'
+
+    def __init__(self, path, keys=None, fmt=None, capacity=1024):
+        """Create MetricsRecorder object.
+
+        Parameters
+        ----------
+
+        path : string
+            File the values are written to. An existing file, or existing
+            parts for npz, are replaced.
+
+        keys : list of strings, optional
+            Keys of the info dictionaries to record. If not given, all keys
+            with numeric scalar values in the first info dictionary are
+            recorded.
+
+        fmt : string, optional
+            Format of the file; if not given, it is taken from the extension
+            of ``path``.
+
+        capacity : integer, optional, default: 1024
+            Number of rows held in memory before they are written.
+        """
+        if fmt is None:
+            fmt = os.path.splitext(path)[1].lstrip('.')
+            if fmt == 'json':
+                fmt = 'jsonl'
+        if fmt not in self.formats:
+            raise ValueError('unknown format %s' % fmt)
+        self.path = path
+        self.keys = None if keys is None else list(keys)
+        self.fmt = fmt
+        self.capacity = capacity
+        self._n_handed_over = 0
+
+        self._columns = None
+        self._n = 0
+        self._n_parts = 0
+        self._queue = Queue.Queue(maxsize=2)
+        self._thread = None
+        self._error = None
+        if os.path.exists(path):
+            os.remove(path)
+        if fmt == 'npz':
+            for part in self.parts():
+                os.remove(part)
+
+    def _new_columns(self):
+        # Plain lists are used, since setting an item of a list is much
+        # cheaper than of an array; they are converted by the writer.
+        self._columns = [(k, [np.nan] * self.capacity) for k in self.keys]
+        self._n = 0
+
+    def __call__(self, info):
+        if self._columns is None:
+            if self.keys is None:
+                self.keys = sorted(k for k, v in info.items()
+                                   if _is_numeric_scalar(v))
+            self._new_columns()
+        n = self._n
+        get = info.get
+        nan = np.nan
+        for key, column in self._columns:
+            column[n] = get(key, nan)
+        self._n = n = n + 1
+        if n == self.capacity:
+            self._hand_over()
+
+    def _hand_over(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._work)
+            self._thread.daemon = True
+            self._thread.start()
+        self._queue.put((self._columns, self._n))
+        self._n_handed_over += self._n
+        self._new_columns()
+
+    @property
+    def n_rows(self):
+        return self._n_handed_over + self._n
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    break
+                columns, n = item
+                self.write(np.array([c[:n] for _, c in columns],
+                                    dtype='float64').T.reshape((n, -1)))
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def parts(self):
+        """Return the paths of the files written in npz format, in the order
+        they were written."""
+        return _npz_parts(self.path)
+
+    @staticmethod
+    def load_npz(path):
+        """Return a dictionary mapping each key to the array of all values
+        recorded in npz format by a MetricsRecorder writing to ``path``."""
+        columns = {}
+        for part in _npz_parts(path):
+            with np.load(part) as f:
+                for key in f.files:
+                    columns.setdefault(key, []).append(f[key])
+        return dict((k, np.concatenate(v)) for k, v in columns.items())
+
+    def write(self, rows):
+        """Append ``rows``, an array with a column for each key, to the
+        file."""
+        if self.fmt == 'npz':
+            path = _npz_part_path(self.path, self._n_parts)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as fp:
+                np.savez(fp, **dict((k, rows[:, i])
+                                    for i, k in enumerate(self.keys)))
+            os.rename(tmp_path, path)
+            self._n_parts += 1
+            return
+
+        exists = os.path.exists(self.path)
+        with open(self.path, 'a') as fp:
+            if self.fmt == 'csv':
+                if not exists:
+                    fp.write(','.join(self.keys) + '\n')
+                np.savetxt(fp, rows, delimiter=',', fmt='%.17g')
+            else:
+                for row in rows.tolist():
+                    # NaNs are written as null, since JSON lacks them.
+                    fp.write(json.dumps(dict(
+                        (k, v if v == v else None)
+                        for k, v in zip(self.keys, row))) + '\n')
+
+    def flush(self):
+        """Write all recorded rows and wait until they are written."""
+        if self._columns is not None and self._n:
+            self._hand_over()
+        if self._thread is not None:
+            self._queue.join()
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def close(self):
+        """Write all recorded rows and stop the background thread."""
+        self.flush()
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def __getstate__(self):
+        self.flush()
+        state = self.__dict__.copy()
+        for key in ('_queue', '_thread', '_error'):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._queue = Queue.Queue(maxsize=2)
+        self._thread = None
+        self._error = None
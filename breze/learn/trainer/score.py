@@ -3,9 +3,19 @@
 """Module for various scoring strategies."""
 
 
-from climin.util import iter_minibatches
+import math
+import multiprocessing
+import Queue
+import time
+import traceback
+
+import numpy as np
+
+from climin.util import minibatches
 from climin import mathadapt as ma
 
+from breze.learn.dataset import is_on_disk, iter_chunks
+
 
 def simple(f_score, *data):
     """Simple scoring strategy which just applies ``f_score`` to the passed
@@ -20,6 +30,10 @@ class MinibatchScore(object):
     of rows can be calculated at the same time. This score assumes that scores
     are averages.
 
+    If any of the data is stored on disk (see
+    ``breze.learn.dataset.DiskArray``), it is processed in consecutive batches,
+    of which the next ones are read in the background.
+
 
     Attributes
     ----------
@@ -53,7 +67,19 @@ class MinibatchScore(object):
 
     def __call__(self, f_score, *data):
         """"Return the score of the data."""
-        batches = iter_minibatches(data, self.max_samples, self.sample_dims, 1)
+        if not any(is_on_disk(i) for i in data):
+            # No need to start a background thread for data in memory.
+            batches = zip(*[minibatches(i, self.max_samples, d)
+                            for i, d in zip(data, self.sample_dims)])
+            return self._score(f_score, batches)
+
+        batches = iter_chunks(data, self.sample_dims, self.max_samples)
+        try:
+            return self._score(f_score, batches)
+        finally:
+            batches.close()
+
+    def _score(self, f_score, batches):
         score = 0.
         seen_samples = 0.
         for batch in batches:
@@ -61,3 +87,294 @@ class MinibatchScore(object):
             score += f_score(*batch) * this_samples
             seen_samples += this_samples
         return ma.scalar(score / seen_samples)
+
+
+class RunningMean(object):
+    """RunningMean class.
+
+    Accumulates a weighted mean of batch scores incrementally, together with
+    the weighted variance of the batch scores.
+
+    Attributes
+    ----------
+
+    mean : float
+        Weighted mean of the scores added so far.
+
+    n_samples : int
+        Total weight, i.e. number of samples, of the scores added so far.
+
+    n_batches : int
+        Number of scores added so far.
+    """
+
+    def __init__(self):
+        self.mean = 0.
+        self.n_samples = 0
+        self.n_batches = 0
+        self._m2 = 0.
+
+    def add(self, score, n_samples):
+        """Add the mean ``score`` of a batch of ``n_samples`` samples."""
+        self.n_samples += n_samples
+        self.n_batches += 1
+        delta = score - self.mean
+        self.mean += delta * n_samples / self.n_samples
+        self._m2 += n_samples * delta * (score - self.mean)
+
+    @property
+    def variance(self):
+        """Weighted variance of the batch scores."""
+        if self.n_samples == 0:
+            return float('nan')
+        return self._m2 / self.n_samples
+
+
+def _score_batches(f_score, datasets, sample_dims, tasks, queue):
+    try:
+        for name, start, stop in tasks:
+            batch = [d[(slice(None),) * i + (slice(start, stop),)]
+                     for d, i in zip(datasets[name], sample_dims)]
+            queue.put((name, ma.scalar(f_score(*batch)), stop - start, None))
+    except Exception:
+        queue.put((None, None, None, traceback.format_exc()))
+
+
+class ParallelScore(object):
+    """ParallelScore class.
+
+    Scoring strategy that evaluates several data sets in one pass, splitting
+    the work into batches of at most ``max_samples`` samples which are scored
+    by a pool of worker processes. The score of a data set is the mean of the
+    batch scores weighted by the batch sizes, which is accumulated as the
+    batch scores arrive. Like ``MinibatchScore``, it assumes that scores are
+    averages.
+
+    If ``subsample`` is given, only a random subset of the batches is scored.
+    The result is then an estimate, for which a confidence interval is given
+    based on the spread of the batch scores.
+
+    Workers are forked when scores are requested, so they inherit the data
+    and the compiled score function. The first batch is scored before forking
+    to make sure the score function is compiled only once.
+
+    Can be used as the ``score`` of a ``Trainer``, which then uses
+    ``score_many`` to score all of the data sets in ``Trainer.eval_keys`` at
+    once.
+
+    Attributes
+    ----------
+
+    max_samples : int
+        Maximum samples to calculcate the score for at the same time.
+
+    sample_dims : list of ints
+        Dimensions along which the samples are stored, one for each argument
+        of the score function.
+
+    n_workers : int
+        Number of worker processes. If 0, the batches are scored in the
+        calling process.
+
+    subsample : float, int or None
+        If a float, the fraction of samples of each data set to score; if an
+        int, the number of samples. If None, all samples are scored.
+
+    z : float
+        Quantile of the standard normal distribution for the confidence
+        intervals; defaults to 95%.
+
+    stats : dict
+        Result of the last call to ``score_many``.
+
+    poll_interval : float
+        Seconds to wait for a result of the workers before checking whether
+        they are still alive.
+    """
+
+    poll_interval = 1.
+
+    def __init__(self, max_samples, sample_dims, n_workers=0, subsample=None,
+                 z=1.96, random_state=None):
+        """Create ParallelScore object.
+
+        Parameters
+        ----------
+
+        max_samples : int
+            Maximum samples to calculcate the score for at the same time.
+
+        sample_dims : list of ints
+            Dimensions along which the samples are stored, one for each
+            argument of the score function.
+
+        n_workers : int, optional, default: 0
+            Number of worker processes.
+
+        subsample : float, int or None, optional, default: None
+            Fraction or number of samples of each data set to score.
+
+        z : float, optional, default: 1.96
+            Quantile of the standard normal distribution for the confidence
+            intervals.
+
+        random_state : np.random.RandomState or None, optional
+            Random number generator for choosing the subsample.
+        """
+        self.max_samples = max_samples
+        self.sample_dims = sample_dims
+        self.n_workers = n_workers
+        self.subsample = subsample
+        self.z = z
+        if random_state is None:
+            random_state = np.random.RandomState()
+        self.random_state = random_state
+        self.stats = None
+
+    def __call__(self, f_score, *data):
+        """"Return the score of the data."""
+        return self.score_many(f_score, {'data': data})['data']['loss']
+
+    def _tasks(self, name, data):
+        n_samples = data[0].shape[self.sample_dims[0]]
+        starts = range(0, n_samples, self.max_samples)
+        tasks = [(name, start, min(start + self.max_samples, n_samples))
+                 for start in starts]
+        if self.subsample is None:
+            return tasks, n_samples
+
+        if isinstance(self.subsample, float):
+            n_wanted = int(math.ceil(self.subsample * n_samples))
+        else:
+            n_wanted = self.subsample
+        n_batches = int(math.ceil(float(n_wanted) / self.max_samples))
+        n_batches = max(1, min(n_batches, len(tasks)))
+        idxs = self.random_state.permutation(len(tasks))[:n_batches]
+        return [tasks[i] for i in sorted(idxs)], n_samples
+
+    def score_many(self, f_score, datasets):
+        """Return the scores of several data sets.
+
+        Parameters
+        ----------
+
+        f_score : callable
+            Score function, e.g. ``model.score``.
+
+        datasets : dict
+            Maps names to tuples of arrays, each of which is passed to
+            ``f_score`` batch by batch.
+
+        Returns
+        -------
+
+        stats : dict
+            Maps the name of each data set to a dictionary holding the score
+            (``loss``), its standard error (``std_err``), a confidence
+            interval (``ci``), the number of samples scored (``n_samples``) and
+            the number of samples scored per second (``samples_per_second``).
+            The latter is given for all data sets as well, under the key
+            ``samples_per_second``.
+        """
+        start_time = time.time()
+        tasks = []
+        totals = {}
+        for name, data in datasets.items():
+            these_tasks, totals[name] = self._tasks(name, data)
+            tasks += these_tasks
+
+        means = dict((name, RunningMean()) for name in datasets)
+        queue = multiprocessing.Queue() if self.n_workers else None
+
+        # Score the first batch here, so that the score function is compiled
+        # before forking.
+        results = []
+        _score_batches(f_score, datasets, self.sample_dims, tasks[:1],
+                       _ListQueue(results))
+        tasks = tasks[1:]
+
+        processes = []
+        if self.n_workers and tasks:
+            for i in range(self.n_workers):
+                p = multiprocessing.Process(
+                    target=_score_batches,
+                    args=(f_score, datasets, self.sample_dims,
+                          tasks[i::self.n_workers], queue))
+                p.daemon = True
+                p.start()
+                processes.append(p)
+        else:
+            _score_batches(f_score, datasets, self.sample_dims, tasks,
+                           _ListQueue(results))
+
+        def merge(result):
+            name, score, n_samples, error = result
+            if error is not None:
+                raise RuntimeError('error in scoring worker:\n%s' % error)
+            means[name].add(score, n_samples)
+
+        try:
+            for result in results:
+                merge(result)
+            if processes:
+                for _ in range(len(tasks)):
+                    merge(self._get_result(queue, processes))
+        finally:
+            for p in processes:
+                p.terminate()
+                p.join()
+
+        elapsed = max(time.time() - start_time, 1e-12)
+        self.stats = stats = {}
+        for name, mean in means.items():
+            stats[name] = self._stats(mean, totals[name], elapsed)
+        stats['samples_per_second'] = sum(
+            i.n_samples for i in means.values()) / elapsed
+        return stats
+
+    def _get_result(self, queue, processes):
+        """Return the next result from ``queue``, raising a RuntimeError if
+        a worker died or all workers exited without delivering it."""
+        while True:
+            try:
+                return queue.get(timeout=self.poll_interval)
+            except Queue.Empty:
+                pass
+            for p in processes:
+                if p.exitcode not in (None, 0):
+                    raise RuntimeError('scoring worker died with exit code %i'
+                                       % p.exitcode)
+            if not any(p.is_alive() for p in processes):
+                # The workers flush their results before exiting, so anything
+                # missing now will not arrive.
+                try:
+                    return queue.get(timeout=self.poll_interval)
+                except Queue.Empty:
+                    raise RuntimeError(
+                        'scoring workers exited without delivering all '
+                        'results')
+
+    def _stats(self, mean, n_total, elapsed):
+        if mean.n_samples >= n_total or mean.n_batches < 2:
+            std_err = 0. if mean.n_samples >= n_total else float('nan')
+        else:
+            # Standard error of a mean of batch means, corrected for
+            # sampling without replacement from a finite population.
+            fpc = 1 - float(mean.n_samples) / n_total
+            std_err = math.sqrt(mean.variance / (mean.n_batches - 1) * fpc)
+        return {
+            'loss': mean.mean,
+            'std_err': std_err,
+            'ci': (mean.mean - self.z * std_err, mean.mean + self.z * std_err),
+            'n_samples': mean.n_samples,
+            'samples_per_second': mean.n_samples / elapsed,
+        }
+
+
+class _ListQueue(object):
+
+    def __init__(self, lst):
+        self.lst = lst
+
+    def put(self, item):
+        self.lst.append(item)
@@ -2,7 +2,10 @@
 
 """Module that contains various functionality for trainers."""
 
+import copy
 import datetime
+import Queue
+import threading
 
 from climin import mathadapt as ma
 from climin.stops import never, always
@@ -10,6 +13,7 @@ from climin.util import clear_info
 
 import score as score_
 import report as report_
+from best import BestParameters
 
 
 class Trainer(object):
@@ -70,8 +74,14 @@ class Trainer(object):
         Callable to which the info dictionary of the current optimization is
         passed during each pause.
 
+    best : BestParameters object
+        Store of the currently best found parameters according to
+        validation data. Info dictionaries hold its buffer under
+        ``best_pars``.
+
     best_pars : array_like
-        Currently best found parameters according to validation data.
+        Currently best found parameters according to validation data, or
+        None.
 
     best_loss : float
         Loss on the validation data of ``best_pars``.
@@ -89,13 +99,28 @@ class Trainer(object):
         Key identifying the data set from ``data`` which is used for
         validation.
 
+    eval_keys : list of strings
+        Keys identifying further data sets from ``data`` which are scored
+        during each pause, next to the one given by ``val_key``. The score of
+        data set ``key`` is stored under ``'%s_loss' % key`` in the info
+        dictionary.
+
     stopped : boolean
         If ``stop`` has returned True once, this is set to True. Otherwise
         False. Useful for distinguishing between interrupt and stop.
+
+    async_score : boolean
+        If True, the validation score is computed in a background thread
+        while optimization continues; see ``iter_fit``.
+
+    checkpointer : Checkpointer object or None
+        If given, used to save checkpoints during ``iter_fit``; see
+        ``breze.learn.trainer.checkpoint``.
     """
 
     def __init__(self, model, data, stop, score=score_.simple,
-                 pause=always, interrupt=never, report=report_.point_print):
+                 pause=always, interrupt=never, report=report_.point_print,
+                 async_score=False, best_storage=None, checkpointer=None):
         """Create a Trainer object.
 
         Parameters
@@ -126,6 +151,17 @@ class Trainer(object):
         report : callable, optional
             Callable to which the info dictionary of the current optimization is
             passed during each pause.
+
+        async_score : boolean, optional, default: False
+            If True, the validation score is computed in a background thread
+            while optimization continues.
+
+        best_storage : string or None, optional, default: None
+            If given, name of a file to which the best parameters are memory
+            mapped; see ``breze.learn.trainer.best.BestParameters``.
+
+        checkpointer : Checkpointer object, optional
+            Used to save checkpoints during ``iter_fit``.
         """
 
         self.model = model
@@ -137,25 +173,135 @@ class Trainer(object):
         self.interrupt = interrupt
         self.report = report
 
-        self.best_pars = None
-        self.best_loss = float('inf')
+        self.best = BestParameters(best_storage)
 
         self.infos = []
         self.current_info = None
 
         self.val_key = None
+        self.eval_keys = []
         self.stopped = False
 
+        self.async_score = async_score
+        self._init_async_score()
+
+        self.checkpointer = checkpointer
+
+    def _init_async_score(self):
+        # Copy of the model with its own parameters and compiled functions
+        # for scoring in the background, see ``_score_model_copy``.
+        self._score_model = None
+        self._score_thread = None
+        self._score_results = Queue.Queue()
+        self._last_losses = {}
+        self._last_val_n_iter = None
+
+    @property
+    def best_pars(self):
+        return self.best.data
+
+    @best_pars.setter
+    def best_pars(self, pars):
+        self.best.set(pars)
+
+    @property
+    def best_loss(self):
+        return self.best.loss
+
+    @best_loss.setter
+    def best_loss(self, loss):
+        self.best.loss = loss
+
     def score(self, *data):
         return self._score(self.model.score, *data)
 
+    def score_data_sets(self, keys):
+        """Return a dictionary mapping each of ``keys`` to the score of the
+        data set stored under that key in ``.data``.
+
+        If the scoring strategy has a ``score_many`` method, as
+        ``breze.learn.trainer.score.ParallelScore`` has, all data sets are
+        scored in a single pass."""
+        return self._score_data_sets(self.model, keys)
+
+    def _score_data_sets(self, model, keys):
+        if hasattr(self._score, 'score_many'):
+            stats = self._score.score_many(
+                model.score, dict((k, self.data[k]) for k in keys))
+            return dict((k, stats[k]['loss']) for k in keys)
+        return dict((k, ma.scalar(self._score(model.score, *self.data[k])))
+                    for k in keys)
+
+    def _score_keys(self):
+        return [self.val_key] + [k for k in self.eval_keys
+                                 if k != self.val_key]
+
     def fit(self):
         """Run ``.iter_fit()`` until it terminates
 
         Termination will occur when either stop or interrupt is True. During
-        each pause, ``.report(info)`` will be executed."""
+        each pause, ``.report(info)`` will be executed. If the report has a
+        ``flush`` method, as ``breze.learn.trainer.report.MetricsRecorder``
+        has, it is called at the end."""
         for i in self.iter_fit(*self.data['train']):
             self.report(i)
+        if hasattr(self.report, 'flush'):
+            self.report.flush()
+
+    def _score_model_copy(self):
+        """Return a shallow copy of the model with its own parameter array.
+
+        Compiled functions are not shared with the model, since they must not
+        be called from two threads at the same time."""
+        if self._score_model is None:
+            model = copy.copy(self.model)
+            model.parameters = copy.copy(self.model.parameters)
+            model.parameters.data = self.model.parameters.data.copy()
+            model._drop_functions()
+            self._score_model = model
+        return self._score_model
+
+    def _start_score(self, n_iter):
+        """Score a snapshot of the current parameters on the validation data
+        and the data sets given by ``eval_keys`` in the background."""
+        model = self._score_model_copy()
+        model.parameters.data[...] = self.model.parameters.data
+        keys = self._score_keys()
+
+        def run():
+            try:
+                result = self._score_data_sets(model, keys), None
+            except Exception as e:
+                result = None, e
+            self._score_results.put((n_iter, result))
+
+        self._score_thread = threading.Thread(target=run)
+        self._score_thread.daemon = True
+        self._score_thread.start()
+
+    def _collect_score(self, block=False):
+        """Merge the result of the background scoring, if it is available or
+        ``block`` is True, into ``best_loss`` and ``best_pars``."""
+        if self._score_thread is None:
+            return
+        try:
+            n_iter, (losses, error) = self._score_results.get(block=block)
+        except Queue.Empty:
+            return
+        self._score_thread.join()
+        self._score_thread = None
+        if error is not None:
+            raise error
+
+        self._last_losses = losses
+        self._last_val_n_iter = n_iter
+        self.best.update(losses[self.val_key],
+                         self._score_model.parameters.data, n_iter)
+
+    def wait_for_score(self):
+        """Wait for a validation score being computed in the background and
+        merge it into ``best_loss`` and ``best_pars``."""
+        self._collect_score(block=True)
 
     def switch_pars(self, pars):
         old = self.model.parameters.data.copy()
@@ -185,19 +331,55 @@ class Trainer(object):
 
         The values yielded from this function will be climin info dictionaries
         stripped from any numpy or gnumpy arrays.
+
+        If ``.async_score`` is True, the validation score is computed in a
+        background thread on a snapshot of the parameters. A pause then does
+        not wait for it; instead, the info dictionary holds the most recent
+        score available, and ``val_loss_n_iter`` the iteration of the
+        parameters it was computed for; the same holds for the scores of the
+        data sets given by ``eval_keys``. At most one score is computed at a
+        time; ``best_pars`` and ``best_loss`` are updated as soon as it
+        arrives. When the generator is finished, the last pending score is
+        waited for.
+
+        If ``.checkpointer`` is set, it is asked after each iteration whether
+        a checkpoint is due; a last checkpoint is saved when fitting stops or
+        is interrupted. Pending checkpoints are written before the generator
+        finishes.
         """
+        try:
+            for info in self._iter_fit(*fit_data):
+                yield info
+        finally:
+            if self.async_score:
+                self.wait_for_score()
+            if self.checkpointer is not None:
+                self.checkpointer.flush()
+
+    def _iter_fit(self, *fit_data):
         for info in self.model.iter_fit(*fit_data, info_opt=self.current_info):
             interrupt = self.interrupt(info)
+            finished = False
             if self.pause(info) or interrupt:
-                info['val_loss'] = ma.scalar(self.score(*self.data[self.val_key]))
-
-                cur_val_loss = info['%s_loss' % self.val_key]
-                if cur_val_loss < self.best_loss:
-                    self.best_loss = cur_val_loss
-                    self.best_pars = self.model.parameters.data.copy()
-
-                info['best_loss'] = self.best_loss
-                info['best_pars'] = self.best_pars
+                if self.async_score:
+                    self._collect_score()
+                    if self._score_thread is None:
+                        self._start_score(info['n_iter'])
+                    losses = dict(
+                        (k, self._last_losses.get(k, float('nan')))
+                        for k in self._score_keys())
+                    info['val_loss_n_iter'] = self._last_val_n_iter
+                else:
+                    losses = self.score_data_sets(self._score_keys())
+                    self.best.update(losses[self.val_key],
+                                     self.model.parameters.data,
+                                     info['n_iter'])
+                for key, loss in losses.items():
+                    info['%s_loss' % key] = loss
+                info['val_loss'] = losses[self.val_key]
+
+                info['best_loss'] = self.best.loss
+                info['best_pars'] = self.best.data
 
                 info.update({
                     'datetime': datetime.datetime.now(),
@@ -211,11 +393,32 @@ class Trainer(object):
 
                 if self.stop(info):
                     self.stopped = True
-                    break
+                    finished = True
                 if interrupt:
-                    break
+                    finished = True
+
+            if self.checkpointer is not None:
+                if finished:
+                    self.checkpointer.save(self, info)
+                else:
+                    self.checkpointer.maybe_save(self, info)
+            if finished:
+                break
 
     def __getstate__(self):
         state = self.__dict__.copy()
         del state['data']
+        for key in ('_score_model', '_score_thread', '_score_results'):
+            state.pop(key, None)
         return state
+
+    def __setstate__(self, state):
+        if 'best' not in state:
+            # Trainers pickled before the introduction of ``best``.
+            best = state['best'] = BestParameters()
+            best_pars = state.pop('best_pars', None)
+            best_loss = state.pop('best_loss', float('inf'))
+            if best_pars is not None:
+                best.update(best_loss, best_pars)
+        self.__dict__.update(state)
+        self._init_async_score()
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+"""Module for executing networks exported by ``breze.arch.export`` with numpy
+only.
+
+Importing this module does not import Theano, which makes it suitable for
+prediction hosts without a C compiler and for processes that need to start
+fast. The weights are memory mapped, so that several processes serving the
+same network share them.
+
+Buffers for intermediate results are allocated on the first call with an
+input of a given shape and reused for all further calls with inputs of that
+shape.
+"""
+
+
+import json
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+def sigmoid(x):
+    x = np.negative(x, out=x)
+    np.exp(x, out=x)
+    x += 1
+    return np.reciprocal(x, out=x)
+
+
+def softmax(x):
+    x -= x.max(axis=-1)[..., np.newaxis]
+    np.exp(x, out=x)
+    x /= x.sum(axis=-1)[..., np.newaxis]
+    return x
+
+
+def diag_gauss(x):
+    half = x.shape[-1] // 2
+    var = x[..., half:]
+    var **= 2
+    var += 1e-8
+    return x
+
+
+def lstm(state_tm1, inpt):
+    size = state_tm1.shape[1]
+    x = np.tanh(inpt[:, :size])
+    gates = sigmoid(inpt[:, size:].copy())
+    ingate = gates[:, :size]
+    forgetgate = gates[:, size:2 * size]
+    outgate = gates[:, 2 * size:]
+
+    state = x * ingate + state_tm1 * forgetgate
+    output = np.tanh(state) * outgate
+    return state, output
+
+
+def gru(state_tm1, inpt):
+    size = state_tm1.shape[1]
+    x = inpt[:, :size]
+    gates = sigmoid(inpt[:, size:].copy())
+    update_gate = gates[:, :size]
+    reset_gate = gates[:, size:]
+
+    cand_output = np.tanh(x + state_tm1 * reset_gate)
+    output = (1 - update_gate) * state_tm1 + update_gate * cand_output
+    return output, output
+
+
+# Transfer functions which map an array to an array of the same shape. They
+# are allowed to work in place and have to return the result.
+transfers = {
+    'identity': lambda x: x,
+    'tanh': lambda x: np.tanh(x, out=x),
+    'tanhplus': lambda x: np.add(np.tanh(x), x, out=x),
+    'sigmoid': sigmoid,
+    'rectifier': lambda x: np.maximum(x, 0, out=x),
+    'softplus': lambda x: np.log1p(np.exp(x, out=x), out=x),
+    'softmax': softmax,
+    'softsign': lambda x: np.divide(x, 1 + abs(x), out=x),
+    'diag_gauss': diag_gauss,
+    'logproduct_of_t': lambda x: np.log1p(np.square(x, out=x), out=x),
+    'logcosh': lambda x: np.log(np.cosh(x, out=x), out=x),
+    'softabs': lambda x: np.sqrt(np.square(x, out=x) + 1e-5, out=x),
+}
+
+# Transfer functions of recurrent layers which carry a state; they map the
+# previous state and the current input to the new state and output.
+stateful_transfers = {
+    'lstm': lstm,
+    'gru': gru,
+}
+
+
+class Runtime(object):
+    """Runtime class.
+
+    Executes the plan of an exported network.
+
+    Attributes
+    ----------
+
+    plan : dictionary
+        Plan as given by ``breze.arch.export.export``.
+
+    weights : array_like
+        Flat vector of all weights.
+
+    arrays : list of arrays
+        Views into ``weights`` for each array of the plan.
+    """
+
+    def __init__(self, plan, weights):
+        """Create a Runtime object.
+
+        Parameters
+        ----------
+
+        plan : dictionary
+            Plan as given by ``breze.arch.export.export``.
+
+        weights : array_like
+            Flat vector of all weights.
+        """
+        self.plan = plan
+        self.weights = weights
+        self.dtype = weights.dtype
+        self.arrays = [
+            weights[i['offset']:i['offset'] + int(np.prod(i['shape']))]
+            .reshape(i['shape'])
+            for i in plan['arrays']]
+
+        self._filters = {}
+        for i, op in enumerate(plan['ops']):
+            transfer = op.get('transfer')
+            if (transfer is not None and transfer not in transfers
+                    and not (op['op'] == 'recurrent'
+                             and transfer in stateful_transfers)):
+                raise ValueError('unknown transfer function %s' % transfer)
+            if op['op'] == 'conv2d':
+                # Theano's conv2d convolves, i.e. the filters are flipped. We
+                # store them as a matrix for a single dot product.
+                w = self.arrays[op['weights']]
+                self._filters[i] = np.ascontiguousarray(
+                    w[:, :, ::-1, ::-1].reshape((w.shape[0], -1)).T)
+
+        self._buffers = {}
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Return a Runtime for the network exported to ``path``.
+
+        If ``mmap`` is True, the weights are memory mapped instead of read."""
+        with open(path + '.json') as fp:
+            plan = json.load(fp)
+        weights = np.load(path + '.npy', mmap_mode='r' if mmap else None)
+        return cls(plan, weights)
+
+    def buffer(self, key, shape):
+        """Return a buffer of ``shape`` which is reused for all calls with
+        the same ``key`` and ``shape``."""
+        key = key, tuple(shape)
+        buf = self._buffers.get(key)
+        if buf is None:
+            buf = self._buffers[key] = np.empty(shape, dtype=self.dtype)
+        return buf
+
+    def __call__(self, X):
+        """Return the output of the network for the input ``X``."""
+        x = np.asarray(X, dtype=self.dtype)
+        for i, op in enumerate(self.plan['ops']):
+            x = getattr(self, 'op_' + op['op'])(i, op, x)
+        # The result lives in a buffer which is overwritten by the next call.
+        return x.copy()
+
+    predict = __call__
+
+    def op_affine(self, i, op, x):
+        weights = self.arrays[op['weights']]
+        x_flat = x.reshape((-1, x.shape[-1]))
+        if not x_flat.flags.c_contiguous:
+            x_flat = np.ascontiguousarray(x_flat)
+        out = self.buffer(i, (x_flat.shape[0], weights.shape[1]))
+        np.dot(x_flat, weights, out=out)
+        if op['bias'] is not None:
+            out += self.arrays[op['bias']]
+        out = transfers[op['transfer']](out)
+        return out.reshape(x.shape[:-1] + (weights.shape[1],))
+
+    def op_flatten(self, i, op, x):
+        return x.reshape((x.shape[0], -1))
+
+    def op_conv2d(self, i, op, x):
+        n, c, h, w = x.shape
+        n_filters, _, fh, fw = self.arrays[op['weights']].shape
+        sh, sw = op['subsample']
+        oh, ow = (h - fh) // sh + 1, (w - fw) // sw + 1
+
+        x = np.ascontiguousarray(x)
+        s = x.strides
+        windows = as_strided(
+            x, shape=(n, oh, ow, c, fh, fw),
+            strides=(s[0], s[2] * sh, s[3] * sw, s[1], s[2], s[3]))
+        cols = self.buffer((i, 'cols'), (n * oh * ow, c * fh * fw))
+        cols.reshape(windows.shape)[...] = windows
+
+        prod = self.buffer((i, 'prod'), (n * oh * ow, n_filters))
+        np.dot(cols, self._filters[i], out=prod)
+
+        out = self.buffer(i, (n, n_filters, oh, ow))
+        out[...] = prod.reshape((n, oh, ow, n_filters)).transpose(0, 3, 1, 2)
+        return transfers[op['transfer']](out)
+
+    def op_max_pool2d(self, i, op, x):
+        n, c, h, w = x.shape
+        ph, pw = op['pool_shape']
+        oh, ow = h // ph, w // pw
+        blocks = x[:, :, :oh * ph, :ow * pw].reshape((n, c, oh, ph, ow, pw))
+        out = self.buffer(i, (n, c, oh, ow))
+        np.max(blocks.max(axis=5), axis=3, out=out)
+        return transfers[op['transfer']](out)
+
+    def op_recurrent(self, i, op, x):
+        weights = self.arrays[op['weights']]
+        initial = self.arrays[op['initial']]
+        n_time_steps, n_samples, _ = x.shape
+
+        if op['transfer'] in stateful_transfers:
+            f = stateful_transfers[op['transfer']]
+            out = self.buffer(i, (n_time_steps, n_samples, weights.shape[0]))
+            h = np.tile(initial, (n_samples, 1))
+            state = np.zeros((n_samples, weights.shape[0]), dtype=self.dtype)
+            hi = self.buffer((i, 'hi'), (n_samples, weights.shape[1]))
+            for t in range(n_time_steps):
+                np.dot(h, weights, out=hi)
+                hi += x[t]
+                state, h = f(state, hi)
+                out[t] = h
+            return out
+
+        f = transfers[op['transfer']]
+        # The hidden pre-activations are carried over time; the initial value
+        # is one as well. It is spread over the samples the way
+        # ``breze.arch.model.rnn.rnn.recurrent_layer`` does it.
+        out = self.buffer(i, (n_time_steps, n_samples, weights.shape[1]))
+        h = self.buffer((i, 'h'), (n_samples, weights.shape[0]))
+        h[...] = np.repeat(initial, n_samples).reshape(h.shape)
+        for t in range(n_time_steps):
+            if t > 0:
+                h[...] = out[t - 1]
+            f(h)
+            np.dot(h, weights, out=out[t])
+            out[t] += x[t]
+        return f(out)
+
+    def op_pooling(self, i, op, x):
+        typ = op['type']
+        if typ == 'last':
+            return x[-1]
+        if typ not in ('mean', 'sum', 'prod', 'min', 'max'):
+            raise ValueError('cannot run pooling of type %s' % typ)
+        return getattr(np, typ)(x, axis=0)
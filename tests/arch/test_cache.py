@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+
+import shutil
+import tempfile
+
+import numpy as np
+import theano
+import theano.tensor as T
+
+from breze.arch.cache import FunctionCache, graph_key
+from breze.arch.util import ParameterSet, Model
+
+
+def make_model(cache):
+    pars = ParameterSet()
+    weights = pars.declare((2, 3))
+    pars.alloc()
+    pars.data[...] = np.arange(6)
+    inpt = T.matrix('inpt')
+
+    model = Model()
+    model.exprs = {'inpt': inpt, 'output': T.tanh(T.dot(inpt, weights))}
+    model.parameters = pars
+    model.function_cache = cache
+    return model
+
+
+def test_function_cache_hit():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = FunctionCache(directory)
+        X = np.random.random((4, 2)).astype(theano.config.floatX)
+
+        f1 = make_model(cache).function(['inpt'], 'output')
+        assert cache.misses == 1 and cache.hits == 0
+
+        f2 = make_model(cache).function(['inpt'], 'output')
+        assert cache.misses == 1 and cache.hits == 1
+
+        assert np.allclose(f1(X), f2(X))
+
+        f3 = make_model(cache).function(['inpt'], ['output'])
+        assert cache.misses == 2, 'list outputs should have different key'
+        assert isinstance(f3(X), list)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_function_cache_eviction():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = FunctionCache(directory, max_size=1)
+        make_model(cache).function(['inpt'], 'output')
+        assert cache.evictions == 1
+        assert len(cache.entries()) == 0
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_function_cache_mode_object():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = FunctionCache(directory)
+        X = np.random.random((4, 2)).astype(theano.config.floatX)
+        mode = theano.compile.mode.get_mode('FAST_RUN')
+
+        f1 = make_model(cache).function(['inpt'], 'output', mode=mode)
+        f2 = make_model(cache).function(['inpt'], 'output', mode=mode)
+        assert cache.misses == 1 and cache.hits == 1
+        assert np.allclose(f1(X), f2(X))
+
+        # Another optimizer gives another function.
+        make_model(cache).function(
+            ['inpt'], 'output',
+            mode=theano.Mode(linker='cvm', optimizer='fast_compile'))
+        assert cache.misses == 2
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_graph_key_scan_constants():
+    def make(value):
+        # Large constants are abbreviated by the debug print.
+        factor = np.arange(10000.)
+        factor[5000] = value
+        inpt = T.matrix('inpt')
+        output, _ = theano.scan(lambda x: x * T.constant(factor),
+                                sequences=inpt)
+        return graph_key([inpt], [output])
+
+    assert make(2.) == make(2.)
+    assert make(2.) != make(3.), 'inner constants not part of the key'
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import climin.initialize
+import numpy as np
+
+from breze.arch.export import export
+from breze.learn.cnn import Lenet
+from breze.learn.mlp import Mlp
+from breze.learn.rnn import SupervisedRnn
+from breze.learn.utils import theano_floatx
+from breze.runtime import Runtime
+
+
+def check_export(model, network, X):
+    climin.initialize.randomize_normal(model.parameters.data, 0, .5)
+    Y = model.predict(X)
+    runtime = Runtime(*export(network, model.parameters))
+    assert np.allclose(runtime(X), Y), 'runtime differs from model'
+    # Again, reusing the buffers.
+    assert np.allclose(runtime(X), Y), 'runtime differs from model'
+
+
+def test_export_mlp():
+    X, = theano_floatx(np.random.standard_normal((10, 2)))
+    model = Mlp(2, [10, 5], 3, ['tanh', 'rectifier'], 'softmax', 'cat_ce')
+    check_export(model, model.mlp, X)
+
+
+def test_export_lenet():
+    X, = theano_floatx(np.random.standard_normal((3, 2, 12, 10)))
+    model = Lenet(12, 10, 2, [4, 3], [(3, 2), (2, 2)], [(2, 2), (1, 2)],
+                  [7], 2, ['tanh', 'rectifier'], ['sigmoid'], 'identity',
+                  'squared', batch_size=3)
+    check_export(model, model.lenet, X)
+
+
+def test_export_rnn():
+    X, = theano_floatx(np.random.standard_normal((5, 3, 2)))
+    for transfers, pooling in [(['tanh', 'sigmoid'], None),
+                               (['lstm'], 'mean'), (['gru'], 'last')]:
+        model = SupervisedRnn(2, [4] * len(transfers), 3,
+                              hidden_transfers=transfers, pooling=pooling)
+        check_export(model, model.rnn, X)
+
+
+def test_runtime_load():
+    X, = theano_floatx(np.random.standard_normal((10, 2)))
+    model = Mlp(2, [10], 1, ['tanh'], 'identity', 'squared')
+    climin.initialize.randomize_normal(model.parameters.data, 0, 1)
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'mlp')
+        export(model.mlp, model.parameters, path)
+        assert np.allclose(Runtime.load(path)(X), model.predict(X))
+    finally:
+        shutil.rmtree(directory)
+
+    # The runtime has to be usable without Theano.
+    code = 'import sys, breze.runtime; assert "theano" not in sys.modules'
+    assert subprocess.call([sys.executable, '-c', code]) == 0
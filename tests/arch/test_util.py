@@ -2,6 +2,9 @@
 
 
 import cPickle
+import os
+import shutil
+import tempfile
 
 import numpy as np
 import theano
@@ -27,6 +30,49 @@ def test_parameter_set_init_declare():
                                              'allocated')
 
 
+def test_parameter_set_shared():
+    pars = ParameterSet()
+    matrix = pars.declare((3, 3))
+    pars.alloc('shared')
+    pars[matrix] = np.eye(3)
+
+    pid = os.fork()
+    if pid == 0:
+        # Child: write to the shared parameters and leave immediately.
+        pars[matrix] *= 2
+        os._exit(0)
+    os.waitpid(pid, 0)
+    assert np.allclose(pars[matrix], 2 * np.eye(3)), 'parameters not shared'
+
+    pickled = cPickle.loads(cPickle.dumps(pars))
+    assert pickled.storage is None
+    assert np.allclose(pickled.data, pars.data)
+
+
+def test_parameter_set_relocate_attach():
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, 'pars')
+
+        pars = ParameterSet()
+        matrix = pars.declare((3, 3))
+        pars.alloc()
+        pars[matrix] = np.eye(3)
+        pars.relocate(filename)
+        assert np.allclose(pars[matrix], np.eye(3))
+
+        other = ParameterSet()
+        other_matrix = other.declare((3, 3))
+        other.alloc()
+        other.attach(filename)
+
+        pars[matrix] = 3
+        pars.data.flush()
+        assert np.allclose(other[other_matrix], 3), 'parameters not shared'
+    finally:
+        shutil.rmtree(directory)
+
+
 def test_parameter_set_init_overwrite():
     pars = ParameterSet()
 
@@ -122,6 +168,69 @@ def test_model_function_mode():
     assert equal, 'wrong mode: (%s != %s)' % (actual_mode, mode)
 
 
+def test_model_function_quantized_updates():
+    pars = ParameterSet()
+    weights = pars.declare((2, 3))
+    pars.alloc()
+    inpt = T.matrix()
+    output = T.dot(inpt, weights)
+    pars.data[...] = np.random.standard_normal(pars.data.shape)
+
+    total = theano.shared(np.zeros(3, dtype=theano.config.floatX))
+    model = Model()
+    model.exprs = {'inpt': inpt, 'output': output}
+    model.updates[output] = {total: total + output.sum(axis=0)}
+    model.parameters = pars
+
+    X = np.random.standard_normal((4, 2)).astype(theano.config.floatX)
+    pars.quantize('float16')
+    try:
+        pars[weights]
+    except ValueError:
+        pass
+    else:
+        assert False, 'quantized parameters should not be accessible'
+
+    f = model.function(['inpt'], 'output')
+    Y = f(X)
+    assert np.allclose(total.get_value(), Y.sum(axis=0))
+
+    pars.dequantize()
+    assert np.allclose(pars[weights], pars.data.reshape((2, 3)))
+
+
+def test_profile_mode():
+    from breze.learn.mlp import Mlp
+    X = np.random.standard_normal((20, 3)).astype(theano.config.floatX)
+    Z = np.random.standard_normal((20, 2)).astype(theano.config.floatX)
+    model = Mlp(3, [4], 2, ['tanh'], 'identity', 'squared', max_iter=3)
+    model.parameters.data[...] = np.random.standard_normal(
+        model.parameters.data.shape) * 0.1
+
+    profile = model.start_profiling()
+    model.fit(X, Z)
+    Y = model.predict(X)
+    model.predict(X)
+
+    assert profile.function_calls['predict'] == 2
+    assert profile.function_calls['loss,d_loss'] == 3
+    layers = [i[0] for i in profile.stats('layer', 'predict')]
+    assert model.mlp.layers[0].name in layers
+    assert model.mlp.layers[1].name in layers
+    assert 'predict' in profile.report()
+
+    fd, fn = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        profile.export(fn)
+    finally:
+        os.remove(fn)
+
+    cPickle.dumps(model)
+    model.stop_profiling()
+    assert np.allclose(model.predict(X), Y)
+
+
 def test_flatten():
     nested = (1, 2, [3, 4, 5, [6], [7], (8), ([9, 10, []]), (), ((([[]]))), []], 11)
     flattened = breze.arch.util.flatten(nested)
@@ -3,9 +3,12 @@
 import numpy as np
 import scipy
 import nose.tools
+import theano
 
 from breze.learn.data import (
-    shuffle, padzeros, windowify, interpolate, skip, one_hot)
+    shuffle, padzeros, windowify, iter_windows, interpolate, skip, one_hot,
+    window_view, iter_window_batches, permute_many, shuffle_many,
+    iter_shuffled_minibatches, pad_sequences, iter_bucketed_minibatches)
 from breze.learn.utils import theano_floatx
 
 
@@ -25,6 +28,88 @@ def test_shuffle():
     assert after == before, "Shuffle mutated data."
 
 
+def test_permute_many():
+    """Test if blockwise permutation in place gives the permuted arrays."""
+    rng = np.random.RandomState(0)
+    X = rng.random_sample((23, 4))
+    Y = rng.random_sample((3, 23))
+    perm = rng.permutation(23)
+    X_, Y_ = X[perm], Y[:, perm]
+    for chunk_size in (1, 5, 23, None):
+        A, B = X.copy(), Y.copy()
+        permute_many([A, B], [0, 1], perm, chunk_size=chunk_size)
+        assert (A == X_).all() and (B == Y_).all()
+
+    A, B = X.copy(), X.copy()
+    shuffle_many([A, B], [0, 0], random_state=1, chunk_size=4)
+    assert (A == B).all()
+    assert sorted(A.tolist()) == sorted(X.tolist())
+
+
+def test_iter_shuffled_minibatches():
+    """Test if shuffled minibatches cover each sample once per pass."""
+    X = np.arange(10)[:, np.newaxis]
+    Z = np.arange(10)[np.newaxis, :]
+    batches = list(iter_shuffled_minibatches([X, Z], 3, [0, 1],
+                                             random_state=0, n_cycles=2))
+    assert len(batches) == 8
+    for x, z in batches:
+        assert (x[:, 0] == z[0]).all()
+    seen = np.concatenate([x[:, 0] for x, _ in batches[:4]])
+    assert sorted(seen) == range(10)
+
+
+def test_pad_sequences():
+    seqs = [np.ones((2, 3)), np.ones((4, 3))]
+    padded, mask = pad_sequences(seqs)
+    assert padded.shape == mask.shape == (4, 2, 3)
+    assert (padded == mask).all()
+    assert mask[:, 0, 0].tolist() == [1, 1, 0, 0]
+
+    _, mask = pad_sequences([np.ones((2, 1), dtype='int8')])
+    assert mask.dtype == theano.config.floatX
+
+
+def test_iter_bucketed_minibatches():
+    """Test if buckets hold sequences of similar length and masks average
+    over the sequence steps."""
+    rng = np.random.RandomState(0)
+    lengths = rng.randint(1, 20, size=17)
+    X = [np.ones((l, 2)) * l for l in lengths]
+    Z = [np.ones((l, 1)) * l for l in lengths]
+    batches = list(iter_bucketed_minibatches(X, Z, 4, random_state=1,
+                                             n_cycles=1))
+    assert len(batches) == 5
+
+    seen = []
+    for x, z, w in batches:
+        assert x.shape[:2] == z.shape[:2] == w.shape[:2]
+        assert w.shape == z.shape
+        seq_lengths = x[0, :, 0]
+        seen.extend(seq_lengths)
+        assert x.shape[0] == seq_lengths.max()
+        assert ((w > 0).sum(axis=0)[:, 0] == seq_lengths).all()
+        assert np.allclose(w.mean(), 1)
+        assert (z[w == 0] == 0).all()
+    assert sorted(seen) == sorted(lengths)
+
+    # Sorted by length, buckets are contiguous ranges of it.
+    ranges = sorted((x[0, :, 0].min(), x[0, :, 0].max()) for x, _, _ in batches)
+    for (_, hi), (lo, _) in zip(ranges[:-1], ranges[1:]):
+        assert hi <= lo
+
+
+def test_iter_bucketed_minibatches_int_targets():
+    """Test if masks of integer targets keep their fractional weights."""
+    X = [np.ones((l, 2)) for l in [1, 2, 3]]
+    Z = [np.zeros((l, 1), dtype='int64') for l in [1, 2, 3]]
+    (_, z, w), = iter_bucketed_minibatches(X, Z, 3, n_cycles=1)
+    assert z.dtype == np.int64
+    assert w.dtype == theano.config.floatX
+    assert np.allclose(w.mean(), 1)
+    assert np.allclose(w[:, 0, 0], [1.5, 0, 0])
+
+
 def test_padzeros():
     """Test if padding with zeros works fine."""
     seqs = [
@@ -85,6 +170,50 @@ def test_windowify_offset():
     assert (W == desired).all(), "result has wrong entries"
 
 
+def test_windowify_empty():
+    """Test if windowifying no sequences gives a clear error."""
+    try:
+        windowify([], 2)
+    except ValueError:
+        pass
+    else:
+        assert False, 'no error raised'
+
+
+def test_iter_windows():
+    """Test if iterated windows are writable views on the sequences."""
+    X = [np.arange(10.).reshape((5, 2)), np.arange(6.).reshape((3, 2))]
+    windows = list(iter_windows(X, 2, 2))
+    assert len(windows) == 3
+    assert (np.array(windows) == windowify(X, 2, 2)).all()
+    windows[0][...] = -1
+    assert (X[0][:2] == -1).all()
+
+
+def test_window_view():
+    """Test if windows are views on the sequence."""
+    x = np.arange(20.).reshape((10, 2))
+    W = window_view(x, 3, 2)
+    assert W.shape == (4, 3, 2), "result has wrong shape: %s" % str(W.shape)
+    assert np.may_share_memory(W, x)
+    assert (W[1] == x[2:5]).all()
+    assert window_view(x, 11).shape == (0, 11, 2)
+
+
+def test_iter_window_batches():
+    """Test if batches of windows cover all windows in order."""
+    X = [np.random.random((n, 3)) for n in (5, 9, 2, 7)]
+    W = windowify(X, 3, 2)
+    batches = list(iter_window_batches(X, 3, 2, batch_size=4))
+    assert [len(i) for i in batches] == [4, 4, 1]
+    assert all(np.may_share_memory(p, x)
+               for p, x in zip(batches[0].pieces, X))
+
+    out = np.empty((4, 3, 3))
+    assert (batches[1].materialize(out) == W[4:8]).all()
+    assert (np.concatenate([np.asarray(i) for i in batches]) == W).all()
+
+
 def test_interpolate():
     """Test if interpolation of sequential data works."""
     x = scipy.array([[0, 1, 2],
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+
+import climin.initialize
+import numpy as np
+
+from breze.learn.dataset import DiskArray, iter_chunks
+from breze.learn.mlp import Mlp
+from breze.learn.utils import theano_floatx
+
+
+def make_memmap(directory, name, arr):
+    filename = os.path.join(directory, name)
+    mm = np.memmap(filename, dtype=arr.dtype, mode='w+', shape=arr.shape)
+    mm[...] = arr
+    mm.flush()
+    del mm
+    return DiskArray.from_memmap(filename, arr.dtype, arr.shape, chunk_size=3)
+
+
+def test_iter_chunks():
+    X = np.arange(20).reshape((10, 2))
+    Z = np.arange(10).reshape((1, 10))
+    chunks = list(iter_chunks([DiskArray(X, chunk_size=4), Z], [0, 1]))
+    assert len(chunks) == 3
+    assert np.allclose(np.concatenate([x for x, _ in chunks]), X)
+    assert np.allclose(np.concatenate([z for _, z in chunks], axis=1), Z)
+
+
+def test_mlp_memmap():
+    X = np.random.standard_normal((10, 2))
+    Z = np.random.standard_normal((10, 1))
+    X, Z = theano_floatx(X, Z)
+
+    directory = tempfile.mkdtemp()
+    try:
+        X_disk = make_memmap(directory, 'X', X)
+        Z_disk = make_memmap(directory, 'Z', Z)
+
+        mlp = Mlp(2, [10], 1, ['tanh'], 'identity', 'squared', max_iter=5,
+                  batch_size=4)
+        climin.initialize.randomize_normal(mlp.parameters.data, 0, 1)
+        mlp.fit(X_disk, Z_disk)
+        assert mlp.prefetcher is None
+
+        assert np.allclose(mlp.predict(X_disk), mlp.predict(X))
+        assert np.allclose(mlp.score(X_disk, Z_disk), mlp.score(X, Z))
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_hdf5_close():
+    import h5py
+    X = np.arange(20).reshape((10, 2))
+
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, 'data.h5')
+        with h5py.File(filename, 'w') as f:
+            f['train/inpt'] = X
+
+        with DiskArray.from_hdf5(filename, 'train/inpt', chunk_size=4) as arr:
+            f = arr.file
+            assert np.allclose(arr[2:5], X[2:5])
+        assert arr.file is None
+        assert not f
+    finally:
+        shutil.rmtree(directory)
@@ -3,7 +3,11 @@
 import random
 
 import numpy as np
+import theano
 
+from breze.learn.base import (
+    memoize_fused, memoize_loss, prepare_array, unprepare_array,
+    cast_array_to_local_type, conversion_counts, reset_conversion_counts)
 from breze.learn.linear import Linear
 from breze.learn.utils import theano_floatx
 
@@ -48,3 +52,109 @@ def test_linear_predict_linear():
     glm = Linear(1, 1, max_iter=10)
     glm.fit(X, Z)
     glm.predict(X)
+
+
+def test_linear_fused_lbfgs():
+    X = np.arange(-2, 2, .01)[:, np.newaxis]
+    Z = np.sin(X)
+    X, Z = theano_floatx(X, Z)
+
+    glm = Linear(1, 1, max_iter=10, optimizer='lbfgs')
+    glm.fuse_loss = True
+    glm.fit(X, Z)
+
+
+def test_memoize_fused():
+    calls = []
+
+    def f_loss_dloss(pars, x):
+        calls.append(1)
+        return (pars ** 2).sum() * x, 2 * pars * x
+
+    f, fprime = memoize_fused(f_loss_dloss)
+    pars = np.ones(3)
+    x = 2.
+
+    assert f(pars, x) == 6
+    assert np.allclose(fprime(pars, x), 4)
+    assert len(calls) == 1, 'fused function evaluated twice'
+
+    # A second gradient at the same point is a fresh copy.
+    assert fprime(pars, x) is not fprime(pars, x)
+    assert len(calls) == 1
+
+    pars += 1
+    assert f(pars, x) == 24
+    assert len(calls) == 2, 'change of parameters not detected'
+
+
+def test_memoize_loss():
+    calls = []
+
+    def f_loss(pars, x):
+        calls.append('loss')
+        return (pars ** 2).sum() * x
+
+    def f_d_loss(pars, x):
+        calls.append('d_loss')
+        return 2 * pars * x
+
+    f, fprime = memoize_loss(f_loss, f_d_loss)
+    pars = np.ones(3)
+    x = 2.
+
+    for _ in range(2):
+        assert f(pars, x) == 6
+        assert np.allclose(fprime(pars, x), 4)
+    assert calls == ['loss', 'd_loss'], 'unfused functions evaluated twice'
+
+    pars += 1
+    assert np.allclose(fprime(pars, x), 8)
+    assert calls == ['loss', 'd_loss', 'd_loss']
+
+
+def test_linear_lbfgs_unfused():
+    X = np.arange(-2, 2, .01)[:, np.newaxis]
+    Z = np.sin(X)
+    X, Z = theano_floatx(X, Z)
+
+    glm = Linear(1, 1, max_iter=10, optimizer='lbfgs')
+    glm.fuse_loss = False
+    glm.fit(X, Z)
+
+
+def test_prepare_array():
+    other = 'float32' if theano.config.floatX == 'float64' else 'float64'
+    X = np.arange(-2, 2, .01)[:, np.newaxis].astype(other)
+    Z = np.sin(X)
+
+    glm = Linear(1, 1, max_iter=10, batch_size=50)
+    reset_conversion_counts()
+    glm.fit(X, Z)
+    assert sum(conversion_counts().values()) >= 10, 'conversions not counted'
+
+    X_prepared = prepare_array(X)
+    prepare_array(Z)
+    assert X_prepared.dtype == theano.config.floatX
+    assert X_prepared.flags.c_contiguous
+    assert prepare_array(X) is X_prepared, 'prepared array not cached'
+
+    reset_conversion_counts()
+    glm.fit(X, Z)
+    glm.score(X, Z)
+    assert not conversion_counts(), 'prepared arrays converted again'
+
+
+def test_prepare_array_modified():
+    other = 'float32' if theano.config.floatX == 'float64' else 'float64'
+    X = np.zeros((4, 1), dtype=other)
+    X_prepared = prepare_array(X)
+
+    # The prepared array is a copy that does not see changes to the original.
+    X[...] = 1
+    assert cast_array_to_local_type(X) is X_prepared
+    assert (X_prepared == 0).all()
+
+    unprepare_array(X)
+    assert (cast_array_to_local_type(X) == 1).all()
+    assert prepare_array(X) is not X_prepared
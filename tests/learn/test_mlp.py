@@ -137,3 +137,101 @@ def test_fd_predict():
     mlp = FastDropoutNetwork(
         2, [10], 1, ['rectifier'], 'identity', loss, max_iter=10)
     mlp.predict(X)
+
+
+def test_mlp_fused_loss():
+    X = np.random.standard_normal((10, 2))
+    Z = np.random.standard_normal((10, 1))
+    X, Z = theano_floatx(X, Z)
+
+    mlp = Mlp(2, [10], 1, ['tanh'], 'identity', 'squared', max_iter=10)
+    climin.initialize.randomize_normal(mlp.parameters.data, 0, 1)
+    mlp.fuse_loss = False
+    f_loss, f_dloss = mlp._make_loss_functions()
+    f_score = mlp._make_score_function()
+
+    mlp.fuse_loss = True
+    f_loss_fused, f_dloss_fused = mlp._make_loss_functions()
+    assert f_loss_fused.fused is f_dloss_fused.fused
+
+    pars = mlp.parameters.data
+    assert np.allclose(f_loss(pars, X, Z), f_loss_fused(pars, X, Z))
+    assert np.allclose(f_dloss(pars, X, Z), f_dloss_fused(pars, X, Z))
+
+    # Scoring uses the fused function of training instead of its own.
+    mlp._f_loss = mlp._f_dloss = None
+    assert np.allclose(mlp.score(X, Z), f_score(X, Z))
+    assert mlp._f_loss is not None
+
+    mlp.fit(X, Z)
+    cPickle.dumps(mlp)
+
+
+def test_mlp_fit_prefetch():
+    X = np.random.standard_normal((10, 2))
+    Z = np.random.standard_normal((10, 1))
+    W = np.random.random((10, 1)) > 0.5
+    X, Z, W = theano_floatx(X, Z, W)
+
+    mlp = Mlp(2, [10], 1, ['tanh'], 'identity', 'squared', max_iter=10,
+              batch_size=3, imp_weight=True)
+    mlp.n_prefetch_workers = 2
+    itr = mlp.iter_fit(X, Z, W)
+    for i, info in enumerate(itr):
+        if i + 1 >= 10:
+            break
+    assert mlp.prefetcher.n_batches >= 10
+    cPickle.dumps(mlp)
+
+    itr.close()
+    assert mlp.prefetcher is None
+
+    mlp.fit(X, Z, W)
+    assert mlp.prefetcher is None
+
+
+def test_mlp_predict_batchwise():
+    X = np.random.standard_normal((10, 2))
+    X, = theano_floatx(X)
+
+    mlp = Mlp(2, [10], 1, ['tanh'], 'identity', 'squared')
+    climin.initialize.randomize_normal(mlp.parameters.data, 0, 1)
+    Y = mlp.predict(X)
+
+    assert np.allclose(mlp.predict(X, batch_size=3), Y)
+
+    out = np.empty((10, 1), dtype=Y.dtype)
+    mlp.n_predict_workers = 2
+    assert mlp.predict(X, batch_size=4, out=out) is out
+    assert np.allclose(out, Y)
+
+    mlp.n_predict_workers = 0
+    mlp.predict_max_memory = 100
+    assert np.allclose(mlp.predict(X), Y)
+
+
+def test_mlp_quantize():
+    X = np.random.standard_normal((10, 2))
+    X, = theano_floatx(X)
+
+    mlp = Mlp(2, [10], 1, ['tanh'], 'identity', 'squared')
+    climin.initialize.randomize_normal(mlp.parameters.data, 0, 1)
+    Y = mlp.predict(X)
+
+    mlp.quantize('float16')
+    try:
+        mlp.parameters.data
+    except ValueError:
+        pass
+    else:
+        assert False, 'quantized parameters should not be accessible'
+    assert np.allclose(mlp.predict(X), Y, atol=1e-2)
+
+    mlp.dequantize()
+    mlp.quantize('int8')
+    assert mlp.parameters.quantized.dtype == np.int8
+    assert np.allclose(mlp.predict(X), Y, atol=.2)
+    cPickle.loads(cPickle.dumps(mlp))
+
+    mlp.dequantize()
+    assert mlp.parameters.data.dtype == Y.dtype
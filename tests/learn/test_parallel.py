@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import climin.initialize
+import numpy as np
+
+from breze.learn.mlp import Mlp
+from breze.learn.parallel import GradientPool, split_batch
+from breze.learn.utils import theano_floatx
+
+
+def test_split_batch():
+    X = np.arange(14).reshape((7, 2))
+    Z = np.arange(7).reshape((1, 7))
+    shards = split_batch((X, Z), [0, 1], 3)
+    assert [len(x) for x, _ in shards] == [2, 2, 3]
+    assert np.allclose(np.concatenate([z for _, z in shards], axis=1), Z)
+
+    assert len(split_batch((X, Z), [0, 1], 10)) == 7
+
+
+def test_gradient_pool():
+    X = np.random.standard_normal((11, 2))
+    Z = np.random.standard_normal((11, 1))
+    X, Z = theano_floatx(X, Z)
+
+    mlp = Mlp(2, [10], 1, ['tanh'], 'identity', 'squared')
+    climin.initialize.randomize_normal(mlp.parameters.data, 0, 1)
+    f_loss, f_dloss = mlp._make_loss_functions()
+
+    pool = GradientPool(f_loss, f_dloss, mlp.parameters.data.size, [0, 0], 3)
+    try:
+        pars = mlp.parameters.data
+        assert np.allclose(pool.f(pars, X, Z), f_loss(pars, X, Z))
+        assert np.allclose(pool.fprime(pars, X, Z), f_dloss(pars, X, Z))
+    finally:
+        pool.close()
+
+
+def test_gradient_pool_shared_pars():
+    X = np.random.standard_normal((11, 2))
+    Z = np.random.standard_normal((11, 1))
+    X, Z = theano_floatx(X, Z)
+
+    mlp = Mlp(2, [10], 1, ['tanh'], 'identity', 'squared')
+    mlp.parameters.relocate('shared')
+    climin.initialize.randomize_normal(mlp.parameters.data, 0, 1)
+    f_loss, f_dloss = mlp._make_loss_functions()
+
+    pars = mlp.parameters.data
+    pool = GradientPool(f_loss, f_dloss, pars, [0, 0], 3)
+    try:
+        assert pool.pars is pars
+        # Changes are seen by the workers without passing the parameters.
+        pars *= 2
+        assert np.allclose(pool.f(pars, X, Z), f_loss(pars, X, Z))
+        assert np.allclose(pool.fprime(pars, X, Z), f_dloss(pars, X, Z))
+
+        # Other parameters are written to the shared buffer.
+        other = pars / 2
+        assert np.allclose(pool.f(other, X, Z), f_loss(other, X, Z))
+        assert np.allclose(pars, other)
+    finally:
+        pool.close()
+
+
+def test_mlp_fit_parallel():
+    X = np.random.standard_normal((10, 2))
+    Z = np.random.standard_normal((10, 1))
+    X, Z = theano_floatx(X, Z)
+
+    mlp = Mlp(2, [10], 1, ['tanh'], 'identity', 'squared', max_iter=10,
+              batch_size=4)
+    climin.initialize.randomize_normal(mlp.parameters.data, 0, 1)
+    mlp.n_grad_workers = 2
+    mlp.fit(X, Z)
+    assert mlp.grad_pool is None, 'worker processes not stopped'
+    assert mlp.parameters.storage == 'shared'
+    assert np.isfinite(mlp.score(X, Z))
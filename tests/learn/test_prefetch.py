@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from breze.learn.prefetch import Prefetcher
+
+
+def test_prefetcher_covers_data():
+    X = np.arange(20).reshape((10, 2))
+    Z = np.arange(10)[:, np.newaxis]
+
+    for shuffle in False, True:
+        for n_workers in 1, 3:
+            p = Prefetcher([X, Z], 3, [0, 0], n_workers=n_workers,
+                           shuffle=shuffle, n_cycles=1)
+            batches = list(p)
+            assert len(batches) == 4
+            assert sorted(np.concatenate([z for _, z in batches]).ravel()) \
+                == range(10)
+            for x, z in batches:
+                assert np.allclose(x[:, 0], 2 * z[:, 0])
+            assert p.n_batches == 4
+
+
+def test_prefetcher_order_independent_of_workers():
+    X = np.arange(100)[:, np.newaxis]
+    first = Prefetcher([X], 7, [0], n_workers=1, shuffle=True,
+                       random_state=np.random.RandomState(1))
+    second = Prefetcher([X], 7, [0], n_workers=4, shuffle=True,
+                        random_state=np.random.RandomState(1))
+    for _ in range(50):
+        assert np.allclose(first.next()[0], second.next()[0])
+    first.close()
+    second.close()
+
+
+def test_prefetcher_sample_dim():
+    X = np.arange(30).reshape((3, 10, 1))
+    p = Prefetcher([X], 5, [1], transform=lambda x: x.astype('float32'),
+                   n_cycles=1)
+    for x, in p:
+        assert x.shape == (3, 5, 1)
+        assert x.dtype == np.float32
+
+
+def test_prefetcher_propagates_errors():
+    X = np.arange(10)
+
+    def fail(x):
+        raise RuntimeError('failed')
+
+    p = Prefetcher([X], 5, [0], transform=fail)
+    try:
+        p.next()
+    except RuntimeError:
+        pass
+    else:
+        assert False, 'error not propagated'
+
+
+def test_prefetcher_closed():
+    X = np.arange(10)
+    p = Prefetcher([X], 5, [0])
+    p.next()
+    p.close()
+    assert list(p) == [], 'closed prefetcher still yields'
+
+
+def test_prefetcher_feeder_died():
+    class Broken(Prefetcher):
+        def iter_indices(self):
+            raise ValueError('no indices')
+            yield
+
+    p = Broken([np.arange(10)], 5, [0])
+    p.poll_interval = .01
+    try:
+        p.next()
+    except RuntimeError:
+        pass
+    else:
+        assert False, 'dead feeder not detected'
+    p.close()
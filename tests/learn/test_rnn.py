@@ -7,7 +7,7 @@ import theano
 import theano.tensor as T
 
 from theano.gradient import jacobian
-from nose.tools import with_setup
+from nose.tools import assert_raises, with_setup
 
 from breze.arch.construct.layer.varprop.sequential import FDRecurrent
 from breze.arch.construct.layer.varprop.simple import AffineNonlinear
@@ -36,6 +36,57 @@ def test_srnn_fit():
     rnn.fit(X, Z, W)
 
 
+def test_srnn_fit_sequences():
+    lengths = [3, 7, 4, 10, 2, 6]
+    X = theano_floatx(*[np.random.standard_normal((l, 2)) for l in lengths])
+    Z = theano_floatx(*[np.random.standard_normal((l, 3)) for l in lengths])
+
+    rnn = SupervisedRnn(2, [10], 3, hidden_transfers=['tanh'], max_iter=4,
+                        batch_size=2, imp_weight=True)
+    rnn.fit(X, Z)
+    rnn.fit(X, Z, [np.ones_like(z) for z in Z])
+
+    rnn = SupervisedRnn(2, [10], 3, hidden_transfers=['tanh'], max_iter=4,
+                        batch_size=2)
+    try:
+        rnn.fit(X, Z)
+    except ValueError:
+        pass
+    else:
+        assert False, 'sequences without imp_weight did not raise'
+
+
+def test_srnn_tbptt():
+    X = np.random.standard_normal((10, 5, 2)).astype(theano.config.floatX)
+    Z = np.random.standard_normal((10, 5, 3)).astype(theano.config.floatX)
+    X, Z = theano_floatx(X, Z)
+
+    for transfer in 'tanh', 'lstm':
+        rnn = SupervisedRnn(2, [4], 3, hidden_transfers=[transfer],
+                            max_iter=3, tbptt_steps=4)
+        rnn.parameters.data[...] = np.random.standard_normal(
+            rnn.parameters.data.shape) * .5
+
+        # Carrying the state over chunks gives the loss of whole sequences.
+        f_loss, _ = rnn._make_loss_functions()
+        args = rnn._iter_tbptt_args(X, Z)
+        total = 0
+        for _ in range(3):
+            a, _ = next(args)
+            total += f_loss(rnn.parameters.data, *a) * a[0].shape[0]
+            # Trial evaluations, e.g. of a line search, leave the carry alone.
+            f_loss(rnn.parameters.data * 2, *a)
+        assert np.allclose(total / X.shape[0], rnn.score(X, Z))
+
+        # The carry is taken from the loss function, so the next chunk is
+        # only available after an evaluation.
+        args = rnn._iter_tbptt_args(X, Z)
+        next(args)
+        assert_raises(RuntimeError, next, args)
+
+        rnn.fit(X, Z)
+
+
 @with_setup(*use_test_values('raise'))
 def test_srnn_lstm_fit():
     X = np.random.standard_normal((13, 5, 4)).astype(theano.config.floatX)
@@ -191,6 +242,32 @@ def test_fd_srnn_predict():
     assert Y.shape[2] == 6
 
 
+def test_streaming_predictor():
+    X = np.random.standard_normal((6, 4, 2)).astype(theano.config.floatX)
+    X, = theano_floatx(X)
+
+    models = [
+        SupervisedRnn(2, [5], 3, hidden_transfers=['tanh']),
+        SupervisedRnn(2, [5, 4], 3, hidden_transfers=['lstm', 'gru']),
+        SupervisedFastDropoutRnn(2, [5], 3, hidden_transfers=['lstm'])]
+    for rnn in models:
+        rnn.parameters.data[...] = np.random.standard_normal(
+            rnn.parameters.data.shape) * .5
+        Y = rnn.predict(X)
+
+        predictor = rnn.streaming_predictor(n_streams=4)
+        Y_stream = np.array([predictor.step(x) for x in X])
+        assert np.allclose(Y, Y_stream)
+
+        # Streams can be advanced separately and restarted.
+        predictor.reset()
+        Y_first = predictor.advance(X[:3, :2], streams=[0, 1])
+        Y_rest = predictor.advance(X[:, 2:], streams=[2, 3])
+        assert np.allclose(Y[:3, :2], Y_first)
+        assert np.allclose(Y[:, 2:], Y_rest)
+        assert np.allclose(Y[3:, :2], predictor.advance(X[3:, :2], [0, 1]))
+
+
 def test_gn_product_rnn():
     raise SkipTest()
     np.random.seed(1010)
@@ -5,8 +5,10 @@ import copy
 import numpy as np
 
 from nose.tools import with_setup
+from scipy.misc import logsumexp
 
 from breze.learn import sgvb
+from breze.learn.sgvb.base import estimate_nll_batched
 from breze.learn.utils import theano_floatx
 from breze.utils.testhelpers import use_test_values
 
@@ -39,6 +41,49 @@ def test_vae():
     m.estimate_nll(X[:2], 2)
 
 
+def test_vae_estimate_nll():
+    X = (np.random.random((20, 10)) > .5) * 1.
+    X, = theano_floatx(X)
+
+    m = MyVAE(
+        10, [20], 4, [15],
+        ['tanh'], ['rectifier'],
+        optimizer='rprop', batch_size=None,
+        max_iter=3)
+    m.parameters.data[...] = np.random.standard_normal(
+        m.parameters.data.shape) * .1
+
+    # Importance sampling does not do worse than the variational bound.
+    nll = m.estimate_nll(X, 200)
+    assert nll <= m.score(X) + .1
+
+    # Drawing the samples in batches estimates the same.
+    nll_batched = m.estimate_nll(X, 200, batch_size=3, sample_batch_size=7)
+    assert abs(nll - nll_batched) < .5
+
+
+def test_estimate_nll_batched():
+    rng = np.random.RandomState(0)
+    n_points, n_samples = 7, 10
+    D = rng.standard_normal((n_samples, n_points))
+    X = np.arange(n_points, dtype='float64')[:, np.newaxis]
+    expected = -(logsumexp(D.sum(axis=1)) - np.log(n_samples)) / n_points
+
+    drawn = [0]
+
+    def f_log_weights(chunk, k):
+        idxs = chunk[:, 0].astype('int64')
+        rows = D[drawn[0]:drawn[0] + k][:, idxs].sum(axis=1)
+        if idxs[-1] == n_points - 1:
+            drawn[0] += k
+        return rows
+
+    nll = estimate_nll_batched(X, f_log_weights, n_samples, batch_size=3,
+                               sample_batch_size=4)
+    assert drawn[0] == n_samples
+    assert np.allclose(nll, expected)
+
+
 @with_setup(*use_test_values('raise'))
 def test_vae_imp_weight():
     X = np.random.random((2, 10))
@@ -107,6 +152,54 @@ def test_storn_sampling():
     m.sample(5, visible_map=True, prefix=X[:, :1, :])
 
 
+def test_storn_sampling_incremental():
+    X = np.random.random((3, 2, 2))
+    X, = theano_floatx(X)
+
+    m = MyStorn(
+        2, [5], 3, [4, 3],
+        ['tanh'], ['rectifier', 'lstm'],
+        optimizer='rprop', batch_size=None,
+        max_iter=3)
+    m.parameters.data[...] = np.random.standard_normal(
+        m.parameters.data.shape) * .3
+
+    np.random.seed(0)
+    S = m.sample(4, visible_map=True, prefix=X)
+    assert S.shape == (3, 2, 2)
+
+    # Running the generating network over the whole sequence at each time
+    # step gives the same.
+    np.random.seed(0)
+    latents = np.zeros((7, 2, 3))
+    latents[3:] = np.random.standard_normal((4, 2, 3))
+    latents, = theano_floatx(latents)
+    R = np.concatenate([X, np.zeros((4, 2, 2))]).astype(X.dtype)
+    for i in range(3, 7):
+        carry = m._f_gen_initial(R[:1], latents[:1])
+        out = m._f_gen_step(R[:i], latents[:i], *carry)[0]
+        R[i] = m._f_visible_map(out)[-1, :, :2]
+    assert np.allclose(S, R[4:])
+
+    S = m.sample(3, prefix=X, n_paths=4)
+    assert S.shape == (2, 8, 2)
+
+
+def test_storn_estimate_nll():
+    X = np.random.random((3, 5, 2))
+    X, = theano_floatx(X)
+
+    m = MyStorn(
+        2, [5], 3, [5],
+        ['tanh'], ['rectifier'],
+        optimizer='rprop', batch_size=None,
+        max_iter=3)
+    m.initialize(par_std=.1)
+
+    nll = m.estimate_nll(X, 50, batch_size=2, sample_batch_size=16)
+    assert np.isfinite(nll)
+
+
 def test_storn_copy():
     X = np.random.random((3, 5, 2))
     X, = theano_floatx(X)
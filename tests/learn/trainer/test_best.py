@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import cPickle
+import os
+import tempfile
+
+import numpy as np
+
+import climin.initialize
+import climin.stops
+
+from breze.learn import mlp
+from breze.learn.trainer.best import BestParameters
+from breze.learn.trainer.trainer import Trainer
+from breze.learn.utils import theano_floatx
+
+
+def test_best_parameters():
+    best = BestParameters()
+    assert not best
+
+    pars = np.random.random(10)
+    assert best.update(1., pars, 1)
+    buf = best.data
+    pars += 1
+    assert not best.update(2., pars, 2)
+    assert best.update(0.5, pars, 3)
+
+    # The buffer is reused.
+    assert best.data is buf
+    assert np.allclose(best, pars)
+    assert best.loss == 0.5 and best.n_iter == 3 and best.n_updates == 2
+
+    target = np.zeros(10)
+    target[...] = best
+    assert np.allclose(target, pars)
+
+    loaded = cPickle.loads(cPickle.dumps(best))
+    assert np.allclose(loaded.data, pars)
+
+
+def test_best_parameters_memmap():
+    fd, fn = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        best = BestParameters(fn)
+        pars = np.random.random(10)
+        best.update(1., pars)
+        assert isinstance(best.data, np.memmap)
+
+        loaded = cPickle.loads(cPickle.dumps(best))
+        assert isinstance(loaded.data, np.memmap)
+        assert np.allclose(loaded.data, pars)
+        del best, loaded
+    finally:
+        os.remove(fn)
+
+
+def test_trainer_best_pars():
+    X, Z = theano_floatx(np.random.random((20, 3)), np.random.random((20, 1)))
+    m = mlp.Mlp(3, [4], 1, ['tanh'], 'identity', 'squared', max_iter=10)
+    climin.initialize.randomize_normal(m.parameters.data, 0, 0.1)
+    t = Trainer(m, data={'train': (X, Z), 'val': (X, Z)},
+                stop=climin.stops.AfterNIterations(2),
+                report=lambda info: None)
+    t.val_key = 'val'
+    for info in t.iter_fit(X, Z):
+        assert isinstance(info['best_pars'], np.ndarray)
+        assert info['best_pars'] is t.best.data
+
+    pars = np.zeros_like(m.parameters.data)
+    t.best_pars = pars
+    t.best_loss = 3.
+    assert np.allclose(t.best.data, 0) and t.best.data is not pars
+    assert t.best.loss == 3.
+
+
+def test_powerfit_best_pars():
+    X, Z = theano_floatx(np.random.random((20, 3)), np.random.random((20, 1)))
+    m = mlp.Mlp(3, [4], 1, ['tanh'], 'identity', 'squared', max_iter=10)
+    climin.initialize.randomize_normal(m.parameters.data, 0, 0.1)
+    infos = list(m.powerfit((X, Z), (X, Z), climin.stops.AfterNIterations(3),
+                            lambda info: True))
+    assert all(isinstance(i['best_pars'], np.ndarray) for i in infos)
+    assert all(i['best_pars'] is infos[0]['best_pars'] for i in infos)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import climin.initialize
+import climin.stops
+
+from breze.learn import mlp
+from breze.learn.trainer.checkpoint import Checkpointer
+from breze.learn.trainer.trainer import Trainer
+from breze.learn.utils import theano_floatx
+
+
+def no_report(info):
+    pass
+
+
+def make_trainer(X, Z, n_iter, checkpointer=None, best_storage=None,
+                 report=no_report):
+    m = mlp.Mlp(10, [10], 2, ['tanh'], 'identity', 'squared',
+                optimizer=('rmsprop', {'step_rate': 1e-3}))
+    climin.initialize.randomize_normal(m.parameters.data, 0, 0.1,
+                                       random_state=np.random.RandomState(0))
+    t = Trainer(
+        m, data={'train': (X, Z), 'val': (X, Z)},
+        stop=climin.stops.AfterNIterations(n_iter),
+        pause=climin.stops.ModuloNIterations(2),
+        report=report,
+        checkpointer=checkpointer,
+        best_storage=best_storage)
+    t.val_key = 'val'
+    return t
+
+
+def test_checkpoint_resume():
+    X = np.random.random((50, 10))
+    Z = np.random.random((50, 2))
+    X, Z = theano_floatx(X, Z)
+
+    directory = tempfile.mkdtemp()
+    try:
+        reference = make_trainer(X, Z, 8)
+        reference.fit()
+
+        checkpointer = Checkpointer(directory, every_n_iter=3, keep=2)
+        t = make_trainer(X, Z, 4, checkpointer)
+        t.fit()
+        paths = checkpointer.checkpoints()
+        assert len(paths) == 2
+        assert paths[-1] == checkpointer.path(4)
+        checkpointer.close()
+
+        t = make_trainer(X, Z, 8, Checkpointer(directory, every_n_iter=3))
+        info = t.checkpointer.restore(t)
+        assert info['n_iter'] == 4
+        assert len(t.infos) == 2
+        t.fit()
+
+        assert t.infos[-1]['n_iter'] == 8
+        assert np.allclose(t.model.parameters.data,
+                           reference.model.parameters.data)
+        assert np.allclose(t.best_loss, reference.best_loss)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_checkpoint_restore_best_storage():
+    X = np.random.random((50, 10))
+    Z = np.random.random((50, 2))
+    X, Z = theano_floatx(X, Z)
+
+    directory = tempfile.mkdtemp()
+    try:
+        best_storage = os.path.join(directory, 'best')
+        bests = {}
+
+        def report(info):
+            bests[info['n_iter']] = t.best.copy(), t.best.loss
+
+        checkpointer = Checkpointer(directory, every_n_iter=2, keep=3)
+        t = make_trainer(X, Z, 6, checkpointer, best_storage, report)
+        t.fit()
+        checkpointer.close()
+        assert not np.allclose(bests[2][0], bests[6][0])
+
+        # The best parameters in the file have changed since the first
+        # checkpoint, which must restore its own.
+        restored = make_trainer(X, Z, 6, best_storage=best_storage)
+        checkpointer.restore(restored, checkpointer.path(2))
+        assert np.allclose(restored.best_pars, bests[2][0])
+        assert restored.best_loss == bests[2][1]
+        assert restored.best.n_iter == 2
+        assert isinstance(restored.best.data, np.memmap)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_checkpoint_pickles_infos_once():
+    X = np.random.random((50, 10))
+    Z = np.random.random((50, 2))
+    X, Z = theano_floatx(X, Z)
+
+    directory = tempfile.mkdtemp()
+    try:
+        checkpointer = Checkpointer(directory, every_n_iter=2, keep=3)
+        t = make_trainer(X, Z, 6, checkpointer)
+        t.fit()
+        checkpointer.close()
+        assert len(checkpointer._pickled_infos) == len(t.infos) == 3
+
+        for path, n_infos in zip(checkpointer.checkpoints(), [1, 2, 3]):
+            _, _, bookkeeping = Checkpointer.load(path)
+            infos = bookkeeping['infos']
+            assert len(infos) == n_infos
+            assert [i['n_iter'] for i in infos] == \
+                [i['n_iter'] for i in t.infos[:n_infos]]
+    finally:
+        shutil.rmtree(directory)
@@ -1,5 +1,51 @@
 # -*- coding: utf-8 -*-
 import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
 from breze.learn.trainer.trainer import Trainer
 from breze.learn.utils import theano_floatx
 from breze.learn.trainer.score import MinibatchScore
+from breze.learn.trainer.report import MetricsRecorder
+
+
+def test_metrics_recorder():
+    directory = tempfile.mkdtemp()
+    try:
+        infos = [{'n_iter': i, 'loss': 1. / (i + 1), 'name': 'x',
+                  'step': np.zeros(3)}
+                 for i in range(10)]
+        infos[3].pop('loss')
+
+        for fmt in MetricsRecorder.formats:
+            path = os.path.join(directory, 'metrics.' + fmt)
+            recorder = MetricsRecorder(path, capacity=4)
+            for info in infos:
+                recorder(info)
+            recorder.close()
+            assert recorder.keys == ['loss', 'n_iter']
+            assert recorder.n_rows == 10
+
+            if fmt == 'csv':
+                with open(path) as fp:
+                    assert fp.readline().strip() == 'loss,n_iter'
+                loss, n_iter = np.loadtxt(path, delimiter=',', skiprows=1).T
+            elif fmt == 'jsonl':
+                with open(path) as fp:
+                    rows = [json.loads(line) for line in fp]
+                loss = np.array([np.nan if r['loss'] is None else r['loss']
+                                 for r in rows])
+                n_iter = np.array([r['n_iter'] for r in rows])
+            else:
+                assert len(recorder.parts()) == 3, 'one part per flush'
+                metrics = MetricsRecorder.load_npz(path)
+                loss, n_iter = metrics['loss'], metrics['n_iter']
+
+            assert np.allclose(n_iter, range(10))
+            assert np.isnan(loss[3])
+            assert np.allclose(loss[4:], [1. / (i + 1) for i in range(4, 10)])
+    finally:
+        shutil.rmtree(directory)
@@ -2,14 +2,16 @@
 import cPickle
 import copy
 import os
+import threading
 
 import numpy as np
+import climin.initialize
 import climin.stops
 
 from breze.learn import mlp
 from breze.learn.trainer.trainer import Trainer
 from breze.learn.utils import theano_floatx
-from breze.learn.trainer.score import MinibatchScore
+from breze.learn.trainer.score import MinibatchScore, ParallelScore
 
 
 def check_infos(info1, info2):
@@ -54,6 +56,21 @@ def test_minibatch_score_trainer():
         break
 
 
+def test_minibatch_score_in_memory():
+    X = np.arange(10.).reshape((10, 1))
+    batch_sizes = []
+
+    def f_score(X):
+        batch_sizes.append(X.shape[0])
+        return X.mean()
+
+    n_threads = threading.active_count()
+    score = MinibatchScore(3, [0])(f_score, X)
+    assert np.allclose(score, X.mean())
+    assert batch_sizes == [3, 3, 3, 1], 'data should be scored once in order'
+    assert threading.active_count() == n_threads
+
+
 def test_checkpoint_trainer():
     # Make model and data for the test.
     X = np.random.random((100, 10))
@@ -130,3 +147,95 @@ def test_training_continuation():
         os.kill(os.getpid(), stopper.sig)
 
     assert info['n_iter'] == 1
+
+
+def no_report(info):
+    pass
+
+
+def test_async_score_trainer():
+    X = np.random.random((100, 10))
+    Z = np.random.random((100, 2))
+    X, Z = theano_floatx(X, Z)
+
+    m = mlp.Mlp(10, [10], 2, ['tanh'], 'identity', 'squared', max_iter=10)
+    t = Trainer(
+        m, data={'train': (X, Z), 'val': (X, Z)},
+        stop=climin.stops.AfterNIterations(5),
+        pause=climin.stops.always,
+        report=no_report,
+        async_score=True)
+    t.val_key = 'val'
+    t.eval_keys = ['train']
+    t.fit()
+
+    assert np.isfinite(t.best_loss)
+    assert t.best_pars is not None
+    assert all('val_loss_n_iter' in i for i in t.infos)
+    assert all('train_loss' in i for i in t.infos)
+
+    # The reported best loss is that of the best parameters.
+    m.parameters.data[...] = t.best_pars
+    assert np.allclose(t.best_loss, m.score(X, Z))
+
+    cPickle.dumps(t)
+
+    # Once a score has arrived, the next pause reports all scored data sets.
+    for i, info in enumerate(t.iter_fit(X, Z)):
+        if i == 1:
+            break
+        t.wait_for_score()
+    assert np.isfinite(info['train_loss'])
+    assert info['train_loss'] == info['val_loss']
+
+
+def test_parallel_score_trainer():
+    X = np.random.random((100, 10))
+    Z = np.random.random((100, 2))
+    X, Z = theano_floatx(X, Z)
+    VX, VZ = X[:60], Z[:60]
+
+    m = mlp.Mlp(10, [10], 2, ['tanh'], 'identity', 'squared', max_iter=10)
+    climin.initialize.randomize_normal(m.parameters.data, 0, 0.1)
+    score = ParallelScore(7, [0, 0], n_workers=2)
+    t = Trainer(
+        m, data={'train': (X, Z), 'val': (VX, VZ)},
+        stop=climin.stops.AfterNIterations(3),
+        pause=climin.stops.always,
+        score=score,
+        report=no_report)
+    t.val_key = 'val'
+    t.eval_keys = ['train']
+    t.fit()
+
+    info = t.current_info
+    assert np.allclose(info['val_loss'], m.score(VX, VZ))
+    assert np.allclose(info['train_loss'], m.score(X, Z))
+    assert score.stats['train']['n_samples'] == 100
+
+    # A subsample estimate has a confidence interval around the full loss.
+    score = ParallelScore(5, [0, 0], subsample=0.5,
+                          random_state=np.random.RandomState(1), z=10)
+    stats = score.score_many(m.score, {'train': (X, Z)})['train']
+    assert stats['n_samples'] == 50
+    lower, upper = stats['ci']
+    assert lower <= m.score(X, Z) <= upper
+
+
+def test_parallel_score_dead_worker():
+    X = np.random.random((20, 2))
+    parent = os.getpid()
+
+    def f_score(X):
+        if os.getpid() != parent:
+            os._exit(3)
+        return X.mean()
+
+    score = ParallelScore(5, [0], n_workers=2)
+    score.poll_interval = .1
+    try:
+        score(f_score, X)
+    except RuntimeError as e:
+        assert 'exit code 3' in str(e)
+    else:
+        assert False, 'dead worker not detected'